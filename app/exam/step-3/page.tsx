@@ -144,7 +144,7 @@ export default function Step3Page() {
         recognizedExamCode: student.testVariant || 'N/A',
         score: student.score || 0,
         status: student.has_issue ? "warning" : (student.score > 0 ? "success" : "error"),
-        imageUrl: `http://localhost:5000/api/images/${student.image}` || "/placeholder.svg",
+        imageUrl: `http://localhost:5000/api/images/${student.image}?size=medium` || "/placeholder.svg",
         name: student.name || 'N/A',
         indexStudent: student.index_student || 'N/A',
         answers: student.answers || [],
@@ -1,26 +1,41 @@
-from fastapi import APIRouter, UploadFile, File, Request
+from fastapi import APIRouter, UploadFile, File, Request, Query, BackgroundTasks
 from fastapi.responses import JSONResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import os
+import uuid
+from urllib.parse import quote
 import pandas as pd
-from typing import List
+from typing import List, Optional
 import logging
-import json
 
 # Import image processing functions
-from utils.image_processing import image_processing
-from utils.detectCodeBox import detect_code_box
-from utils.detectInfo import detect_name_student, detect_id_student, detect_index_student
-from utils.detectGrade import predict_grade
-from utils.automatic_exam_grading import calculate_score
-from utils.student_validation import validate_and_correct_student_info
-from utils.processing_result_file import process_df_student
-
-def normalize_path(path):
-    """Normalize path separators to forward slashes for web compatibility"""
-    return path.replace("\\", "/")
-
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO)
+from utils.processing_result_file import load_answer_key_artifact, load_student_artifact
+from utils.artifact_cache import content_sha256
+from utils.executor import run_blocking
+from utils.upload_storage import (
+    save_uploads_concurrently, save_upload_stream, UploadBudget, UploadTooLarge, MAX_UPLOAD_REQUEST_BYTES
+)
+from utils.grading_pipeline import (
+    GradingInputError, load_grading_context, grade_sheet, summarize_results, normalize_path
+)
+from utils.ingest_session import create_session, get_session, SessionFinalized
+from utils.image_normalization import create_working_copy, resolve_working_image
+from utils.image_variants import (
+    get_variant_path, negotiate_format, cached_file_response, is_safe_name, ImageVariantError, IMAGE_CACHE_MAX_AGE
+)
+from utils.contact_sheet import build_contact_sheet_for_results, load_contact_sheet, sprite_path
+from utils.job_workspace import content_addressed_name, safe_filename
+from utils.retention import get_retention_manager
+from utils.metrics import get_metrics_registry
+from utils.request_profiler import list_profiles, profile_path, profiles_access_allowed, PROFILE_FORMATS
+from utils.results_store import get_results_store, persist_results
+from utils.rescoring import edit_sheet, rescore_exam, rerun_sheet_stage, EditError
+from utils.archive_ingest import ingest_archive, remove_archive, ArchiveError, ARCHIVE_EXTENSIONS
+from utils.log_utils import configure_logging
+
+# Cấu hình logging (LOG_LEVEL, LOG_LEVELS theo module)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -58,50 +73,15 @@ async def upload_answer_key(file: UploadFile = File(...)):
         
         logger.info("File saved successfully")
         
-        # Đọc file Excel để lấy exam codes và answer keys
-        import io
+        # Biên dịch đáp án một lần (cache theo hash nội dung), process_images dùng lại bản này
         try:
-            df = pd.read_excel(io.BytesIO(content))
-            logger.info(f"Excel file read successfully. Shape: {df.shape}")
-            logger.info(f"Columns: {list(df.columns)}")
-            
-            # Lấy mã đề và đáp án
-            exam_codes = []
-            answer_keys = {}
+            answer_key = await run_in_threadpool(load_answer_key_artifact, save_path, content_sha256(content))
+            if answer_key is None:
+                return JSONResponse({'error': 'Lỗi đọc file Excel: không thể đọc file đáp án'}, status_code=500)
             
-            if not df.empty:
-                # Lấy cột đầu tiên cho exam codes
-                first_col = df.iloc[:, 0].dropna()
-                
-                for index, value in enumerate(first_col):
-                    if pd.notna(value):
-                        str_value = str(value).replace('.0', '')
-                        # Chỉ lấy những giá trị là số (mã đề)
-                        if str_value.isdigit() or (str_value.replace('.', '').isdigit()):
-                            exam_codes.append(str_value)
-                            
-                            # Lấy đáp án cho mã đề này (từ cột thứ 2 trở đi)
-                            if index < len(df):
-                                answers = []
-                                # Lấy đáp án từ các cột từ 1 trở đi (bỏ qua cột 0 là exam code)
-                                for col_idx in range(1, len(df.columns)):
-                                    if index < len(df):
-                                        answer_val = df.iloc[index, col_idx]
-                                        if pd.notna(answer_val):
-                                            answer_str = str(answer_val).strip().upper()
-                                            # Chỉ lấy A, B, C, D
-                                            if answer_str in ['A', 'B', 'C', 'D']:
-                                                answers.append(answer_str)
-                                            else:
-                                                answers.append('')  # Empty answer for invalid values
-                                        else:
-                                            answers.append('')  # Empty answer for NaN
-                                
-                                answer_keys[str_value] = answers
-                                logger.info(f"Exam code {str_value}: {len(answers)} answers")
-                
-                logger.info(f"Found exam codes: {exam_codes}")
-                logger.info(f"Answer keys sample: {dict(list(answer_keys.items())[:2])}")  # Show first 2 for debugging
+            exam_codes = answer_key.index.tolist()
+            answer_keys = {code: answers.tolist() for code, answers in zip(exam_codes, answer_key.to_numpy())}
+            logger.info(f"Found {len(exam_codes)} exam codes, {answer_key.shape[1]} questions")
             
             return { 
                 'message': 'Tải lên đáp án thành công!', 
@@ -153,22 +133,14 @@ async def upload_student_list(file: UploadFile = File(...)):
         
         # Xử lý file Excel sử dụng process_df_student
         try:
-            result = process_df_student(save_path)
+            # Danh sách đã biên dịch được cache theo hash nội dung, process_images dùng lại trực tiếp
+            roster_digest = content_sha256(content)
+            result = await run_in_threadpool(load_student_artifact, save_path, roster_digest)
             
             if 'error' in result:
                 logger.error(f"Error processing student list: {result['error']}")
                 return JSONResponse({'error': result['error']}, status_code=400)
             
-            # Lưu df_parts vào file tạm
-            temp_dir = os.path.join('uploads', 'temp')
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            df_parts_file = os.path.join(temp_dir, f'df_parts_{filename}.json')
-            with open(df_parts_file, 'w', encoding='utf-8') as f:
-                json.dump({key: part.to_dict() for key, part in result['df_parts'].items()}, f, ensure_ascii=False)
-            
-            logger.info(f"Saved df_parts to: {df_parts_file}")
-            
             # Tạo danh sách students cho response
             students = []
             for part_key, part_df in result['df_parts'].items():
@@ -194,7 +166,7 @@ async def upload_student_list(file: UploadFile = File(...)):
                 'filename': filename,
                 'studentCount': len(students),
                 'students': students,
-                'df_parts_file': df_parts_file,
+                'roster_digest': roster_digest,
                 'num_parts': len(result['df_parts']),
                 'parts_info': {key: (part_df['STT'].iloc[0], part_df['STT'].iloc[-1]) for key, part_df in result['df_parts'].items()}
             }
@@ -207,298 +179,264 @@ async def upload_student_list(file: UploadFile = File(...)):
         logger.error(f"Error processing student list file: {str(e)}")
         return JSONResponse({'error': f'Lỗi xử lý file: {str(e)}'}, status_code=500)
 
+def _image_upload_path(file):
+    """Đường dẫn lưu ảnh upload: chỉ lấy tên file (bỏ thư mục, '..') để không ghi ra ngoài uploads/images"""
+    return os.path.join('uploads', 'images', safe_filename(file.filename))
+
 # Upload ảnh bài làm
 @router.post('/api/upload_exam_images')
 async def upload_exam_images(images: List[UploadFile] = File(...)):
     logger.info(f"Received {len(images)} image uploads")
     
-    saved_files = []
+    named_images = []
     for i, file in enumerate(images):
         if not file.filename:
             logger.warning(f"File {i} has no filename, skipping")
             continue
-            
-        filename = file.filename
-        save_path = os.path.join('uploads', 'images', filename)
-        
-        # Đảm bảo thư mục tồn tại
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        
-        try:
-            content = await file.read()
-            with open(save_path, 'wb') as f:
-                f.write(content)
-            saved_files.append(filename)
-            logger.info(f"Saved image {i+1}/{len(images)}: {filename} ({len(content)} bytes)")
-        except Exception as e:
-            logger.error(f"Error saving file {filename}: {str(e)}")
+        named_images.append(file)
+    
+    # Ghi từng ảnh theo chunk (song song, có giới hạn kích thước) thay vì đọc cả file vào bộ nhớ
+    try:
+        results = await save_uploads_concurrently(
+            named_images,
+            _image_upload_path,
+            budget=UploadBudget(),
+            content_addressed=True
+        )
+    except UploadTooLarge as e:
+        logger.error(f"Upload rejected: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=413)
+    
+    # Tạo bản làm việc (xoay theo EXIF, giảm độ phân giải) cho các ảnh đã ghi xong
+    working_copies = await asyncio.gather(*(
+        run_in_threadpool(create_working_copy, result['filename'])
+        for result in results if not isinstance(result, Exception)
+    ))
+    working_iter = iter(working_copies)
+    
+    saved_files = []
+    saved_details = []
+    rejected_files = []
+    for file, result in zip(named_images, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error saving file {file.filename}: {str(result)}")
+            rejected_files.append({'filename': file.filename, 'error': str(result)})
             continue
+        working = next(working_iter)
+        # Tên lưu trữ (theo hash nội dung) là tên dùng cho process_images và /api/images
+        saved_files.append(result['filename'])
+        saved_details.append({
+            'filename': result['filename'],
+            'original_filename': file.filename,
+            'size': result['size'],
+            'sha256': result['sha256'],
+            'width': working['width'] if working else None,
+            'height': working['height'] if working else None,
+        })
+        logger.info(f"Saved image {len(saved_files)}/{len(images)}: {file.filename} ({result['size']} bytes)")
     
     logger.info(f"Successfully uploaded {len(saved_files)}/{len(images)} images")
     return { 
         'message': f'Uploaded {len(saved_files)} images successfully', 
-        'files': saved_files 
+        'files': saved_files,
+        'details': saved_details,
+        'rejected': rejected_files
     }
 
 # Xử lý ảnh và trả về kết quả thực tế
 @router.post('/api/process_images')
-async def process_images(request: Request):
+async def process_images(request: Request, background_tasks: BackgroundTasks):
     try:
         data = await request.json()
+    except Exception as e:
+        logger.error(f"Invalid process_images payload: {str(e)}")
+        return JSONResponse({'error': 'Invalid JSON payload'}, status_code=400)
+
+    # Toàn bộ pipeline (OpenCV, OCR, YOLO, pandas) chạy trên grading executor
+    result = await run_blocking(_process_images_sync, data)
+    # Tạo contact sheet của phòng thi sau khi đã trả response
+    if isinstance(result, dict):
+        background_tasks.add_task(
+            build_contact_sheet_for_results,
+            data.get('exam') or data.get('answer_key_filename'), data.get('room'), result['results']
+        )
+    return result
+
+
+def _process_images_sync(data):
+    try:
         answer_key_filename = data.get('answer_key_filename')
         student_list_filename = data.get('student_list_filename')
         image_filenames = data.get('image_filenames')
         room = data.get('room')
         
-        logger.info(f"Processing images with params: answer_key={answer_key_filename}, student_list={student_list_filename}, images={len(image_filenames)}, room={room}")
+        logger.info(f"Processing images with params: answer_key={answer_key_filename}, student_list={student_list_filename}, images={len(image_filenames or [])}, room={room}")
         
         if not answer_key_filename or not student_list_filename or not image_filenames or not room:
             return JSONResponse({'error': 'Missing required parameters'}, status_code=400)
         
-        # Đường dẫn file
-        data_path_process = os.path.join('uploads', 'key', answer_key_filename)
-        df_parts_file = os.path.join('uploads', 'student', student_list_filename)
-        phongthi = room
-        
-        logger.info(f"Checking files - data_path_process: {data_path_process}")
-        logger.info(f"df_parts_file: {df_parts_file}")
-        logger.info(f"phongthi: {phongthi}")
-        
-        if not os.path.exists(data_path_process):
-            return JSONResponse({'error': 'Không có file đáp án được tải lên hoặc xử lý.'}, status_code=400)
-        if not os.path.exists(df_parts_file):
-            return JSONResponse({'error': 'Không có dữ liệu danh sách học sinh.'}, status_code=400)
-        
-        # Đọc df_parts từ file JSON (được tạo từ upload_student_list)
-        try:
-            # Tìm file df_parts tương ứng với student_list_filename
-            df_parts_file = os.path.join('uploads', 'temp', f'df_parts_{student_list_filename}.json')
-            
-            if not os.path.exists(df_parts_file):
-                logger.error(f"df_parts file not found: {df_parts_file}")
-                return JSONResponse({'error': 'File df_parts không tồn tại. Vui lòng upload lại danh sách sinh viên.'}, status_code=400)
-            
-            with open(df_parts_file, 'r', encoding='utf-8') as f:
-                df_parts_data = json.load(f)
-            
-            # Chuyển đổi JSON thành DataFrame
-            df_parts = {}
-            for key, data in df_parts_data.items():
-                df = pd.DataFrame(data)
-                df = df.reset_index(drop=True)  # Reset index để đảm bảo index là số nguyên
-                df_parts[key] = df
-            
-            logger.info(f"Loaded df_parts from JSON: {list(df_parts.keys())}")
-            
-            # Log chi tiết từng part
-            for part_name, df in df_parts.items():
-                logger.info(f"Part '{part_name}': shape={df.shape}, columns={list(df.columns)}, index_type={type(df.index[0]) if len(df) > 0 else 'empty'}")
-                logger.info(f"Part '{part_name}' first few rows: {df.head(2).to_dict()}")
-                
-        except Exception as e:
-            logger.error(f"Error reading df_parts file: {e}")
-            return JSONResponse({'error': f'Lỗi đọc file df_parts: {str(e)}'}, status_code=400)
-        
-        # Xử lý phòng thi - tìm part phù hợp
-        available_parts = list(df_parts.keys())
-        logger.info(f"Available parts: {available_parts}")
-        
-        # Tìm part phù hợp với phòng thi
-        part_key = None
-        room_number = phongthi.replace('A', '').replace('B', '').replace('C', '')
         try:
-            room_num = int(room_number)
-            part_key = f"df_part{room_num}"
-            if part_key not in available_parts:
-                # Nếu không tìm thấy, sử dụng part đầu tiên
-                part_key = available_parts[0]
-                logger.info(f"Room {phongthi} not found, using first part: {part_key}")
-        except ValueError:
-            # Nếu không parse được số phòng, sử dụng part đầu tiên
-            part_key = available_parts[0] if available_parts else None
-            logger.info(f"Invalid room format, using first part: {part_key}")
-        
-        if part_key is None:
-            return JSONResponse({'error': f'Không tìm thấy part phù hợp cho phòng thi {phongthi}.'}, status_code=400)
-        
-        logger.info(f"Using part: {part_key}")
-        df_part = df_parts[part_key]
-        logger.info(f"df_part columns: {df_part.columns.tolist()}")
-        
-        required_columns = ['STT', 'MSSV']
-        missing_columns = [col for col in required_columns if col not in df_part.columns]
-        if missing_columns:
-            return JSONResponse({'error': f'File danh sách học sinh thiếu cột: {", ".join(missing_columns)}'}, status_code=400)
-        
-        student_ids = df_part['MSSV'].astype(str).tolist()
-        if 'HoDem' in df_part.columns and 'Ten' in df_part.columns:
-            student_names = (df_part['HoDem'].astype(str) + ' ' + df_part['Ten'].astype(str)).tolist()
-        elif 'Ten' in df_part.columns:
-            student_names = df_part['Ten'].astype(str).tolist()
-        else:
-            student_names = []
-        stt_list = df_part['STT'].astype(str).tolist()
-        
-        logger.info(f"Processing for {phongthi}, student_ids: {student_ids}, student_names: {student_names}, stt_list: {stt_list}")
-        
-        # Đọc file đáp án
-        try:
-            df_key = pd.read_excel(data_path_process)
-            logger.info(f"df_key shape: {df_key.shape}")
-            logger.info(f"df_key indices: {list(df_key.index)}")
-        except Exception as e:
-            logger.error(f"Error reading answer key file: {e}")
-            return JSONResponse({'error': 'Không thể xử lý file đáp án.'}, status_code=400)
-        
-        # Tính số câu hỏi (bỏ cột đầu tiên là mã đề)
-        num_questions = len(df_key.columns) - 1
-        logger.info(f"Số câu hỏi: {num_questions} (total columns: {len(df_key.columns)})")
+            context = load_grading_context(answer_key_filename, student_list_filename, room)
+        except GradingInputError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
         
         students = []
-        successful_recognitions = 0
-        
         for image_filename in image_filenames:
             try:
-                image_path = os.path.join('uploads', 'images', image_filename)
-                logger.info(f"Processing image: {image_path}")
-                
-                if not os.path.exists(image_path):
-                    logger.warning(f"Image file not found: {image_path}")
-                    continue
-                
-                # Xử lý ảnh và lấy tọa độ vùng phiếu thi
-                processing_result = image_processing(image_path)
-                paths = processing_result.get('paths', {})
-                
-                temp_file_name = os.path.basename(image_path).split('.')[0]
-                temp_file_name = temp_file_name.replace('\t', '').replace('\\', '/')
-                
-                # Tạo thư mục temp nếu chưa có
-                temp_dir = os.path.join('uploads', 'images', 'temp', temp_file_name)
-                os.makedirs(temp_dir, exist_ok=True)
-                
-                # Detect các thông tin từ ảnh
-                code_box_path = paths.get('code_box', os.path.join(temp_dir, 'code_box_bounding_box.jpg'))
-                name_student_path = paths.get('name', os.path.join(temp_dir, 'name_bounding_box.jpg'))
-                grading_path = paths.get('table_grading', os.path.join(temp_dir, 'table_grading_bounding_box.jpg'))
-                id_student_path = paths.get('id_student', os.path.join(temp_dir, 'id_student.jpg'))
-                index_student_path = paths.get('index_student', os.path.join(temp_dir, 'index_student.jpg'))
-                
-                logger.info(f"Processing paths: code_box={normalize_path(code_box_path)}, name={normalize_path(name_student_path)}, grading={normalize_path(grading_path)}")
-                
-                # Detect thông tin từ các vùng ảnh (raw detection)
-                exam_code = detect_code_box(code_box_path)
-                raw_name = detect_name_student(name_student_path, student_names)
-                raw_id = detect_id_student(id_student_path, student_ids)
-                raw_index = detect_index_student(index_student_path)
-                
-                # Xử lý ảnh để lấy đáp án bằng YOLO model với bounding boxes
-                try:
-                    logger.info(f"Starting YOLO processing for {grading_path}")
-                    # Gọi predict_grade với save_processed_image=True để tạo ảnh với bounding boxes
-                    processed_image_path, student_result = predict_grade(grading_path, save_processed_image=True)
-                    logger.info(f"YOLO processing completed. Processed image: {processed_image_path}")
-                    logger.info(f"Student result keys: {list(student_result.keys()) if student_result else 'None'}")
-                except Exception as e:
-                    logger.error(f"Error in predict_grade: {str(e)}")
-                    raise Exception(f"Error in YOLO processing: {str(e)}")
-
-                if not student_result:
-                    logger.error("No answers detected by YOLO model")
-                    raise Exception("No answers detected by YOLO model")
-                
-                # Lấy STT đầu tiên nếu có
-                raw_stt = raw_index[0] if raw_index else None
-                
-                # Validate và correct thông tin sinh viên
-                validation_result = validate_and_correct_student_info(
-                    detected_name=raw_name,
-                    detected_mssv=raw_id,
-                    detected_stt=raw_stt,
-                    df_students=df_part
-                )
-                
-                # Lấy thông tin đã được correct
-                corrected_name = validation_result['name']
-                corrected_mssv = validation_result['mssv']
-                corrected_stt = validation_result['stt']
-                correction_status = validation_result['status']
-                correction_reason = validation_result['correction_reason']
-                
-                # Kiểm tra kết quả chấm điểm
-                if student_result is None:
-                    logger.warning(f"Không thể xử lý bảng chấm điểm tại {grading_path}")
-                    answers = [''] * num_questions
-                else:
-                    # Chuyển student_result thành danh sách câu trả lời
-                    answers = [student_result.get(i, '') for i in range(1, num_questions + 1)]
-                    
-                    # Kiểm tra độ dài câu trả lời
-                    if len(answers) != num_questions:
-                        logger.warning(f"Số câu trả lời ({len(answers)}) không khớp với số câu hỏi ({num_questions})")
-                        answers = answers + [''] * (num_questions - len(answers)) if len(answers) < num_questions else answers[:num_questions]
-                
-                # Tính điểm
-                score = calculate_score(answers, df_key, exam_code)
-                
-                # Kiểm tra có vấn đề gì không
-                has_issue = (
-                    exam_code not in [str(idx).replace('.0', '') for idx in df_key.index] or 
-                    not corrected_name or 
-                    not corrected_mssv or 
-                    not corrected_stt or
-                    correction_status != 'exact_match'
-                )
-                
-                # Tạo đường dẫn cho ảnh processed
-                processed_filename = os.path.basename(processed_image_path)
-                
-                student = {
-                    'id': corrected_mssv,
-                    'name': corrected_name,
-                    'testVariant': exam_code,
-                    'score': score,
-                    'answers': answers,
-                    'image': normalize_path(image_filename),
-                    'imageName': temp_file_name,  # Tên folder cho processed images
-                    'processedGradingImage': normalize_path(f"temp/{temp_file_name}/{processed_filename}"),  # Đường dẫn ảnh đã xử lý với bounding boxes
-                    'has_issue': has_issue,
-                    'num_questions': num_questions,
-                    'index_student': corrected_stt or 'N/A',
-                    'correction_status': correction_status,
-                    'correction_reason': correction_reason,
-                    'raw_detection': {
-                        'name': raw_name,
-                        'mssv': raw_id,
-                        'stt': raw_stt
-                    }
-                }
-                
-                students.append(student)
-                if corrected_name and corrected_mssv and corrected_stt and score is not None and score > 0:
-                    successful_recognitions += 1
-                    
+                student = grade_sheet(image_filename, context)
             except Exception as e:
                 logger.error(f"Error processing {image_filename}: {e}")
                 continue
+            if student is not None:
+                students.append(student)
         
-        total_students = len(students)
-        recognition_rate = (successful_recognitions / total_students * 100) if total_students > 0 else 0
-        
-        logger.info(f"Processing completed. Total students: {total_students}, Recognition rate: {recognition_rate:.2f}%")
-        
-        return {
-            'message': 'Processing completed',
-            'results': students,
-            'total_students': total_students,
-            'recognition_rate': round(recognition_rate, 2),
-            'num_questions': num_questions
-        }
+        # Lưu kết quả vào results store (exam mặc định là file đáp án)
+        return persist_results(
+            summarize_results(students, context['num_questions']),
+            data.get('exam') or answer_key_filename, room, answer_key_filename, student_list_filename
+        )
         
     except Exception as e:
         logger.error(f"Error processing images: {str(e)}")
         return JSONResponse({'error': str(e)}, status_code=500)
 
+# Phiên ingest: mỗi ảnh được xử lý ngay khi upload xong, chấm điểm khi kết thúc phiên
+@router.post('/api/ingest_sessions')
+async def create_ingest_session(request: Request):
+    try:
+        data = await request.json()
+        room = data.get('room')
+        if not room:
+            return JSONResponse({'error': 'Missing required parameters'}, status_code=400)
+        
+        session = await run_in_threadpool(
+            create_session, room, data.get('answer_key_filename'), data.get('student_list_filename')
+        )
+        return session.status()
+    except GradingInputError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error creating ingest session: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@router.get('/api/ingest_sessions/{session_id}')
+async def get_ingest_session(session_id: str):
+    session = get_session(session_id)
+    if session is None:
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+    return session.status()
+
+# Bổ sung đáp án / danh sách sinh viên cho phiên đang mở
+@router.patch('/api/ingest_sessions/{session_id}')
+async def update_ingest_session(session_id: str, request: Request):
+    session = get_session(session_id)
+    if session is None:
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+    try:
+        data = await request.json()
+        await run_in_threadpool(
+            session.configure, data.get('answer_key_filename'), data.get('student_list_filename')
+        )
+        return session.status()
+    except GradingInputError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error updating ingest session {session_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Upload ảnh vào phiên; mỗi ảnh được đưa vào pipeline ngay khi ghi xong xuống đĩa.
+# Client nên gửi từng ảnh (hoặc nhóm nhỏ) trong các request song song để upload và xử lý chồng lên nhau.
+@router.post('/api/ingest_sessions/{session_id}/images')
+async def upload_session_images(session_id: str, images: List[UploadFile] = File(...)):
+    session = get_session(session_id)
+    if session is None:
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+    if session.finalized:
+        return JSONResponse({'error': 'Session already finalized'}, status_code=409)
+    
+    named_images = [file for file in images if file.filename]
+    try:
+        results = await save_uploads_concurrently(
+            named_images,
+            _image_upload_path,
+            budget=UploadBudget(),
+            on_saved=lambda file, result: session.submit(result['filename']),
+            content_addressed=True
+        )
+    except UploadTooLarge as e:
+        logger.error(f"Upload rejected: {str(e)}")
+        # Ảnh đã ghi xong trước khi vượt giới hạn vẫn nằm trong phiên (đang được xử lý)
+        return JSONResponse({'error': str(e), 'session': session.status()}, status_code=413)
+    
+    saved_files = [result['filename'] for result in results if not isinstance(result, Exception)]
+    rejected_files = [
+        {'filename': file.filename, 'error': str(result)}
+        for file, result in zip(named_images, results) if isinstance(result, Exception)
+    ]
+    status = session.status()
+    status.update({'files': saved_files, 'rejected': rejected_files})
+    return status
+
+# Upload một file ZIP hoặc PDF nhiều trang vào phiên; từng trang được tách và xử lý lần lượt
+@router.post('/api/ingest_sessions/{session_id}/archive')
+async def upload_session_archive(session_id: str, file: UploadFile = File(...)):
+    session = get_session(session_id)
+    if session is None:
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+    if session.finalized:
+        return JSONResponse({'error': 'Session already finalized'}, status_code=409)
+    if not file.filename or os.path.splitext(file.filename)[1].lower() not in ARCHIVE_EXTENSIONS:
+        return JSONResponse({'error': 'Chỉ hỗ trợ file .zip hoặc .pdf'}, status_code=400)
+    
+    archive_path = os.path.join('uploads', 'temp', 'archives', f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}")
+    try:
+        saved = await save_upload_stream(file, archive_path, max_bytes=MAX_UPLOAD_REQUEST_BYTES)
+        # Tách trang trong thread pool (không chiếm grading executor, nơi các trang đang được xử lý);
+        # tên trang có hash của archive để archive trùng tên từ các phòng khác không đè nhau
+        pages = await run_in_threadpool(
+            ingest_archive, archive_path, content_addressed_name(saved['sha256'], file.filename), session
+        )
+    except UploadTooLarge as e:
+        logger.error(f"Upload rejected: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=413)
+    except ArchiveError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error ingesting archive {file.filename}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+    finally:
+        await run_in_threadpool(remove_archive, archive_path)
+    
+    status = session.status()
+    status.update({'archive': file.filename, 'files': pages})
+    return status
+
+# Kết thúc phiên: chờ các ảnh xử lý xong rồi chấm điểm
+@router.post('/api/ingest_sessions/{session_id}/finalize')
+async def finalize_ingest_session(session_id: str, background_tasks: BackgroundTasks):
+    session = get_session(session_id)
+    if session is None:
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+    try:
+        futures = session.close()
+    except SessionFinalized:
+        return JSONResponse({'error': 'Session already finalized'}, status_code=409)
+    except GradingInputError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    try:
+        # Chờ trên event loop để không giữ thread của grading executor
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures.values()), return_exceptions=True)
+        result = await run_blocking(session.score_all)
+        background_tasks.add_task(
+            build_contact_sheet_for_results, session.answer_key_filename, session.room, result['results']
+        )
+        return result
+    except GradingInputError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error finalizing ingest session {session_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
 # Tải file kết quả (Excel)
 @router.get('/api/download_result/{filename}')
 async def download_result(filename: str):
@@ -581,30 +519,242 @@ async def calculate_rooms(request: Request):
         logger.error(f"Error calculating rooms: {str(e)}")
         return JSONResponse({'error': f'Lỗi tính toán phòng thi: {str(e)}'}, status_code=500) 
 
-# Serve uploaded images
+async def _serve_image(request, file_path, size=None, fmt=None):
+    """Trả ảnh gốc hoặc variant (thumb/medium) với ETag/Last-Modified/Range"""
+    if size is None:
+        return await run_in_threadpool(cached_file_response, request, file_path)
+    variant_fmt = negotiate_format(request.headers.get('accept'), fmt)
+    variant_path, media_type = await run_in_threadpool(get_variant_path, file_path, size, variant_fmt)
+    return await run_in_threadpool(
+        cached_file_response, request, variant_path, media_type, vary_accept=fmt is None
+    )
+
+# Serve uploaded images (?size=thumb|medium để lấy ảnh thu nhỏ, ?format=webp|jpeg)
 @router.get('/api/images/{filename}')
-async def get_image(filename: str):
+async def get_image(request: Request, filename: str, original: bool = False,
+                    size: Optional[str] = None, fmt: Optional[str] = Query(None, alias='format')):
     try:
-        file_path = os.path.join('uploads', 'images', filename)
-        if not os.path.exists(file_path):
+        if not is_safe_name(filename):
+            return JSONResponse({'error': 'Image not found'}, status_code=404)
+        # Mặc định trả bản làm việc (đã xoay, giảm độ phân giải); ?original=1 để lấy ảnh gốc
+        if original:
+            file_path = os.path.join('uploads', 'images', filename)
+            if not os.path.isfile(file_path):
+                file_path = None
+        else:
+            file_path = await run_in_threadpool(resolve_working_image, filename)
+        if file_path is None:
             return JSONResponse({'error': 'Image not found'}, status_code=404)
-        return FileResponse(file_path)
+        return await _serve_image(request, file_path, size, fmt)
+    except ImageVariantError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
     except Exception as e:
         logger.error(f"Error serving image {filename}: {str(e)}")
         return JSONResponse({'error': 'Error serving image'}, status_code=500)
 
 # Serve processed images (table grading results)
 @router.get('/api/processed_images/{image_folder}/{filename}')
-async def get_processed_image(image_folder: str, filename: str):
+async def get_processed_image(request: Request, image_folder: str, filename: str,
+                              size: Optional[str] = None, fmt: Optional[str] = Query(None, alias='format')):
     try:
         file_path = os.path.join('uploads', 'images', 'temp', image_folder, filename)
-        if not os.path.exists(file_path):
+        if not is_safe_name(image_folder) or not is_safe_name(filename) or not os.path.isfile(file_path):
             return JSONResponse({'error': 'Processed image not found'}, status_code=404)
-        return FileResponse(file_path)
+        return await _serve_image(request, file_path, size, fmt)
+    except ImageVariantError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
     except Exception as e:
         logger.error(f"Error serving processed image {image_folder}/{filename}: {str(e)}")
         return JSONResponse({'error': 'Error serving processed image'}, status_code=500)
 
+# Contact sheet của phòng thi: file map (vị trí từng bài) và các ảnh sprite
+# exam: kỳ thi (mặc định là tên file đáp án, giống results store)
+@router.get('/api/rooms/{room}/contact_sheet')
+async def get_contact_sheet(room: str, exam: str = Query(...)):
+    try:
+        manifest = await run_in_threadpool(load_contact_sheet, exam, room)
+        if manifest is None:
+            return JSONResponse({'error': 'Contact sheet not found'}, status_code=404)
+        # Sprite bị ghi đè khi tạo lại contact sheet: version trong URL để không dùng bản đã cache
+        version = quote(str(manifest.get('version', '')), safe='')
+        manifest['sprite_urls'] = [
+            f"/api/rooms/{quote(room, safe='')}/contact_sheet/{sprite['index']}.webp"
+            f"?exam={quote(exam, safe='')}&v={version}"
+            for sprite in manifest['sprites']
+        ]
+        return manifest
+    except Exception as e:
+        logger.error(f"Error loading contact sheet for room {room}: {str(e)}")
+        return JSONResponse({'error': 'Error loading contact sheet'}, status_code=500)
+
+@router.get('/api/rooms/{room}/contact_sheet/{index}.webp')
+async def get_contact_sheet_sprite(request: Request, room: str, index: int, exam: str = Query(...),
+                                   v: str = Query('')):
+    try:
+        path = sprite_path(exam, room, index)
+        if not os.path.isfile(path):
+            return JSONResponse({'error': 'Sprite not found'}, status_code=404)
+        # URL không có version (không lấy từ manifest): bắt trình duyệt kiểm tra lại ETag mỗi lần
+        max_age = IMAGE_CACHE_MAX_AGE if v else 0
+        return await run_in_threadpool(cached_file_response, request, path, 'image/webp', max_age)
+    except Exception as e:
+        logger.error(f"Error serving contact sheet sprite {room}/{index}: {str(e)}")
+        return JSONResponse({'error': 'Error serving sprite'}, status_code=500)
+
+# Số liệu dung lượng artifact (byte đang giữ / đã thu hồi theo loại)
+@router.get('/api/retention')
+async def get_retention_metrics():
+    return get_retention_manager().snapshot()
+
+# Chạy ngay một lượt dọn artifact (ngoài lịch của sweeper nền)
+@router.post('/api/retention/sweep')
+async def run_retention_sweep():
+    try:
+        return await run_in_threadpool(get_retention_manager().sweep)
+    except Exception as e:
+        logger.error(f"Error running retention sweep: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Tóm tắt thời gian theo stage / engine (dạng JSON của /metrics)
+@router.get('/api/metrics/stages')
+async def get_stage_metrics():
+    return {'stages': get_metrics_registry().snapshot()}
+
+# Profile đã lưu của các request gửi kèm X-Profile / ?profile=1
+# (cần header X-Profile mang PROFILE_TOKEN; 404 khi profiling tắt)
+@router.get('/api/profiles')
+async def get_profiles(request: Request):
+    if not profiles_access_allowed(request.headers):
+        return JSONResponse({'error': 'Profiling is disabled or token is invalid'}, status_code=404)
+    return {'profiles': await run_in_threadpool(list_profiles)}
+
+@router.get('/api/profiles/{profile_id}')
+async def get_profile(request: Request, profile_id: str, format: str = Query('speedscope')):
+    if not profiles_access_allowed(request.headers):
+        return JSONResponse({'error': 'Profiling is disabled or token is invalid'}, status_code=404)
+    path = profile_path(profile_id, format)
+    if path is None:
+        return JSONResponse({'error': f'Invalid profile id or format (expected one of {list(PROFILE_FORMATS)})'}, status_code=400)
+    if not os.path.exists(path):
+        return JSONResponse({'error': 'Profile not found'}, status_code=404)
+    return FileResponse(path, media_type=PROFILE_FORMATS[format][1], filename=os.path.basename(path))
+
+# Kết quả đã lưu của một lần chấm (dùng khi tải lại trang review)
+@router.get('/api/jobs/{job_id}')
+async def get_job_results(job_id: str):
+    try:
+        store = get_results_store()
+        job = await run_in_threadpool(store.get_job, job_id)
+        if job is None:
+            return JSONResponse({'error': 'Job not found'}, status_code=404)
+        job['results'] = await run_in_threadpool(store.list_sheets, job_id=job_id)
+        return job
+    except Exception as e:
+        logger.error(f"Error loading job {job_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Tra cứu kết quả đã lưu theo exam / phòng thi / MSSV
+@router.get('/api/results')
+async def list_results(exam: Optional[str] = None, room: Optional[str] = None, mssv: Optional[str] = None):
+    try:
+        results = await run_in_threadpool(get_results_store().list_sheets, exam=exam, room=room, mssv=mssv)
+        return {'results': results, 'total': len(results)}
+    except Exception as e:
+        logger.error(f"Error listing results: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@router.get('/api/results/statistics')
+async def results_statistics(exam: Optional[str] = None, room: Optional[str] = None, job_id: Optional[str] = None):
+    try:
+        return await run_in_threadpool(get_results_store().statistics, exam=exam, room=room, job_id=job_id)
+    except Exception as e:
+        logger.error(f"Error computing statistics: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@router.get('/api/results/{sheet_id}')
+async def get_result(sheet_id: int):
+    try:
+        store = get_results_store()
+        sheet = await run_in_threadpool(store.get_sheet, sheet_id)
+        if sheet is None:
+            return JSONResponse({'error': 'Sheet not found'}, status_code=404)
+        sheet['edits'] = await run_in_threadpool(store.list_edits, sheet_id)
+        return sheet
+    except Exception as e:
+        logger.error(f"Error loading sheet {sheet_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Sửa một bài đã lưu (câu trả lời, mã đề, thông tin sinh viên): chỉ chấm lại bài đó
+@router.patch('/api/results/{sheet_id}')
+async def edit_result(sheet_id: int, request: Request):
+    try:
+        payload = await request.json()
+    except Exception:
+        return JSONResponse({'error': 'Invalid JSON payload'}, status_code=400)
+    if not isinstance(payload, dict):
+        return JSONResponse({'error': 'Invalid JSON payload'}, status_code=400)
+    try:
+        delta = await run_in_threadpool(edit_sheet, sheet_id, payload)
+        if delta is None:
+            return JSONResponse({'error': 'Sheet not found'}, status_code=404)
+        return delta
+    except (EditError, GradingInputError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error editing sheet {sheet_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Chạy lại một stage (code_box, name, id, index, grading) cho một bài, có thể với vùng cắt đã chỉnh
+@router.post('/api/results/{sheet_id}/rerun')
+async def rerun_result_stage(sheet_id: int, request: Request):
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({'error': 'Invalid JSON payload'}, status_code=400)
+    if not isinstance(data, dict) or not data.get('stage'):
+        return JSONResponse({'error': 'Missing required parameters'}, status_code=400)
+    try:
+        # Detector dùng model OCR/YOLO nên chạy trên grading executor
+        delta = await run_blocking(rerun_sheet_stage, sheet_id, data['stage'], data.get('rect'))
+        if delta is None:
+            return JSONResponse({'error': 'Sheet not found'}, status_code=404)
+        return delta
+    except (EditError, GradingInputError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error re-running {data.get('stage')} for sheet {sheet_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Chấm lại toàn bộ bài của một đề theo file đáp án đã sửa (không chạy lại OCR/YOLO)
+@router.post('/api/exams/{exam}/rescore')
+async def rescore_exam_results(exam: str, request: Request):
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({'error': 'Invalid JSON payload'}, status_code=400)
+    answer_key_filename = data.get('answer_key_filename') if isinstance(data, dict) else None
+    if not answer_key_filename:
+        return JSONResponse({'error': 'Missing required parameters'}, status_code=400)
+    try:
+        result = await run_blocking(rescore_exam, exam, answer_key_filename)
+        if result is None:
+            return JSONResponse({'error': 'No stored results for this exam'}, status_code=404)
+        return result
+    except GradingInputError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error rescoring exam {exam}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Các phiên bản điểm (score set) của một đề
+@router.get('/api/exams/{exam}/score_sets')
+async def list_exam_score_sets(exam: str):
+    try:
+        return {'score_sets': await run_in_threadpool(get_results_store().list_score_sets, exam)}
+    except Exception as e:
+        logger.error(f"Error listing score sets for {exam}: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
 # Export results to original Excel file
 @router.post('/api/export_to_original_excel')
 async def export_to_original_excel(request: Request):
@@ -613,6 +763,16 @@ async def export_to_original_excel(request: Request):
         results = data.get('results', [])
         student_filename = data.get('student_filename', '')
         
+        # Không gửi results: lấy điểm (thang 10) từ results store theo job_id hoặc exam/room
+        if not results and (data.get('job_id') or data.get('exam')):
+            stored = await run_in_threadpool(
+                get_results_store().list_sheets, exam=data.get('exam'), room=data.get('room'), job_id=data.get('job_id')
+            )
+            results = [
+                {'mssv': sheet['id'], 'diem': sheet['score'] * 10.0 / sheet['num_questions']}
+                for sheet in stored if sheet['num_questions'] and sheet['score'] is not None
+            ]
+        
         logger.info(f"Export to original Excel request - student_filename: {student_filename}, results count: {len(results)}")
         
         if not results or not student_filename:
@@ -630,7 +790,7 @@ async def export_to_original_excel(request: Request):
             from openpyxl import load_workbook
             
             # Load workbook với tất cả formatting
-            workbook = load_workbook(original_file_path)
+            workbook = await run_in_threadpool(load_workbook, original_file_path)
             worksheet = workbook.active
             
             logger.info(f"Loaded Excel workbook: {original_file_path}")
@@ -684,7 +844,7 @@ async def export_to_original_excel(request: Request):
             output_path = os.path.join(output_dir, output_filename)
             
             # Lưu workbook với tất cả formatting gốc
-            workbook.save(output_path)
+            await run_in_threadpool(workbook.save, output_path)
             
             logger.info(f"Saved updated Excel file with original formatting: {output_path}")
             
@@ -1,11 +1,32 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import os
 from api_mobile import router as api_mobile_router
+from utils.executor import shutdown_executor
+from utils.upload_storage import MAX_UPLOAD_REQUEST_BYTES
+from utils.job_workspace import cleanup_stale_jobs
+from utils.retention import start_retention_sweeper, stop_retention_sweeper, retention_gauges
+from utils.ingest_session import start_session_sweeper, stop_session_sweeper
+from utils.metrics import get_metrics_registry
+from utils.request_profiler import ProfilingMiddleware
+from utils.torch_threads import configure_torch_threads
+from utils.tesseract_engine import check_tesseract_backend
+from utils.memory_guard import install_memory_guard, memory_debug_allowed, memory_report, start_tracing, stop_tracing
+from starlette.concurrency import run_in_threadpool
 
 app = FastAPI(title="Exam Grading System API", version="1.0.0")
 
+# Từ chối sớm các request upload quá lớn dựa trên Content-Length, trước khi parse multipart
+# (khai báo trước CORS để response 413 vẫn có header CORS)
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and content_length and content_length.isdigit() \
+            and int(content_length) > MAX_UPLOAD_REQUEST_BYTES:
+        return JSONResponse({'error': f'Request vượt quá giới hạn {MAX_UPLOAD_REQUEST_BYTES} bytes'}, status_code=413)
+    return await call_next(request)
+
 # Cấu hình CORS
 app.add_middleware(
     CORSMiddleware,
@@ -13,8 +34,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
 
+# Profile theo yêu cầu: header X-Profile: <PROFILE_TOKEN>; tắt nếu chưa đặt token (xem utils/request_profiler.py)
+app.add_middleware(ProfilingMiddleware)
+
 # Cấu hình thư mục upload
 UPLOAD_FOLDER_KEY = os.path.join('uploads', 'key')
 UPLOAD_FOLDER_STUDENT = os.path.join('uploads', 'student')
@@ -26,10 +51,54 @@ for folder in [UPLOAD_FOLDER_KEY, UPLOAD_FOLDER_STUDENT, UPLOAD_FOLDER_IMAGES]:
 # Đăng ký router
 app.include_router(api_mobile_router)
 
+@app.on_event("startup")
+async def startup():
+    # Số luồng torch là thiết lập toàn process (TrOCR, YOLO, EasyOCR); đặt trước khi model nào chạy
+    configure_torch_threads()
+    # Cảnh báo một lần nếu OCR mã đề phải spawn process tesseract cho mỗi bài
+    check_tesseract_backend()
+    # Thư mục job còn sót từ lần chạy trước (server dừng giữa lúc chấm)
+    cleanup_stale_jobs()
+    # Dọn artifact theo TTL / quota định kỳ
+    start_retention_sweeper()
+    # Bỏ phiên ingest bị bỏ dở (giữ future và kết quả trong bộ nhớ)
+    start_session_sweeper()
+    get_metrics_registry().add_gauge_provider(retention_gauges)
+    # Lấy mẫu RSS theo stage, gauge bộ nhớ, governor số bài đang xử lý
+    install_memory_guard(get_metrics_registry())
+
+@app.on_event("shutdown")
+async def shutdown():
+    stop_retention_sweeper()
+    stop_session_sweeper()
+    shutdown_executor()
+
 @app.get("/ping")
 async def ping():
     return {"message": "pong"}
 
+# Histogram độ trễ / lỗi theo stage của pipeline chấm (Prometheus text format)
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(get_metrics_registry().render_prometheus(),
+                             media_type="text/plain; version=0.0.4")
+
+# RSS, trạng thái memory guard, mức tăng RSS theo stage và top allocator (tracemalloc)
+# ?trace=start|stop bật / tắt tracemalloc; group_by: lineno | filename | traceback
+# Cần header X-Debug-Token = MEMORY_DEBUG_TOKEN (hoặc PROFILE_TOKEN); chưa cấu hình token thì 404
+@app.get("/debug/memory")
+async def debug_memory(request: Request, top: int = Query(20, ge=1, le=200), group_by: str = 'lineno', trace: str = ''):
+    if not memory_debug_allowed(request.headers):
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return JSONResponse({'error': 'group_by phải là lineno, filename hoặc traceback'}, status_code=400)
+    if trace == 'start':
+        start_tracing()
+    elif trace == 'stop':
+        stop_tracing()
+    # take_snapshot có thể mất vài giây với nhiều trace, không chạy trên event loop
+    return await run_in_threadpool(memory_report, top, group_by)
+
 @app.post("/login")
 async def login(request: Request):
     data = await request.json()
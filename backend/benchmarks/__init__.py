@@ -0,0 +1,11 @@
+"""
+Benchmark hiệu năng cho pipeline chấm (không phải test)
+
+- synthetic_sheets: sinh phiếu trả lời tổng hợp với MSSV/STT/mã đề/đáp án đã biết
+- pipeline_benchmark: đo sheets/sec, độ trễ p50/p95, peak RSS và độ chính xác,
+  ghi báo cáo JSON vào benchmarks/results/
+- micro_benchmark: thời gian / cấp phát của hậu xử lý YOLO, khớp roster và chấm
+  điểm, fail khi chậm hơn baseline trong benchmarks/baselines/
+
+Chạy từ thư mục backend, ví dụ: python -m benchmarks.pipeline_benchmark --stage full
+"""
@@ -0,0 +1,287 @@
+"""
+Micro-benchmark cho phần Python thuần trên đường chấm (không gồm model)
+
+- Hậu xử lý YOLO (utils.detectGrade): group_nearby_boxes,
+  select_final_label_and_box, split_columns, postprocess_detections trên bộ
+  detection tổng hợp (vài trăm box, mỗi câu 1–4 box trùng nhau)
+- Khớp danh sách sinh viên: validate_and_correct_student_info và
+  synchronize_student_data với roster 45 → 10.000 sinh viên
+- Chấm điểm: calculate_score (đáp án thô) và score_answers (đáp án đã biên dịch)
+
+Mỗi case báo thời gian mỗi lần gọi (best / median qua nhiều lần lặp) và cấp phát
+bộ nhớ đo bằng tracemalloc cho một lần gọi: peak byte và số block còn giữ lại.
+So với baseline JSON đã lưu, chương trình trả exit code 1 khi có case chậm hơn
+--max-regression hoặc cấp phát nhiều hơn --max-alloc-regression, và exit code 2
+khi không có baseline (hoặc baseline không chứa case nào đã chạy) để CI không
+"pass" mà không so sánh gì. Baseline phụ thuộc máy nên không được commit; tạo
+trên máy chạy CI. Chạy từ thư mục backend:
+
+    python -m benchmarks.micro_benchmark --save-baseline      # ghi baseline trên máy tham chiếu
+    python -m benchmarks.micro_benchmark                      # so với baseline, fail nếu chậm đi
+    python -m benchmarks.micro_benchmark --allow-missing-baseline   # chỉ in kết quả
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic_sheets import ANSWER_CHOICES, DEFAULT_EXAM_CODES, make_answer_key, make_roster
+
+BASELINE_PATH = os.path.join('benchmarks', 'baselines', 'micro_baseline.json')
+BOX_SET_QUESTIONS = (60, 120)
+ROSTER_SIZES = (45, 500, 10000)
+QUICK_ROSTER_SIZES = (45, 500)
+# Bỏ qua chênh lệch cấp phát nhỏ hơn ngưỡng này (byte) khi so baseline
+ALLOC_NOISE_BYTES = 4096
+# Exit code khi không so sánh được (thiếu baseline / baseline không khớp case nào)
+EXIT_NO_BASELINE = 2
+
+
+def make_detections(num_questions, rng, columns=3, max_duplicates=4, jitter=6.0,
+                    table_size=(1520, 1340), box_size=40):
+    """
+    Detection YOLO tổng hợp cho một bảng trả lời: mỗi câu có 1–max_duplicates box
+    gần nhau (đôi khi khác nhãn), tọa độ xyxy trong ảnh vùng bảng.
+
+    Returns:
+        tuple: (boxes, cls_ids, confidences, names) như run_yolo.
+    """
+    width, height = table_size
+    rows = -(-num_questions // columns)
+    names = {i: f"answer_{choice}" for i, choice in enumerate(ANSWER_CHOICES)}
+    boxes, cls_ids, confidences = [], [], []
+    for q in range(num_questions):
+        c, r = divmod(q, rows)
+        cx = (c + 0.65) * width / columns
+        cy = (r + 0.5) * height / rows
+        answer = int(rng.integers(len(ANSWER_CHOICES)))
+        for d in range(int(rng.integers(1, max_duplicates + 1))):
+            x, y = cx + rng.uniform(-jitter, jitter), cy + rng.uniform(-jitter, jitter)
+            boxes.append([x - box_size / 2, y - box_size / 2, x + box_size / 2, y + box_size / 2])
+            wrong = d > 0 and rng.random() < 0.3
+            cls_ids.append(int(rng.integers(len(ANSWER_CHOICES))) if wrong else answer)
+            confidences.append(float(rng.uniform(0.3, 0.99)))
+    order = rng.permutation(len(boxes))
+    return (np.asarray(boxes, dtype=np.float32)[order], np.asarray(cls_ids)[order],
+            np.asarray(confidences, dtype=np.float32)[order], names)
+
+
+def build_cases(quick=False, seed=0):
+    """Danh sách (tên case, hàm không tham số) — dữ liệu được chuẩn bị sẵn, ngoài phần đo"""
+    from utils.detectGrade import (
+        box_centers, group_nearby_boxes, select_final_label_and_box, split_columns, postprocess_detections
+    )
+    from utils.student_validation import validate_and_correct_student_info
+    from utils.synchronize_student_data import synchronize_student_data
+    from utils.grading import calculate_score, score_answers
+    from utils.processing_result_file import compile_answer_key
+
+    rng = np.random.default_rng(seed)
+    cases = []
+
+    for num_questions in BOX_SET_QUESTIONS:
+        boxes, cls_ids, confidences, names = make_detections(num_questions, rng)
+        labels = [names[i] for i in cls_ids]
+        centers = box_centers(boxes)
+        groups = group_nearby_boxes(boxes, labels, centers, confidences)
+        cluster_boxes = [(best[0], char) for char, best in map(select_final_label_and_box, groups)]
+        tag = f"{num_questions}q/{len(boxes)}det"
+        cases += [
+            (f"group_nearby_boxes[{tag}]",
+             lambda b=boxes, l=labels, c=centers, f=confidences: group_nearby_boxes(b, l, c, f)),
+            (f"select_final_label_and_box[{tag}]",
+             lambda g=groups: [select_final_label_and_box(group) for group in g]),
+            (f"split_columns[{tag}]", lambda cb=cluster_boxes: split_columns(cb)),
+            (f"postprocess_detections[{tag}]",
+             lambda b=boxes, i=cls_ids, f=confidences, n=names: postprocess_detections(b, i, f, n)),
+        ]
+
+    for size in (QUICK_ROSTER_SIZES if quick else ROSTER_SIZES):
+        roster = make_roster(size, rng)
+        target = roster.iloc[size // 2]
+        full_name = f"{target['HoDem']} {target['Ten']}"
+        # Tên nhận diện sai một ký tự, MSSV và STT đúng (trường hợp hay gặp nhất)
+        noisy_name = full_name[:-1] + ('x' if full_name[-1] != 'x' else 'y')
+        student = {'id': str(target['MSSV']), 'name': noisy_name, 'index_student': str(target['STT'])}
+        cases += [
+            (f"validate_and_correct_student_info[roster={size}]",
+             lambda r=roster, t=target, n=noisy_name: validate_and_correct_student_info(
+                 detected_name=n, detected_mssv=str(t['MSSV']), detected_stt=str(t['STT']), df_students=r)),
+            (f"synchronize_student_data[roster={size}]",
+             lambda r=roster, s=student: synchronize_student_data(dict(s), r)),
+        ]
+
+    raw_key = make_answer_key(DEFAULT_EXAM_CODES, 60, rng)
+    compiled_key = compile_answer_key(raw_key)
+    answers = [str(a) for a in rng.choice(ANSWER_CHOICES, size=60)]
+    exam_code = DEFAULT_EXAM_CODES[0]
+    cases += [
+        (f"calculate_score[{len(DEFAULT_EXAM_CODES)}codes/60q]",
+         lambda: calculate_score(answers, raw_key, exam_code)),
+        (f"score_answers[{len(DEFAULT_EXAM_CODES)}codes/60q]",
+         lambda: score_answers(answers, compiled_key, exam_code)),
+    ]
+    return cases
+
+
+def time_call(func, min_time=0.2, repeat=5, max_number=100000):
+    """
+    Thời gian mỗi lần gọi (giây): tự chọn số lần gọi mỗi vòng để vòng đo đủ dài,
+    tắt GC trong lúc đo như timeit.
+
+    Returns:
+        dict: best, median (giây / lần gọi), number (số lần gọi mỗi vòng), repeat.
+    """
+    func()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / repeat or number >= max_number:
+            break
+        number *= 2
+
+    per_call = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                func()
+            per_call.append((time.perf_counter() - started) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {'best': min(per_call), 'median': float(np.median(per_call)), 'number': number, 'repeat': repeat}
+
+
+def measure_allocations(func):
+    """Cấp phát của một lần gọi: peak byte (so với trước khi gọi) và số block còn giữ lại"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        baseline_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, 'lineno') if stat.count_diff > 0)
+    return {'peak_bytes': max(peak - baseline_bytes, 0), 'retained_blocks': retained}
+
+
+def run_cases(cases, min_time=0.2, repeat=5, name_filter=None):
+    results = {}
+    # Một số hàm in log ra stdout; bỏ đi để không làm nhiễu kết quả và output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, func in cases:
+            if name_filter and name_filter not in name:
+                continue
+            timing = time_call(func, min_time=min_time, repeat=repeat)
+            results[name] = {
+                'best_us': round(timing['best'] * 1e6, 2),
+                'median_us': round(timing['median'] * 1e6, 2),
+                'calls_per_round': timing['number'],
+                **measure_allocations(func),
+            }
+    return results
+
+
+def check_regressions(results, baseline, max_regression=0.25, max_alloc_regression=0.5):
+    """
+    So kết quả với baseline.
+
+    Returns:
+        list: Mô tả các case vượt ngưỡng (rỗng nếu không có).
+    """
+    failures = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = current['median_us'] / previous['median_us'] if previous['median_us'] else 1.0
+        if ratio > 1 + max_regression:
+            failures.append(f"{name}: {previous['median_us']}us -> {current['median_us']}us ({ratio:.2f}x)")
+        grown = current['peak_bytes'] - previous['peak_bytes']
+        if grown > ALLOC_NOISE_BYTES and current['peak_bytes'] > previous['peak_bytes'] * (1 + max_alloc_regression):
+            failures.append(f"{name}: peak alloc {previous['peak_bytes']}B -> {current['peak_bytes']}B")
+    return failures
+
+
+def _print_table(results, baseline):
+    print(f"{'case':<58} {'median us':>12} {'best us':>12} {'peak KB':>10} {'blocks':>8} {'vs base':>8}")
+    for name, r in results.items():
+        previous = baseline.get(name)
+        ratio = f"{r['median_us'] / previous['median_us']:.2f}x" if previous and previous['median_us'] else '-'
+        print(f"{name:<58} {r['median_us']:>12.2f} {r['best_us']:>12.2f} "
+              f"{r['peak_bytes'] / 1024:>10.1f} {r['retained_blocks']:>8} {ratio:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmark hậu xử lý YOLO, khớp roster và chấm điểm')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='File baseline JSON')
+    parser.add_argument('--save-baseline', action='store_true', help='Ghi kết quả lần này làm baseline')
+    parser.add_argument('--allow-missing-baseline', action='store_true',
+                        help='Không fail khi thiếu baseline (chỉ in kết quả)')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Tỉ lệ chậm hơn baseline cho phép (0.25 = 25%%)')
+    parser.add_argument('--max-alloc-regression', type=float, default=0.5,
+                        help='Tỉ lệ tăng peak cấp phát cho phép')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Thời gian đo tối thiểu mỗi case (giây)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='Bỏ roster 10.000 sinh viên')
+    parser.add_argument('--filter', help='Chỉ chạy case có tên chứa chuỗi này')
+    parser.add_argument('--output', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args(argv)
+
+    results = run_cases(build_cases(quick=args.quick), min_time=args.min_time,
+                        repeat=args.repeat, name_filter=args.filter)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f).get('cases', {})
+    _print_table(results, baseline)
+
+    report = {'python': sys.version.split()[0], 'cases': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved: {args.baseline}")
+        return 0
+
+    compared = [name for name in results if name in baseline]
+    if not compared:
+        if not baseline:
+            print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        else:
+            print(f"Baseline {args.baseline} has none of the cases that ran")
+        return 0 if args.allow_missing_baseline else EXIT_NO_BASELINE
+    for name in results:
+        if name not in baseline:
+            print(f"NEW {name}: not in baseline, not compared")
+
+    failures = check_regressions(results, baseline, args.max_regression, args.max_alloc_regression)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""
+Benchmark thông lượng / độ chính xác của pipeline chấm trên phiếu tổng hợp
+
+Sinh phiếu bằng benchmarks.synthetic_sheets rồi chạy:
+- full: grade_sheet + summarize_results như /api/process_images (ảnh đặt trong
+  uploads/images, dùng bản làm việc, workspace và artifact như khi chạy thật;
+  không ghi vào results store)
+- image_processing | code_box | index | grading | scoring: chỉ một stage, trên
+  vùng cắt đã chuẩn bị trước (phần chuẩn bị không tính giờ)
+
+Báo cáo JSON gồm sheets/sec, độ trễ p50/p95 mỗi bài, peak RSS, độ chính xác
+so với đáp án đúng của phiếu và thời gian trung bình theo stage (utils.metrics).
+Chạy từ thư mục backend:
+
+    python -m benchmarks.pipeline_benchmark --stage full --count 30 --noise light --workers 2
+    python -m benchmarks.pipeline_benchmark --stage grading --compare benchmarks/results/old.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.synthetic_sheets import NOISE_PROFILES, DEFAULT_PAGE_WIDTH, generate_dataset, expected_score
+from utils.metrics import sheet_timings
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('full', 'image_processing', 'code_box', 'index', 'grading', 'scoring')
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+IMAGES_DIR = os.path.join('uploads', 'images')
+CROP_KEYS = ('code_box', 'name', 'id_student', 'index_student', 'table_grading')
+
+
+def peak_rss_bytes():
+    """Peak RSS của process (resource trên Unix, psutil nếu có); None nếu không đo được"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về byte
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return None
+
+
+def build_context(dataset):
+    """Context chấm điểm giống load_grading_context, dựng thẳng từ roster / đáp án tổng hợp"""
+    from utils.processing_result_file import compile_answer_key
+
+    roster = dataset['roster']
+    df_key = compile_answer_key(dataset['answer_key'])
+    return {
+        'df_part': roster,
+        'student_ids': roster['MSSV'].astype(str).tolist(),
+        'student_names': (roster['HoDem'] + ' ' + roster['Ten']).tolist(),
+        'stt_list': roster['STT'].astype(str).tolist(),
+        'df_key': df_key,
+        'num_questions': len(df_key.columns),
+    }
+
+
+def _answer_accuracy(truth_answers, detected):
+    """Tỉ lệ câu nhận đúng; detected là list theo thứ tự câu hoặc dict {số câu: ký tự}"""
+    if isinstance(detected, dict):
+        detected = [detected.get(i, '') for i in range(1, len(truth_answers) + 1)]
+    detected = list(detected or []) + [''] * len(truth_answers)
+    hits = sum(1 for truth, got in zip(truth_answers, detected) if (got or '') == truth)
+    return hits / len(truth_answers)
+
+
+# --- Các stage: run(item, context) -> (kết quả, dict chỉ số độ chính xác) ---
+
+def _run_full(item, context):
+    from utils.grading_pipeline import grade_sheet
+
+    student = grade_sheet(item['filename'], context)
+    if student is None:
+        raise FileNotFoundError(item['filename'])
+    return student, {
+        'exam_code': str(student['testVariant']) == item['exam_code'],
+        'mssv': str(student['id']) == item['mssv'],
+        'stt': str(student['index_student']) == item['stt'],
+        'answers': _answer_accuracy(item['answers'], student['answers']),
+        'score': student['score'] == item['expected_score'],
+    }
+
+
+def _run_image_processing(item, context):
+    from utils.image_processing import image_processing
+
+    result = image_processing(item['path'], temp_dir=tempfile.mkdtemp(dir=item['work_dir']))
+    paths = result['paths']
+    return result, {'crops': all(key in paths for key in CROP_KEYS)}
+
+
+def _run_code_box(item, context):
+    from utils.detectCodeBox import detect_code_box
+
+    exam_code = detect_code_box(item['crops']['code_box'])
+    return exam_code, {'exam_code': str(exam_code) == item['exam_code']}
+
+
+def _run_index(item, context):
+    from utils.detectInfo import detect_index_student
+
+    raw_index = detect_index_student(item['crops']['index_student'])
+    return raw_index, {'stt': bool(raw_index) and str(raw_index[0]) == item['stt']}
+
+
+def _run_grading(item, context):
+    from utils.detectGrade import predict_grade
+
+    _, student_result = predict_grade(item['crops']['table_grading'], save_processed_image=True)
+    return student_result, {'answers': _answer_accuracy(item['answers'], student_result)}
+
+
+def _run_scoring(item, context):
+    from utils.grading_pipeline import score_sheet
+
+    # Kết quả nhận diện giả định đúng hoàn toàn: chỉ đo validate + chấm điểm
+    sheet = {
+        'image_filename': item['filename'],
+        'temp_file_name': 'benchmark',
+        'paths': {},
+        'exam_code': item['exam_code'],
+        'raw_index': [item['stt']],
+        'student_result': {i + 1: answer for i, answer in enumerate(item['answers'])},
+        'processed_image_path': item['filename'],
+        'raw_name': item['name'],
+        'raw_id': item['mssv'],
+        'identity_detected': True,
+    }
+    student = score_sheet(sheet, context)
+    return student, {
+        'score': student['score'] == item['expected_score'],
+        'identity': student['correction_status'] == 'exact_match',
+    }
+
+
+STAGE_RUNNERS = {
+    'full': _run_full,
+    'image_processing': _run_image_processing,
+    'code_box': _run_code_box,
+    'index': _run_index,
+    'grading': _run_grading,
+    'scoring': _run_scoring,
+}
+
+
+def _prepare_crops(items, work_dir):
+    """Cắt vùng trước cho các stage đơn lẻ (không tính vào thời gian đo)"""
+    from utils.image_processing import image_processing
+
+    for item in items:
+        crop_dir = os.path.join(work_dir, os.path.splitext(item['filename'])[0])
+        item['crops'] = image_processing(item['path'], temp_dir=crop_dir)['paths']
+
+
+def _time_item(runner, item, context):
+    timings = {}
+    started = time.perf_counter()
+    try:
+        with sheet_timings(timings):
+            _, accuracy = runner(item, context)
+        error = None
+    except Exception as e:
+        accuracy = {}
+        error = f"{type(e).__name__}: {e}"
+    return {
+        'filename': item['filename'],
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'accuracy': accuracy,
+        'stage_timings': timings,
+        'error': error,
+    }
+
+
+def _summarize(samples):
+    values = np.asarray(samples, dtype=float)
+    if not len(values):
+        return None
+    return {
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'max': round(float(values.max()), 2),
+    }
+
+
+def _cleanup_full_run(items):
+    from utils.image_normalization import working_path_for
+    from utils.job_workspace import sheet_dirs_for
+
+    for item in items:
+        if os.path.exists(item['path']):
+            # Mỗi lần xử lý có thư mục artifact riêng (hash ảnh + hậu tố ngẫu nhiên)
+            for sheet_dir in sheet_dirs_for(item['path']):
+                shutil.rmtree(sheet_dir, ignore_errors=True)
+        for path in (item['path'], working_path_for(item['filename'])):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run_benchmark(stage='full', count=20, noise='light', seed=0, workers=1, warmup=1,
+                  num_students=45, width=DEFAULT_PAGE_WIDTH, keep=False, per_sheet=False):
+    """
+    Chạy benchmark và trả về báo cáo (dict, ghi được ra JSON).
+
+    Args:
+        stage (str): Một trong STAGES.
+        count (int): Số phiếu được đo (không kể warmup).
+        workers (int): Số thread chạy song song (như GRADING_WORKERS).
+        warmup (int): Số phiếu chạy trước để load model, không tính vào kết quả.
+        keep (bool): Giữ lại ảnh / artifact sau khi chạy.
+        per_sheet (bool): Kèm kết quả từng phiếu trong báo cáo.
+    """
+    if stage not in STAGE_RUNNERS:
+        raise ValueError(f"stage phải là một trong {STAGES}")
+    runner = STAGE_RUNNERS[stage]
+    run_id = uuid.uuid4().hex[:8]
+    work_dir = tempfile.mkdtemp(prefix=f'bench_{run_id}_')
+
+    # Ảnh cho chế độ full nằm trong uploads/images như ảnh upload thật
+    image_dir = IMAGES_DIR if stage == 'full' else work_dir
+    dataset = generate_dataset(image_dir, count + warmup, seed=seed, noise=noise,
+                               num_students=num_students, width=width, prefix=f'bench_{run_id}')
+    context = build_context(dataset)
+    items = dataset['sheets']
+    for item in items:
+        item['expected_score'] = expected_score(item['answers'], context['df_key'], item['exam_code'])
+        item['work_dir'] = work_dir
+
+    try:
+        if stage not in ('full', 'image_processing', 'scoring'):
+            _prepare_crops(items, work_dir)
+
+        for item in items[:warmup]:
+            _time_item(runner, item, context)
+
+        measured = items[warmup:]
+        started = time.perf_counter()
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bench') as pool:
+                results = list(pool.map(lambda item: _time_item(runner, item, context), measured))
+        else:
+            results = [_time_item(runner, item, context) for item in measured]
+        wall_seconds = time.perf_counter() - started
+    finally:
+        if not keep:
+            if stage == 'full':
+                _cleanup_full_run(items)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    ok = [r for r in results if r['error'] is None]
+    metric_names = sorted({name for r in ok for name in r['accuracy']})
+    accuracy = {
+        # Phiếu lỗi được tính là sai
+        name: round(sum(float(r['accuracy'].get(name, 0)) for r in ok) / len(results), 4)
+        for name in metric_names
+    } if results else {}
+
+    stage_names = sorted({name for r in ok for name in r['stage_timings']})
+    stage_timings = {
+        name: _summarize([r['stage_timings'][name] for r in ok if name in r['stage_timings']])
+        for name in stage_names
+    }
+
+    report = {
+        'benchmark': 'pipeline',
+        'stage': stage,
+        'noise': noise,
+        'seed': seed,
+        'count': len(results),
+        'warmup': warmup,
+        'workers': workers,
+        'page_width': width,
+        'yolo_backend': os.environ.get('YOLO_BACKEND', 'pytorch').lower(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'wall_seconds': round(wall_seconds, 3),
+        'sheets_per_sec': round(len(results) / wall_seconds, 3) if wall_seconds > 0 else None,
+        'latency_ms': _summarize([r['latency_ms'] for r in ok]),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'errors': len(results) - len(ok),
+        'error_samples': [r['error'] for r in results if r['error']][:5],
+        'accuracy': accuracy,
+        'stage_timings_ms': stage_timings,
+    }
+    if per_sheet:
+        report['sheets'] = results
+    return report
+
+
+def compare_reports(report, baseline):
+    """Chênh lệch các chỉ số chính so với một báo cáo trước (giá trị mới - cũ)"""
+    def delta(new, old):
+        return round(new - old, 4) if new is not None and old is not None else None
+
+    latency, base_latency = report.get('latency_ms') or {}, baseline.get('latency_ms') or {}
+    diff = {
+        'sheets_per_sec': delta(report.get('sheets_per_sec'), baseline.get('sheets_per_sec')),
+        'latency_p50_ms': delta(latency.get('p50'), base_latency.get('p50')),
+        'latency_p95_ms': delta(latency.get('p95'), base_latency.get('p95')),
+        'peak_rss_bytes': delta(report.get('peak_rss_bytes'), baseline.get('peak_rss_bytes')),
+        'errors': delta(report.get('errors'), baseline.get('errors')),
+    }
+    for name, value in report.get('accuracy', {}).items():
+        diff[f'accuracy_{name}'] = delta(value, baseline.get('accuracy', {}).get(name))
+    return diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pipeline chấm trên phiếu tổng hợp')
+    parser.add_argument('--stage', choices=STAGES, default='full')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--noise', choices=tuple(NOISE_PROFILES), default='light')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--students', type=int, default=45)
+    parser.add_argument('--width', type=int, default=DEFAULT_PAGE_WIDTH)
+    parser.add_argument('--output', help='File JSON kết quả (mặc định benchmarks/results/<stage>_<noise>_<thời gian>.json)')
+    parser.add_argument('--compare', help='Báo cáo JSON trước đó để so sánh')
+    parser.add_argument('--per-sheet', action='store_true', help='Ghi kết quả từng phiếu')
+    parser.add_argument('--keep', action='store_true', help='Giữ lại ảnh và artifact sinh ra')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    report = run_benchmark(stage=args.stage, count=args.count, noise=args.noise, seed=args.seed,
+                           workers=args.workers, warmup=args.warmup, num_students=args.students,
+                           width=args.width, keep=args.keep, per_sheet=args.per_sheet)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['compared_to'] = {'file': args.compare, 'delta': compare_reports(report, json.load(f))}
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{args.stage}_{args.noise}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    summary = {key: report[key] for key in ('stage', 'count', 'sheets_per_sec', 'latency_ms',
+                                            'peak_rss_bytes', 'errors', 'accuracy')}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"Report: {output}")
+
+
+if __name__ == '__main__':
+    main()
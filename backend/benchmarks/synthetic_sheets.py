@@ -0,0 +1,254 @@
+"""
+Sinh phiếu trả lời tổng hợp (synthetic) với đáp án đúng đã biết
+
+Phiếu được vẽ theo bố cục mà utils/image_processing.py cắt vùng:
+- Khung thông tin lớn nhất ở ô trên-trái (1/3 × 1/3 trang): tên ở nửa trên,
+  cột trái; MSSV (hàng 3–5) và STT (hàng 6–8) ở nửa dưới, cột trái
+- Ô mã đề vuông, cũng bắt đầu trong ô trên-trái
+- Đường kẻ ngang dài nhất trang (dùng để xoay thẳng) nằm dưới ô trên-trái
+- Bảng trả lời là contour lớn nhất: 3 cột × 20 câu, chữ A–D viết trong từng ô
+
+Nhiễu (xoay, mờ, ánh sáng không đều, nhiễu cảm biến, nén JPEG) theo các mức
+trong NOISE_PROFILES. Cùng seed cho ra cùng bộ phiếu.
+
+    python -m benchmarks.synthetic_sheets --count 20 --noise medium --out /tmp/sheets
+"""
+
+import argparse
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Mức nhiễu: góc xoay tối đa (độ), sigma làm mờ, độ lệch ánh sáng, độ lệch chuẩn nhiễu, chất lượng JPEG.
+# Góc xoay lẻ (không tròn độ) thường làm HoughLinesP của bước xoay thẳng bám vào đường
+# kẻ dọc của bảng trả lời; medium/heavy giữ lại trường hợp này để đo độ bền của pipeline.
+NOISE_PROFILES = {
+    'none': {'rotation': 0.0, 'blur': 0.0, 'lighting': 0.0, 'noise': 0.0, 'jpeg_quality': 95},
+    'light': {'rotation': 0.0, 'blur': 0.6, 'lighting': 0.10, 'noise': 3.0, 'jpeg_quality': 90},
+    'medium': {'rotation': 1.0, 'blur': 1.2, 'lighting': 0.25, 'noise': 6.0, 'jpeg_quality': 82},
+    'heavy': {'rotation': 3.0, 'blur': 2.0, 'lighting': 0.40, 'noise': 12.0, 'jpeg_quality': 65},
+}
+
+ANSWER_CHOICES = ('A', 'B', 'C', 'D')
+QUESTIONS_PER_COLUMN = 20
+ANSWER_COLUMNS = 3
+NUM_QUESTIONS = QUESTIONS_PER_COLUMN * ANSWER_COLUMNS
+DEFAULT_EXAM_CODES = ('101', '102', '103', '104')
+DEFAULT_PAGE_WIDTH = 1600
+# Tỉ lệ A4 (cao / rộng)
+PAGE_RATIO = 2 ** 0.5
+
+_HO = ['Nguyen', 'Tran', 'Le', 'Pham', 'Hoang', 'Huynh', 'Phan', 'Vu', 'Vo', 'Dang', 'Bui', 'Do', 'Ho', 'Ngo']
+_DEM = ['Van', 'Thi', 'Minh', 'Duc', 'Ngoc', 'Thanh', 'Quoc', 'Hoang', 'Gia', 'Bao', 'Anh', 'Thu']
+_TEN = ['An', 'Binh', 'Chi', 'Dung', 'Giang', 'Ha', 'Hieu', 'Hung', 'Khanh', 'Lan', 'Long', 'Mai',
+        'Nam', 'Nhi', 'Phuc', 'Quan', 'Son', 'Tam', 'Trang', 'Tuan', 'Vy', 'Yen']
+
+INK = (30, 30, 30)
+PAPER = (245, 245, 245)
+
+
+def make_roster(num_students, rng, first_mssv=20210000):
+    """Danh sách sinh viên cùng cột với df_part của process_df_student (STT, MSSV, HoDem, Ten)"""
+    mssv = first_mssv + rng.choice(max(10000, 2 * num_students), size=num_students, replace=False)
+    return pd.DataFrame({
+        'STT': np.arange(1, num_students + 1),
+        'MSSV': np.sort(mssv),
+        'HoDem': [f"{rng.choice(_HO)} {rng.choice(_DEM)}" for _ in range(num_students)],
+        'Ten': [str(rng.choice(_TEN)) for _ in range(num_students)],
+    })
+
+
+def make_answer_key(exam_codes, num_questions, rng):
+    """Đáp án dạng file Excel gốc: cột đầu là mã đề, các cột sau là đáp án câu 1..N"""
+    rows = [[code] + list(rng.choice(ANSWER_CHOICES, size=num_questions)) for code in exam_codes]
+    return pd.DataFrame(rows, columns=['Mã đề'] + list(range(1, num_questions + 1)))
+
+
+def _put_fitted(image, text, box, font=cv2.FONT_HERSHEY_SIMPLEX, thickness=2, max_scale=2.0):
+    """Viết text căn giữa trong box (x, y, w, h), co cỡ chữ cho vừa"""
+    x, y, w, h = box
+    scale = max_scale
+    while scale > 0.3:
+        (tw, th), _ = cv2.getTextSize(text, font, scale, thickness)
+        if tw <= w * 0.9 and th <= h * 0.7:
+            break
+        scale -= 0.1
+    (tw, th), _ = cv2.getTextSize(text, font, scale, thickness)
+    cv2.putText(image, text, (x + (w - tw) // 2, y + (h + th) // 2), font, scale, INK, thickness, cv2.LINE_AA)
+
+
+def render_clean_sheet(truth, width=DEFAULT_PAGE_WIDTH):
+    """
+    Vẽ phiếu chưa có nhiễu.
+
+    Args:
+        truth (dict): name, mssv, stt, exam_code, answers (list 'A'-'D' hoặc '' nếu bỏ trống).
+        width (int): Chiều rộng trang (px); chiều cao theo tỉ lệ A4.
+
+    Returns:
+        np.ndarray: Ảnh BGR.
+    """
+    height = int(round(width * PAGE_RATIO))
+    image = np.full((height, width, 3), PAPER, dtype=np.uint8)
+    margin = int(width * 0.025)
+    line = max(2, width // 500)
+
+    # Khung thông tin sinh viên
+    info_w, info_h = int(width * 0.66), int(height * 0.2)
+    cv2.rectangle(image, (margin, margin), (margin + info_w, margin + info_h), INK, line + 1)
+    field_w = int(info_w // 3.5)
+    cv2.line(image, (margin + field_w, margin), (margin + field_w, margin + info_h), INK, line)
+    cv2.line(image, (margin, margin + info_h // 2), (margin + info_w, margin + info_h // 2), INK, line)
+    half = info_h // 2
+    _put_fitted(image, truth['name'], (margin, margin, field_w, half), font=cv2.FONT_HERSHEY_SIMPLEX)
+    row = half // 8
+    bottom = margin + half
+    _put_fitted(image, str(truth['mssv']), (margin, bottom + 2 * row, field_w, 3 * row))
+    _put_fitted(image, str(truth['stt']), (margin, bottom + 5 * row, field_w, half - 5 * row))
+    _put_fitted(image, 'PHIEU TRA LOI', (margin + field_w, margin, info_w - field_w, half), thickness=3)
+
+    # Ô mã đề (vuông)
+    code_side = int(width * 0.14)
+    code_y = margin + info_h + int(height * 0.02)
+    cv2.rectangle(image, (margin, code_y), (margin + code_side, code_y + code_side), INK, line + 1)
+    _put_fitted(image, str(truth['exam_code']), (margin, code_y, code_side, code_side), thickness=4)
+
+    # Đường kẻ ngang dài nhất trang (dùng cho bước xoay thẳng)
+    rule_y = int(height * 0.36)
+    cv2.line(image, (margin, rule_y), (width - margin, rule_y), INK, line)
+
+    # Bảng trả lời: 3 cột × 20 câu, mỗi cột gồm ô số câu và ô đáp án
+    table_x, table_y = margin, int(height * 0.39)
+    table_w, table_h = width - 2 * margin, height - table_y - margin
+    cv2.rectangle(image, (table_x, table_y), (table_x + table_w, table_y + table_h), INK, line + 1)
+    column_w = table_w / ANSWER_COLUMNS
+    row_h = table_h / QUESTIONS_PER_COLUMN
+    number_w = column_w * 0.3
+    for c in range(ANSWER_COLUMNS):
+        cx = int(table_x + c * column_w)
+        if c:
+            cv2.line(image, (cx, table_y), (cx, table_y + table_h), INK, line + 1)
+        cv2.line(image, (int(cx + number_w), table_y), (int(cx + number_w), table_y + table_h), INK, line)
+    for r in range(1, QUESTIONS_PER_COLUMN):
+        ry = int(table_y + r * row_h)
+        cv2.line(image, (table_x, ry), (table_x + table_w, ry), INK, 1)
+
+    for q, answer in enumerate(truth['answers']):
+        c, r = divmod(q, QUESTIONS_PER_COLUMN)
+        cx, ry = int(table_x + c * column_w), int(table_y + r * row_h)
+        _put_fitted(image, str(q + 1), (cx, ry, int(number_w), int(row_h)), thickness=1, max_scale=0.8)
+        if answer:
+            _put_fitted(image, answer, (int(cx + number_w), ry, int(column_w - number_w), int(row_h)),
+                        font=cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, thickness=3, max_scale=1.6)
+    return image
+
+
+def apply_noise(image, profile, rng):
+    """Thêm ánh sáng không đều, xoay, mờ và nhiễu cảm biến theo một mức trong NOISE_PROFILES"""
+    params = NOISE_PROFILES[profile] if isinstance(profile, str) else profile
+    h, w = image.shape[:2]
+    result = image.astype(np.float32)
+
+    if params['lighting']:
+        # Dải sáng tuyến tính theo hướng ngẫu nhiên (bóng đổ khi chụp)
+        theta = rng.uniform(0, 2 * np.pi)
+        ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+        ramp = (np.cos(theta) * xs / w + np.sin(theta) * ys / h)
+        ramp = (ramp - ramp.min()) / max(float(np.ptp(ramp)), 1e-6)
+        result *= (1.0 - params['lighting'] * ramp)[..., None]
+
+    if params['rotation']:
+        angle = rng.uniform(-params['rotation'], params['rotation'])
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        result = cv2.warpAffine(result, matrix, (w, h), borderValue=PAPER)
+
+    if params['blur']:
+        result = cv2.GaussianBlur(result, (0, 0), params['blur'])
+
+    if params['noise']:
+        result += rng.normal(0, params['noise'], result.shape).astype(np.float32)
+
+    return np.clip(result, 0, 255).astype(np.uint8)
+
+
+def make_sheet_truth(roster_row, exam_codes, rng, num_questions=NUM_QUESTIONS, blank_rate=0.03):
+    answers = [str(a) for a in rng.choice(ANSWER_CHOICES, size=num_questions)]
+    for q in np.flatnonzero(rng.random(num_questions) < blank_rate):
+        answers[q] = ''
+    return {
+        'name': f"{roster_row['HoDem']} {roster_row['Ten']}",
+        'mssv': str(roster_row['MSSV']),
+        'stt': str(roster_row['STT']),
+        'exam_code': str(rng.choice(exam_codes)),
+        'answers': answers,
+    }
+
+
+def expected_score(answers, answer_key, exam_code):
+    """Số câu đúng theo đáp án đã biên dịch (compile_answer_key)"""
+    correct = answer_key.loc[str(exam_code)].tolist()
+    return sum(1 for a, k in zip(answers, correct) if a and a == k)
+
+
+def generate_dataset(out_dir, count, seed=0, noise='light', num_students=45,
+                     exam_codes=DEFAULT_EXAM_CODES, width=DEFAULT_PAGE_WIDTH, prefix='synthetic'):
+    """
+    Sinh `count` phiếu vào out_dir cùng danh sách sinh viên và đáp án.
+
+    Returns:
+        dict: roster (DataFrame), answer_key (DataFrame dạng file gốc),
+        sheets (list dict: filename, path + các trường của truth).
+    """
+    if noise not in NOISE_PROFILES:
+        raise ValueError(f"noise phải là một trong {tuple(NOISE_PROFILES)}")
+    rng = np.random.default_rng(seed)
+    roster = make_roster(max(num_students, 1), rng)
+    answer_key = make_answer_key(exam_codes, NUM_QUESTIONS, rng)
+    params = NOISE_PROFILES[noise]
+
+    os.makedirs(out_dir, exist_ok=True)
+    sheets = []
+    for i in range(count):
+        truth = make_sheet_truth(roster.iloc[i % len(roster)], exam_codes, rng)
+        image = apply_noise(render_clean_sheet(truth, width), params, rng)
+        filename = f"{prefix}_{i:04d}.jpg"
+        path = os.path.join(out_dir, filename)
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, params['jpeg_quality']])
+        sheets.append({'filename': filename, 'path': path, **truth})
+
+    return {'roster': roster, 'answer_key': answer_key, 'sheets': sheets}
+
+
+def write_manifest(dataset, out_dir):
+    """Ghi manifest.json (đáp án đúng từng phiếu), roster.csv và answer_key.csv"""
+    dataset['roster'].to_csv(os.path.join(out_dir, 'roster.csv'), index=False)
+    dataset['answer_key'].to_csv(os.path.join(out_dir, 'answer_key.csv'), index=False)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'sheets': dataset['sheets']}, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sinh phiếu trả lời tổng hợp')
+    parser.add_argument('--out', required=True, help='Thư mục ghi ảnh và manifest')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--noise', choices=tuple(NOISE_PROFILES), default='light')
+    parser.add_argument('--students', type=int, default=45)
+    parser.add_argument('--width', type=int, default=DEFAULT_PAGE_WIDTH)
+    args = parser.parse_args(argv)
+
+    dataset = generate_dataset(args.out, args.count, seed=args.seed, noise=args.noise,
+                               num_students=args.students, width=args.width)
+    print(write_manifest(dataset, args.out))
+
+
+if __name__ == '__main__':
+    main()
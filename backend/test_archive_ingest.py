@@ -0,0 +1,62 @@
+"""
+Tách trang ZIP: giới hạn tổng dung lượng tách ra và dọn dẹp khi vượt
+
+    python -m pytest -q test_archive_ingest.py
+"""
+
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip('fastapi')
+
+from utils.archive_ingest import ingest_archive, iter_archive_pages
+from utils.upload_storage import UploadBudget, UploadTooLarge
+
+
+class _RecordingSession:
+    """Phiên tối thiểu: ghi nhận ảnh được submit / discard"""
+    session_id = 'test'
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, filename):
+        self.submitted.append(filename)
+
+    def discard(self, filenames):
+        self.submitted = [f for f in self.submitted if f not in filenames]
+        return list(filenames)
+
+
+def _zip_with_pages(path, count, size):
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for i in range(count):
+            zf.writestr(f'scan/page_{i:02d}.jpg', b'\0' * size)
+
+
+def test_pages_within_budget_are_extracted(tmp_path):
+    archive = tmp_path / 'room.zip'
+    _zip_with_pages(archive, 3, 1000)
+    dest = tmp_path / 'images'
+
+    pages = list(iter_archive_pages(str(archive), 'room.zip', str(dest), UploadBudget(10_000)))
+
+    assert len(pages) == 3
+    assert sorted(os.listdir(dest)) == sorted(pages)
+
+
+def test_highly_compressible_archive_stops_at_budget_and_cleans_up(tmp_path):
+    # Archive vài KB nhưng tách ra 20 x 200 KB
+    archive = tmp_path / 'bomb.zip'
+    _zip_with_pages(archive, 20, 200_000)
+    assert os.path.getsize(archive) < 50_000
+    dest = tmp_path / 'images'
+    session = _RecordingSession()
+
+    with pytest.raises(UploadTooLarge):
+        ingest_archive(str(archive), 'bomb.zip', session, dest_dir=str(dest), budget=UploadBudget(1_000_000))
+
+    assert session.submitted == []
+    assert os.listdir(dest) == []
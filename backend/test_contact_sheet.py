@@ -0,0 +1,80 @@
+"""
+Contact sheet theo kỳ thi + phòng thi: không ghi đè giữa kỳ thi, cộng dồn các lô,
+xoá sprite thừa khi tạo lại
+
+    python -m pytest -q test_contact_sheet.py
+"""
+
+import os
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from utils import contact_sheet, results_store
+from utils.results_store import ResultsStore
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(contact_sheet, 'CONTACT_SHEET_DIR', str(tmp_path / 'contact_sheets'))
+    monkeypatch.setattr(contact_sheet, 'TEMP_IMAGES_DIR', str(tmp_path / 'temp'))
+    monkeypatch.setattr(contact_sheet, 'MAX_TILES_PER_SPRITE', 2)
+    monkeypatch.setattr(results_store, '_store_instance', ResultsStore(str(tmp_path / 'results.db')))
+    return tmp_path
+
+
+def _crop(workspace, image_name):
+    folder = workspace / 'temp' / image_name
+    folder.mkdir(parents=True)
+    Image.new('RGB', (80, 100), 'gray').save(folder / contact_sheet.GRADING_CROP_NAMES[1])
+    return {'image': f"{image_name}.jpg", 'imageName': image_name, 'id': image_name, 'score': 1}
+
+
+def _sprites(workspace):
+    return sorted(os.listdir(workspace / 'contact_sheets'))
+
+
+def test_same_room_in_two_exams_does_not_collide(workspace):
+    contact_sheet.build_contact_sheet('math.xlsx', 'A101', [_crop(workspace, 'm1')['imageName']])
+    contact_sheet.build_contact_sheet('physics.xlsx', 'A101', [_crop(workspace, 'p1')['imageName']])
+
+    assert list(contact_sheet.load_contact_sheet('math.xlsx', 'A101')['tiles']) == ['m1']
+    assert list(contact_sheet.load_contact_sheet('physics.xlsx', 'A101')['tiles']) == ['p1']
+    assert contact_sheet.sheet_key('x', 'A-1') != contact_sheet.sheet_key('x', 'A 1')
+
+
+def test_batches_accumulate_from_results_store(workspace):
+    store = results_store.get_results_store()
+    for batch in (['s1', 's2'], ['s3']):
+        students = [_crop(workspace, name) for name in batch]
+        job_id = store.create_job('math.xlsx', 'A101', 3)
+        store.save_sheets(job_id, 'math.xlsx', 'A101', students)
+        contact_sheet.build_contact_sheet_for_results('math.xlsx', 'A101', students)
+
+    manifest = contact_sheet.load_contact_sheet('math.xlsx', 'A101')
+    assert sorted(manifest['tiles']) == ['s1', 's2', 's3']
+    assert len(manifest['sprites']) == 2
+
+
+def test_rebuild_with_fewer_sprites_removes_stale_ones(workspace):
+    names = [_crop(workspace, f"s{i}")['imageName'] for i in range(5)]
+    contact_sheet.build_contact_sheet('math.xlsx', 'A101', names)
+    assert os.path.exists(contact_sheet.sprite_path('math.xlsx', 'A101', 2))
+
+    contact_sheet.build_contact_sheet('math.xlsx', 'A101', names[:2])
+
+    assert not os.path.exists(contact_sheet.sprite_path('math.xlsx', 'A101', 1))
+    assert not os.path.exists(contact_sheet.sprite_path('math.xlsx', 'A101', 2))
+    key = contact_sheet.sheet_key('math.xlsx', 'A101')
+    assert _sprites(workspace) == [f"{key}.json", f"{key}_0.webp"]
+
+
+def test_rebuild_changes_manifest_version(workspace):
+    names = [_crop(workspace, 's1')['imageName']]
+
+    first = contact_sheet.build_contact_sheet('math.xlsx', 'A101', names)
+    second = contact_sheet.build_contact_sheet('math.xlsx', 'A101', names)
+
+    assert first['version'] != second['version']
+    assert contact_sheet.load_contact_sheet('math.xlsx', 'A101')['version'] == second['version']
@@ -0,0 +1,62 @@
+"""
+Phiên ingest: dọn phiên bị bỏ dở theo TTL
+
+    python -m pytest -q test_ingest_session.py
+"""
+
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+ingest_session = pytest.importorskip('utils.ingest_session')
+
+
+@pytest.fixture(autouse=True)
+def clean_sessions():
+    ingest_session._sessions.clear()
+    yield
+    ingest_session._sessions.clear()
+
+
+def _session(last_activity, futures=()):
+    session = ingest_session.IngestSession('P101')
+    session.last_activity = last_activity
+    session.futures = {f'img_{i}.jpg': future for i, future in enumerate(futures)}
+    ingest_session._sessions[session.session_id] = session
+    return session
+
+
+def test_idle_sessions_are_evicted_and_pending_work_cancelled():
+    pending = Future()
+    idle = _session(last_activity=0, futures=[pending])
+    active = _session(last_activity=1000)
+
+    assert ingest_session.evict_idle_sessions(ttl=100, now=1050) == 1
+
+    assert ingest_session.get_session(idle.session_id) is None
+    assert ingest_session.get_session(active.session_id) is active
+    assert pending.cancelled()
+
+
+def test_session_with_running_image_is_kept_until_it_finishes():
+    running = Future()
+    assert running.set_running_or_notify_cancel()
+    session = _session(last_activity=0, futures=[running])
+
+    assert ingest_session.evict_idle_sessions(ttl=100, now=1050) == 0
+    assert ingest_session.get_session(session.session_id) is session
+
+    running.set_result(None)
+    assert ingest_session.evict_idle_sessions(ttl=100, now=1050) == 1
+
+
+def test_second_finalize_is_rejected():
+    session = _session(last_activity=0)
+    session.roster, session.key = {'df_part': None}, {'df_key': None}
+
+    assert session.close() == {}
+    with pytest.raises(ingest_session.SessionFinalized):
+        session.close()
+    with pytest.raises(ingest_session.SessionFinalized):
+        session.submit('late.jpg')
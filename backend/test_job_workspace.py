@@ -0,0 +1,67 @@
+"""
+Thư mục job / artifact: không dùng chung giữa các job, dọn dẹp lúc khởi động
+không xóa job đang chạy của process khác
+
+    python -m pytest -q test_job_workspace.py
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utils import job_workspace
+from utils.job_workspace import JobWorkspace, cleanup_stale_jobs, sheet_dirs_for, sheet_key_for
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_workspace, 'JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setattr(job_workspace, 'SHEETS_DIR', str(tmp_path / 'temp'))
+    return tmp_path
+
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_same_image_gets_a_directory_per_run(dirs):
+    image = dirs / 'scan.jpg'
+    image.write_bytes(b'same content')
+
+    first, second = sheet_key_for(str(image)), sheet_key_for(str(image))
+
+    assert first != second
+    assert first.split('_')[0] == second.split('_')[0]
+    for key in (first, second):
+        os.makedirs(job_workspace.sheet_dir_for(key))
+    assert sorted(sheet_dirs_for(str(image))) == sorted(job_workspace.sheet_dir_for(k) for k in (first, second))
+
+
+def test_startup_cleanup_keeps_live_workspaces(dirs):
+    jobs = dirs / 'jobs'
+    with JobWorkspace() as live:
+        dead = jobs / f"job_{_dead_pid()}_abc"
+        old = jobs / 'job_legacy'
+        fresh_legacy = jobs / 'job_recent'
+        for path in (dead, old, fresh_legacy):
+            path.mkdir()
+        past = time.time() - job_workspace.JOB_WORKSPACE_STALE_SECONDS - 60
+        os.utime(old, (past, past))
+
+        removed = cleanup_stale_jobs()
+
+        assert removed == 2
+        assert sorted(os.listdir(jobs)) == sorted([os.path.basename(live.path), 'job_recent'])
+
+
+@pytest.mark.parametrize('filename', ['../../x/evil.jpg', '..\\..\\evil.jpg', '/etc/evil.jpg', 'evil.JPG'])
+def test_safe_filename_keeps_uploads_inside_target_directory(filename):
+    name = job_workspace.safe_filename(filename)
+
+    assert os.path.dirname(name) == ''
+    assert name.endswith('.jpg') and '..' not in name
@@ -0,0 +1,39 @@
+"""
+/debug/memory: chỉ mở khi đã cấu hình token và request gửi đúng token
+
+    python -m pytest -q test_memory_guard.py
+"""
+
+import tracemalloc
+
+import pytest
+
+from utils import memory_guard
+
+
+def test_no_token_configured_denies_everyone(monkeypatch):
+    monkeypatch.setattr(memory_guard, 'MEMORY_DEBUG_TOKEN', '')
+
+    assert not memory_guard.memory_debug_allowed({})
+    assert not memory_guard.memory_debug_allowed({'x-debug-token': ''})
+
+
+def test_configured_token_must_match(monkeypatch):
+    monkeypatch.setattr(memory_guard, 'MEMORY_DEBUG_TOKEN', 's3cret')
+
+    assert memory_guard.memory_debug_allowed({'x-debug-token': 's3cret'})
+    assert not memory_guard.memory_debug_allowed({'x-debug-token': 'guess'})
+    assert not memory_guard.memory_debug_allowed({})
+
+
+def test_endpoint_rejects_unauthorized_trace_start(monkeypatch):
+    app_module = pytest.importorskip('app')
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(memory_guard, 'MEMORY_DEBUG_TOKEN', 's3cret')
+    client = TestClient(app_module.app)
+    was_tracing = tracemalloc.is_tracing()
+
+    assert client.get('/debug/memory?trace=start').status_code == 404
+    assert tracemalloc.is_tracing() == was_tracing
+    assert client.get('/debug/memory', headers={'X-Debug-Token': 's3cret'}).status_code == 200
@@ -0,0 +1,38 @@
+"""
+Micro-benchmark: chế độ kiểm tra không được "pass" khi không có baseline
+
+    python -m pytest -q test_micro_benchmark.py
+"""
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from benchmarks.micro_benchmark import EXIT_NO_BASELINE, check_regressions, main
+
+FAST_ARGS = ['--quick', '--filter', 'split_columns[60q', '--min-time', '0.001', '--repeat', '1']
+
+
+def test_missing_baseline_fails_check_mode(tmp_path):
+    baseline = str(tmp_path / 'missing.json')
+
+    assert main(FAST_ARGS + ['--baseline', baseline]) == EXIT_NO_BASELINE
+    assert main(FAST_ARGS + ['--baseline', baseline, '--allow-missing-baseline']) == 0
+
+
+def test_saved_baseline_is_compared(tmp_path):
+    baseline = str(tmp_path / 'baseline.json')
+
+    assert main(FAST_ARGS + ['--baseline', baseline, '--save-baseline']) == 0
+    # Ngưỡng rộng: chỉ kiểm tra là có so sánh, không đo hiệu năng máy chạy test
+    assert main(FAST_ARGS + ['--baseline', baseline, '--max-regression', '100', '--max-alloc-regression', '100']) == 0
+    assert main(['--quick', '--filter', 'score_answers', '--min-time', '0.001', '--repeat', '1',
+                 '--baseline', baseline]) == EXIT_NO_BASELINE
+
+
+def test_check_regressions_flags_slower_and_larger_cases():
+    baseline = {'case': {'median_us': 100.0, 'peak_bytes': 10_000}}
+
+    assert check_regressions({'case': {'median_us': 110.0, 'peak_bytes': 10_000}}, baseline) == []
+    failures = check_regressions({'case': {'median_us': 200.0, 'peak_bytes': 100_000}}, baseline)
+    assert len(failures) == 2
@@ -0,0 +1,83 @@
+"""
+Qwen detector: fallback khi transformers không hỗ trợ stop_strings
+
+    python -m pytest -q test_qwen_detector.py
+"""
+
+import pytest
+
+qwen_detector = pytest.importorskip('utils.qwen_detector')
+from utils.qwen_detector import FIELD_POLICIES, QwenDetector
+
+
+class _Inputs(dict):
+    def __init__(self):
+        super().__init__(input_ids=[[1, 2]])
+        self.input_ids = [[1, 2]]
+
+    def to(self, device):
+        return self
+
+
+class _Processor:
+    tokenizer = object()
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        return 'prompt'
+
+    def __call__(self, **kwargs):
+        return _Inputs()
+
+    def batch_decode(self, ids, **kwargs):
+        return ['20123456\nextra']
+
+
+class _OldTransformersModel:
+    """generate của transformers cũ: kwargs lạ -> ValueError"""
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, **kwargs):
+        self.calls.append(kwargs)
+        if 'stop_strings' in kwargs:
+            raise ValueError("The following `model_kwargs` are not used by the model: ['stop_strings', 'tokenizer']")
+        return [[1, 2, 3]]
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    monkeypatch.setattr(QwenDetector, '_load_model', lambda self: None)
+    detector = QwenDetector()
+    detector.model = _OldTransformersModel()
+    detector.processor = _Processor()
+    return detector
+
+
+def test_value_error_on_stop_strings_falls_back_once(detector, tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    crop = tmp_path / 'id.png'
+    Image.new('RGB', (200, 60), 'white').save(crop)
+
+    assert detector.extract_text_from_image(str(crop), 'MSSV?', field='id') == '20123456'
+    assert detector.extract_text_from_image(str(crop), 'MSSV?', field='id') == '20123456'
+
+    assert not detector.stop_strings_supported
+    assert [('stop_strings' in call) for call in detector.model.calls] == [True, False, False]
+
+
+def test_only_used_field_policies_are_defined():
+    assert set(FIELD_POLICIES) == {'name', 'id', 'default'}
+
+
+def test_unrelated_value_error_does_not_disable_stop_strings(detector, tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    crop = tmp_path / 'id.png'
+    Image.new('RGB', (200, 60), 'white').save(crop)
+
+    def broken_generate(**kwargs):
+        raise ValueError('Input image size (0, 0) is invalid')
+
+    detector.model.generate = broken_generate
+
+    assert detector.extract_text_from_image(str(crop), 'MSSV?', field='id') is None
+    assert detector.stop_strings_supported
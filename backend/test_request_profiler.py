@@ -0,0 +1,64 @@
+"""
+Request profiler: mặc định tắt nếu chưa cấu hình PROFILE_TOKEN
+
+    python -m pytest -q test_request_profiler.py
+"""
+
+import asyncio
+import importlib
+
+import pytest
+
+pytest.importorskip('starlette')
+
+from utils import request_profiler
+
+
+def _reload(monkeypatch, **env):
+    for name in ('PROFILING_ENABLED', 'PROFILE_TOKEN'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return importlib.reload(request_profiler)
+
+
+@pytest.fixture(autouse=True)
+def restore_module():
+    yield
+    importlib.reload(request_profiler)
+
+
+def _scope(headers=(), query=b''):
+    return {'type': 'http', 'method': 'GET', 'path': '/', 'headers': list(headers), 'query_string': query}
+
+
+def test_disabled_by_default_without_token(monkeypatch):
+    module = _reload(monkeypatch)
+
+    assert not module.PROFILING_ENABLED
+    assert not module.profiles_access_allowed({'x-profile': '1'})
+
+
+def test_token_enables_profiling_and_is_required(monkeypatch):
+    module = _reload(monkeypatch, PROFILE_TOKEN='s3cret')
+
+    assert module.PROFILING_ENABLED
+    assert module.profiling_requested(_scope([(b'x-profile', b's3cret')]))
+    assert not module.profiling_requested(_scope([(b'x-profile', b'1')]))
+    assert not module.profiling_requested(_scope(query=b'profile=1'))
+    assert module.profiles_access_allowed({'x-profile': 's3cret'})
+    assert not module.profiles_access_allowed({})
+
+
+def test_disabled_middleware_passes_requests_through(monkeypatch, tmp_path):
+    module = _reload(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope['path'])
+
+    asyncio.run(module.ProfilingMiddleware(app)(_scope([(b'x-profile', b'1')]), None, None))
+
+    assert calls == ['/']
+    assert not (tmp_path / 'uploads').exists()
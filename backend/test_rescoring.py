@@ -0,0 +1,177 @@
+"""
+Chấm lại từ kết quả đã lưu: chấm lại cả đề theo đáp án mới (score set,
+room_stats) và chạy lại một stage cho một bài (artifact ghi vào thư mục riêng
+của bài, thư mục của lần chấm gốc không bị sửa)
+
+    python -m pytest -q test_rescoring.py
+"""
+
+import os
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+rescoring = pytest.importorskip('utils.rescoring')
+
+from utils import job_workspace, results_store
+from utils.processing_result_file import compile_answer_key
+from utils.results_store import ResultsStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_workspace, 'JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setattr(job_workspace, 'SHEETS_DIR', str(tmp_path / 'temp'))
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    monkeypatch.setattr(results_store, '_store_instance', store)
+    df_key = compile_answer_key(pd.DataFrame([['Mã đề', 'Câu 1'], ['101', 'A'], ['102', 'B']]))
+    monkeypatch.setattr(rescoring, '_load_job_key', lambda store, sheet: (store.get_job(sheet['job_id']), df_key))
+    return store
+
+
+def _saved_sheet(store, image_name):
+    sheet_dir = job_workspace.sheet_dir_for(image_name)
+    os.makedirs(sheet_dir)
+    for crop_name in ('code_box_bounding_box.jpg', 'table_grading_bounding_box.jpg', 'table_with_bboxes.jpg'):
+        with open(os.path.join(sheet_dir, crop_name), 'wb') as f:
+            f.write(b'original')
+    job_id = store.create_job('math.xlsx', 'A101', 1, 'math.xlsx')
+    [sheet_id] = store.save_sheets(job_id, 'math.xlsx', 'A101', [{
+        'image': 'scan.jpg', 'imageName': image_name, 'testVariant': '101', 'answers': ['A'], 'score': 1,
+        'num_questions': 1, 'processedGradingImage': f'temp/{image_name}/table_with_bboxes.jpg',
+    }])
+    return sheet_id, sheet_dir
+
+
+def test_rerun_publishes_to_a_sheet_scoped_directory(store, monkeypatch):
+    sheet_id, original_dir = _saved_sheet(store, 'abc_1')
+
+    def fake_stage(stage, crop_path, roster=None):
+        with open(crop_path, 'wb') as f:
+            f.write(b'rerun')
+        processed = os.path.join(os.path.dirname(crop_path), 'table_with_bboxes.jpg')
+        with open(processed, 'wb') as f:
+            f.write(b'rerun')
+        return {'student_result': {1: 'B'}, 'processed_image_path': processed}
+
+    monkeypatch.setattr(rescoring, 'run_stage', fake_stage)
+
+    delta = rescoring.rerun_sheet_stage(sheet_id, 'grading')
+
+    row = store.get_sheet(sheet_id)
+    assert row['imageName'].startswith(f'sheet{sheet_id}_')
+    assert row['processedGradingImage'] == f"temp/{row['imageName']}/table_with_bboxes.jpg"
+    assert delta['result']['imageName'] == row['imageName']
+    new_dir = job_workspace.sheet_dir_for(row['imageName'])
+    with open(os.path.join(new_dir, 'table_grading_bounding_box.jpg'), 'rb') as f:
+        assert f.read() == b'rerun'
+    with open(os.path.join(new_dir, 'code_box_bounding_box.jpg'), 'rb') as f:
+        assert f.read() == b'original'
+    # Thư mục gốc (có thể được job khác dùng) giữ nguyên
+    for name in os.listdir(original_dir):
+        with open(os.path.join(original_dir, name), 'rb') as f:
+            assert f.read() == b'original'
+
+
+def test_two_reruns_of_the_same_image_do_not_share_a_directory(store, monkeypatch):
+    first, _ = _saved_sheet(store, 'abc_1')
+    second, _ = _saved_sheet(store, 'abc_2')
+    monkeypatch.setattr(rescoring, 'run_stage', lambda stage, crop_path, roster=None: {'exam_code': '102'})
+
+    rescoring.rerun_sheet_stage(first, 'code_box')
+    rescoring.rerun_sheet_stage(second, 'code_box')
+
+    assert store.get_sheet(first)['imageName'] != store.get_sheet(second)['imageName']
+    assert store.get_sheet(first)['testVariant'] == '102'
+
+
+def _key(rows):
+    return compile_answer_key(pd.DataFrame([['Mã đề', 'Câu 1', 'Câu 2', 'Câu 3', 'Câu 4']] + rows))
+
+
+def _student(image, variant, answers, score):
+    return {
+        'image': image, 'imageName': image, 'testVariant': variant, 'answers': answers, 'score': score,
+        'num_questions': 4, 'name': 'Nguyen Van An', 'id': '20210001', 'index_student': '1',
+        'correction_status': 'exact_match', 'has_issue': False,
+    }
+
+
+def _fresh_room_stats(store, job_id):
+    """Tổng hợp tính lại từ đầu trên bảng sheets (cùng công thức với room_stats)"""
+    row = store.connection().execute(
+        "SELECT COUNT(*) AS sheet_count, COALESCE(SUM(score), 0) AS score_sum, SUM(has_issue) AS issue_count, "
+        "SUM(CASE WHEN num_questions > 0 AND score * 10.0 / num_questions >= 5 THEN 1 ELSE 0 END) AS passed_count "
+        "FROM sheets WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    return dict(row)
+
+
+def _stored_room_stats(store, job_id):
+    stats = store.get_room_stats(job_id)
+    return {k: stats[k] for k in ('sheet_count', 'score_sum', 'issue_count', 'passed_count')}
+
+
+def test_rescore_exam_writes_score_set_and_rebuilds_room_stats(store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'uploads' / 'key').mkdir(parents=True)
+    (tmp_path / 'uploads' / 'key' / 'v2.xlsx').write_bytes(b'new key')
+    new_key = _key([['101', 'A', 'B', 'C', 'A'], ['102', 'D', 'C', 'B', 'A']])
+    monkeypatch.setattr(rescoring, 'load_key_context', lambda filename: {'df_key': new_key, 'num_questions': 4})
+
+    job_id = store.create_job('math.xlsx', 'A101', 4, 'math.xlsx')
+    ids = store.save_sheets(job_id, 'math.xlsx', 'A101', [
+        _student('s1.jpg', '101', ['A', 'B', 'C', 'D'], 4),
+        # Ký tự ngoài latin-1 trong câu trả lời đã lưu không được làm hỏng cả lượt chấm lại
+        _student('s2.jpg', '102', ['Ă', 'C', 'B', 'A'], 3),
+        _student('s3.jpg', '999', ['A', 'B', 'C', 'D'], 0),
+    ])
+
+    result = rescoring.rescore_exam('math.xlsx', 'v2.xlsx')
+
+    assert result['sheet_count'] == 3
+    assert result['changes'] == [{'sheet_id': ids[0], 'score_before': 4, 'score_after': 3}]
+    assert result['unknown_exam_code_count'] == 1
+    assert store.get_score_set_scores(result['score_set_id']) == {ids[0]: 3, ids[1]: 3, ids[2]: 0}
+    [score_set] = store.list_score_sets('math.xlsx')
+    assert score_set['answer_key_filename'] == 'v2.xlsx'
+    assert [store.get_sheet(i)['score'] for i in ids] == [3, 3, 0]
+    assert store.get_sheet(ids[2])['has_issue']
+    assert store.get_job(job_id)['answer_key_filename'] == 'v2.xlsx'
+    assert _stored_room_stats(store, job_id) == _fresh_room_stats(store, job_id)
+
+
+def test_edit_sheet_applies_room_stats_delta_and_records_edits(store, monkeypatch):
+    key = _key([['101', 'A', 'B', 'C', 'D'], ['102', 'D', 'C', 'B', 'A']])
+    monkeypatch.setattr(rescoring, '_load_job_key', lambda store, sheet: (store.get_job(sheet['job_id']), key))
+    job_id = store.create_job('math.xlsx', 'A101', 4, 'math.xlsx')
+    first, second = store.save_sheets(job_id, 'math.xlsx', 'A101', [
+        _student('s1.jpg', '101', ['A', 'B', '', ''], 2),
+        _student('s2.jpg', '101', ['A', 'B', 'C', 'D'], 4),
+    ])
+    assert _stored_room_stats(store, job_id) == {'sheet_count': 2, 'score_sum': 6, 'issue_count': 0, 'passed_count': 2}
+
+    delta = rescoring.edit_sheet(first, {'answers': {3: 'c', 4: 'D'}, 'testVariant': '102'})
+
+    assert delta['score_before'] == 2 and delta['score_after'] == 0 and delta['score_delta'] == -2
+    assert delta['changed_questions'] == [3, 4]
+    assert delta['changed_fields'] == ['answers', 'testVariant']
+    assert delta['result']['answers'] == ['A', 'B', 'C', 'D']
+    assert [(e['field'], e['old_value'], e['new_value']) for e in store.list_edits(first)] == [
+        ('testVariant', '101', '102'), ('answers', 'AB--', 'ABCD'),
+    ]
+    expected = {'sheet_count': 2, 'score_sum': 4, 'issue_count': 0, 'passed_count': 1}
+    assert {k: delta['room_stats'][k] for k in expected} == expected
+    assert _stored_room_stats(store, job_id) == _fresh_room_stats(store, job_id) == expected
+
+    # Mã đề không có trong đáp án: bài bị đánh dấu có vấn đề
+    delta = rescoring.edit_sheet(second, {'testVariant': '999'})
+
+    assert delta['has_issue'] and delta['score_delta'] == -4
+    assert _stored_room_stats(store, job_id) == _fresh_room_stats(store, job_id) == \
+        {'sheet_count': 2, 'score_sum': 0, 'issue_count': 1, 'passed_count': 0}
+
+
+def test_edit_sheet_rejects_unknown_fields(store):
+    with pytest.raises(rescoring.EditError):
+        rescoring.edit_sheet(1, {'score': 10})
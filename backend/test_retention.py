@@ -0,0 +1,84 @@
+"""
+Retention: không xóa ảnh / vùng cắt mà results store còn trỏ tới
+
+    python -m pytest -q test_retention.py
+"""
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip('starlette')
+
+from utils import retention
+from utils.retention import DAY, RetentionManager
+from utils.results_store import ResultsStore
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    images = tmp_path / 'uploads' / 'images'
+    (images / 'temp').mkdir(parents=True)
+    return images
+
+
+def _touch(path, age):
+    if not path.exists():
+        path.write_bytes(b'x' * 10)
+    past = time.time() - age
+    os.utime(path, (past, past))
+
+
+def _classes():
+    return [
+        ('images', retention.IMAGES_DIR, 'file', 1 * DAY, None),
+        ('sheet_artifacts', retention.SHEETS_DIR, 'dir', 1 * DAY, None),
+    ]
+
+
+def test_expired_files_referenced_by_live_results_are_kept(uploads, monkeypatch):
+    store = ResultsStore(os.path.join('uploads', 'results.db'))
+    monkeypatch.setattr('utils.results_store._store_instance', store)
+    job_id = store.create_job('math.xlsx', 'A101', 3)
+    store.save_sheets(job_id, 'math.xlsx', 'A101', [{
+        'image': 'kept.jpg', 'imageName': 'abc_1', 'processedGradingImage': 'temp/abc_1/table.jpg',
+    }])
+
+    old = 5 * DAY
+    for name in ('kept.jpg', 'orphan.jpg'):
+        _touch(uploads / name, old)
+    for name in ('abc_1', 'orphan_dir'):
+        (uploads / 'temp' / name).mkdir()
+        _touch(uploads / 'temp' / name / 'table.jpg', old)
+        _touch(uploads / 'temp' / name, old)
+
+    snapshot = RetentionManager(classes=_classes(), quota_bytes=0, min_age_seconds=0).sweep()
+
+    assert sorted(os.listdir(uploads)) == ['kept.jpg', 'temp']
+    assert os.listdir(uploads / 'temp') == ['abc_1']
+    assert snapshot['kept_referenced'] == 2
+
+
+def test_referenced_files_survive_quota_eviction(uploads):
+    for name in ('a.jpg', 'b.jpg'):
+        _touch(uploads / name, 2 * 3600)
+    referenced = {os.path.normpath(os.path.join(retention.IMAGES_DIR, 'a.jpg'))}
+
+    manager = RetentionManager(classes=_classes(), quota_bytes=5, min_age_seconds=0,
+                               references=lambda now: referenced)
+    manager.sweep()
+
+    assert sorted(os.listdir(uploads)) == ['a.jpg', 'temp']
+
+
+def test_unreadable_store_skips_deletions(uploads):
+    _touch(uploads / 'old.jpg', 5 * DAY)
+
+    def broken(now):
+        raise RuntimeError('database is locked')
+
+    RetentionManager(classes=_classes(), quota_bytes=0, min_age_seconds=0, references=broken).sweep()
+
+    assert 'old.jpg' in os.listdir(uploads)
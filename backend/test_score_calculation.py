@@ -0,0 +1,62 @@
+"""
+Biên dịch đáp án (compile_answer_key) và chấm điểm
+
+    python -m pytest -q test_score_calculation.py
+"""
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from utils.grading import score_answer_matrix, score_answers
+from utils.processing_result_file import compile_answer_key
+
+
+def _key_sheet():
+    return pd.DataFrame([
+        ['Mã đề', 'Câu 1', 'Câu 2', 'Câu 3'],
+        [101.0, 'a', 'B', 'C'],
+        [' 102 ', 'D', 'x', None],
+        [101, 'A', 'A', 'A'],
+    ])
+
+
+def test_compile_answer_key_normalizes_codes_and_answers():
+    key = compile_answer_key(_key_sheet())
+
+    assert key.index.tolist() == ['102', '101']
+    assert key.columns.tolist() == [1, 2, 3]
+    assert key.loc['101'].tolist() == ['A', 'A', 'A']  # mã đề trùng lấy dòng cuối
+    assert key.loc['102'].tolist() == ['D', '', '']
+
+
+@pytest.mark.parametrize('df', [
+    pd.DataFrame(),
+    pd.DataFrame(columns=['Mã đề', 'Câu 1', 'Câu 2']),
+    pd.DataFrame({'Mã đề': pd.Series([], dtype=float), 'Câu 1': pd.Series([], dtype=float)}),
+])
+def test_compile_answer_key_empty_sheet_gives_empty_key(df):
+    key = compile_answer_key(df)
+
+    assert key.empty
+    assert key.index.tolist() == []
+
+
+def test_score_answers_and_matrix_agree():
+    key = compile_answer_key(_key_sheet())
+
+    assert score_answers(['A', 'A', 'B'], key, '101') == 2
+    assert score_answers(['A', 'A', 'B'], key, '999') == 0
+
+    scores, known = score_answer_matrix(['AAB', 'D--'], ['101', '102'], key)
+    assert scores.tolist() == [2, 1]
+    assert known.tolist() == [True, True]
+
+
+def test_score_matrix_tolerates_answers_outside_latin1():
+    key = compile_answer_key(_key_sheet())
+
+    scores, known = score_answer_matrix(['AĂB', '€'], ['101', '102'], key)
+
+    assert scores.tolist() == [1, 0]
+    assert known.tolist() == [True, True]
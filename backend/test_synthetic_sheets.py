@@ -0,0 +1,101 @@
+"""
+Phiếu tổng hợp cho benchmark: sinh lặp lại được theo seed, đáp án đúng khớp với
+cách chấm thật, và các stage benchmark chạy được không cần model
+
+    python -m pytest -q test_synthetic_sheets.py
+"""
+
+import json
+import os
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+pytest.importorskip('pandas')
+
+from benchmarks.pipeline_benchmark import compare_reports, run_benchmark
+from benchmarks.synthetic_sheets import NUM_QUESTIONS, expected_score, generate_dataset, write_manifest
+from utils.grading import score_answers
+from utils.processing_result_file import compile_answer_key
+
+
+def _truth(dataset):
+    return [{k: v for k, v in sheet.items() if k != 'path'} for sheet in dataset['sheets']]
+
+
+def test_same_seed_gives_same_sheets(tmp_path):
+    first = generate_dataset(str(tmp_path / 'a'), count=2, seed=7, noise='light', width=800)
+    second = generate_dataset(str(tmp_path / 'b'), count=2, seed=7, noise='light', width=800)
+    other = generate_dataset(str(tmp_path / 'c'), count=2, seed=8, noise='light', width=800)
+
+    assert _truth(first) == _truth(second)
+    assert _truth(first) != _truth(other)
+    assert first['roster'].equals(second['roster'])
+    for a, b in zip(first['sheets'], second['sheets']):
+        with open(a['path'], 'rb') as fa, open(b['path'], 'rb') as fb:
+            assert fa.read() == fb.read()
+
+
+def test_sheet_truth_matches_roster_and_answer_key(tmp_path):
+    dataset = generate_dataset(str(tmp_path), count=3, seed=1, noise='none', width=800)
+    key = compile_answer_key(dataset['answer_key'])
+    roster_mssv = set(dataset['roster']['MSSV'].astype(str))
+
+    for sheet in dataset['sheets']:
+        assert sheet['mssv'] in roster_mssv
+        assert len(sheet['answers']) == NUM_QUESTIONS
+        assert sheet['exam_code'] in key.index
+        assert expected_score(sheet['answers'], key, sheet['exam_code']) == \
+            score_answers(sheet['answers'], key, sheet['exam_code'])
+        assert cv2.imread(sheet['path']) is not None
+
+
+def test_manifest_round_trip(tmp_path):
+    dataset = generate_dataset(str(tmp_path), count=2, seed=2, noise='none', width=800)
+
+    with open(write_manifest(dataset, str(tmp_path)), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    assert manifest['sheets'] == dataset['sheets']
+    assert {'roster.csv', 'answer_key.csv'} <= set(os.listdir(tmp_path))
+
+
+def test_unknown_noise_profile_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        generate_dataset(str(tmp_path), count=1, noise='heavy-rain')
+
+
+def test_image_processing_stage_report(tmp_path, monkeypatch):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+
+    report = run_benchmark(stage='image_processing', count=2, warmup=0, noise='none', per_sheet=True)
+
+    assert report['count'] == 2 and report['errors'] == 0, report['error_samples']
+    assert report['accuracy'] == {'crops': 1.0}
+    assert report['latency_ms']['p50'] > 0
+    assert [name for name in os.listdir(tmp_path) if name.startswith('bench_')] == []
+
+
+def test_scoring_stage_scores_every_sheet_correctly():
+    pytest.importorskip('utils.grading_pipeline')
+
+    report = run_benchmark(stage='scoring', count=3, warmup=0, noise='none')
+
+    assert report['errors'] == 0, report['error_samples']
+    assert report['accuracy']['score'] == 1.0
+
+
+def test_compare_reports_gives_new_minus_old():
+    old = {'sheets_per_sec': 2.0, 'latency_ms': {'p50': 500, 'p95': 900}, 'peak_rss_bytes': 100,
+           'errors': 1, 'accuracy': {'score': 0.9}}
+    new = {'sheets_per_sec': 2.5, 'latency_ms': {'p50': 400, 'p95': None}, 'peak_rss_bytes': 150,
+           'errors': 0, 'accuracy': {'score': 1.0, 'mssv': 0.8}}
+
+    diff = compare_reports(new, old)
+
+    assert diff['sheets_per_sec'] == 0.5
+    assert diff['latency_p50_ms'] == -100
+    assert diff['latency_p95_ms'] is None
+    assert diff['errors'] == -1
+    assert diff['accuracy_score'] == 0.1
+    assert diff['accuracy_mssv'] is None
@@ -0,0 +1,70 @@
+"""
+Engine Tesseract thường trú (tesserocr) và fallback pytesseract cho cùng kết quả
+
+Cả hai backend đọc cùng crop ô mã đề (chữ số vẽ bằng OpenCV) với cấu hình của
+get_digits_engine. Cần tesserocr, pytesseract và binary tesseract; thiếu thì bỏ qua.
+
+    python -m pytest -q test_tesseract_engine.py
+"""
+
+import shutil
+import sys
+import types
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from utils import tesseract_engine
+from utils.tesseract_engine import DIGITS_WHITELIST, PSM_SINGLE_BLOCK, TesseractEngine
+
+
+def _code_box_crop(text):
+    crop = np.full((80, 220), 255, dtype=np.uint8)
+    cv2.putText(crop, text, (14, 58), cv2.FONT_HERSHEY_SIMPLEX, 1.6, 0, 3, cv2.LINE_AA)
+    return crop
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        TesseractEngine(backend='opencv')
+
+
+@pytest.mark.skipif(tesseract_engine.TESSEROCR_AVAILABLE, reason='tesserocr đã được cài')
+def test_startup_check_reports_fallback(caplog):
+    assert tesseract_engine.check_tesseract_backend() == 'pytesseract'
+    assert 'tesserocr not installed' in caplog.text
+
+
+@pytest.mark.parametrize('text', ['101', '2047', '38'])
+def test_tesserocr_and_pytesseract_agree(text):
+    if not tesseract_engine.TESSEROCR_AVAILABLE:
+        pytest.skip('tesserocr chưa được cài')
+    pytest.importorskip('pytesseract')
+    if shutil.which('tesseract') is None:
+        pytest.skip('Không có binary tesseract cho pytesseract')
+
+    crop = _code_box_crop(text)
+    resident = TesseractEngine(psm=PSM_SINGLE_BLOCK, whitelist=DIGITS_WHITELIST, backend='tesserocr')
+    subprocess_engine = TesseractEngine(psm=PSM_SINGLE_BLOCK, whitelist=DIGITS_WHITELIST, backend='pytesseract')
+    try:
+        resident_text = resident.recognize(crop).strip()
+        subprocess_text = subprocess_engine.recognize(crop).strip()
+    finally:
+        resident.close()
+
+    assert resident_text == subprocess_text
+    assert resident_text == text
+
+
+def test_bgr_array_reaches_pytesseract_as_rgb(monkeypatch):
+    received = []
+    fake = types.SimpleNamespace(image_to_string=lambda image, **kwargs: received.append(image) or '')
+    monkeypatch.setitem(sys.modules, 'pytesseract', fake)
+    bgr = np.zeros((4, 4, 3), dtype=np.uint8)
+    bgr[..., 0] = 255  # kênh xanh dương trong thứ tự BGR của cv2
+
+    TesseractEngine(lang='vie', backend='pytesseract').recognize(bgr)
+
+    assert received[0][0, 0].tolist() == [0, 0, 255]
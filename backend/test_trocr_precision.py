@@ -0,0 +1,70 @@
+"""
+Cổng độ chính xác cho TrOCR INT8 (TROCR_PRECISION=int8)
+
+So sánh float32 và int8 bằng evaluate_trocr_precision trên các crop MSSV có
+nhãn. Mặc định dùng crop tổng hợp (chữ số viết bằng font script của OpenCV);
+đặt TROCR_EVAL_DIR tới thư mục có labels.csv (dòng "tên_file,mssv") để chạy
+trên crop thật. Bỏ qua khi không có torch / transformers hoặc không tải được model.
+
+    python -m pytest -q test_trocr_precision.py
+"""
+
+import csv
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+# INT8 được coi là tương đương nếu không kém float32 quá các mức này
+MAX_EXACT_ACCURACY_DROP = 0.1
+MAX_CHAR_ACCURACY_DROP = 0.05
+NUM_SYNTHETIC_CROPS = 12
+
+
+def _synthetic_id_crops(out_dir, count=NUM_SYNTHETIC_CROPS, seed=7):
+    rng = np.random.default_rng(seed)
+    samples = []
+    for i in range(count):
+        student_id = ''.join(str(d) for d in rng.integers(0, 10, size=7))
+        canvas = np.full((96, 384, 3), 255, dtype=np.uint8)
+        cv2.putText(canvas, student_id, (12, 66), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX,
+                    1.8, (30, 30, 30), 3, cv2.LINE_AA)
+        path = os.path.join(out_dir, f'id_{i:02d}.png')
+        cv2.imwrite(path, canvas)
+        samples.append((path, student_id))
+    return samples
+
+
+def _labeled_crops(eval_dir):
+    with open(os.path.join(eval_dir, 'labels.csv'), newline='', encoding='utf-8') as f:
+        return [(os.path.join(eval_dir, name), label.strip()) for name, label in csv.reader(f)]
+
+
+@pytest.fixture(scope='module')
+def trocr():
+    try:
+        from utils import automatic_exam_grading
+    except Exception as e:  # thiếu dependency khác của module hoặc không tải được model
+        pytest.skip(f"TrOCR không khả dụng: {e}")
+    return automatic_exam_grading
+
+
+def test_float32_is_default(trocr):
+    if 'TROCR_PRECISION' not in os.environ:
+        assert trocr.TROCR_PRECISION == 'float32'
+
+
+def test_int8_matches_float32_accuracy(trocr, tmp_path):
+    eval_dir = os.environ.get('TROCR_EVAL_DIR')
+    samples = _labeled_crops(eval_dir) if eval_dir else _synthetic_id_crops(str(tmp_path))
+
+    report = trocr.evaluate_trocr_precision(samples, precisions=('float32', 'int8'))
+
+    fp32, int8 = report['float32'], report['int8']
+    assert fp32['samples'] == int8['samples'] == len(samples)
+    assert int8['accuracy'] >= fp32['accuracy'] - MAX_EXACT_ACCURACY_DROP, report
+    assert int8['char_accuracy'] >= fp32['char_accuracy'] - MAX_CHAR_ACCURACY_DROP, report
@@ -0,0 +1,71 @@
+"""
+Ghi upload theo chunk: giới hạn kích thước và rollback khi vượt budget
+
+    python -m pytest -q test_upload_storage.py
+"""
+
+import asyncio
+import io
+import os
+
+import pytest
+
+pytest.importorskip('fastapi')
+from starlette.datastructures import UploadFile
+
+from utils.upload_storage import UploadBudget, UploadTooLarge, save_upload_stream, save_uploads_concurrently
+
+
+def _upload(name, content):
+    return UploadFile(io.BytesIO(content), filename=name)
+
+
+def test_file_over_limit_leaves_nothing_behind(tmp_path):
+    dest = tmp_path / 'a.jpg'
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(save_upload_stream(_upload('a.jpg', b'x' * 100), str(dest), max_bytes=10))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_content_addressed_duplicate_keeps_existing_file(tmp_path):
+    first = asyncio.run(save_upload_stream(_upload('a.jpg', b'same'), str(tmp_path / 'a.jpg'),
+                                           content_addressed=True))
+    second = asyncio.run(save_upload_stream(_upload('a.jpg', b'same'), str(tmp_path / 'a.jpg'),
+                                            content_addressed=True))
+
+    assert first['created'] and not second['created']
+    assert first['path'] == second['path']
+    assert sorted(os.listdir(tmp_path)) == [first['filename']]
+
+
+def test_budget_overflow_removes_only_files_created_by_the_call(tmp_path):
+    existing = tmp_path / 'old.jpg'
+    existing.write_bytes(b'earlier upload')
+    uploads = [_upload('old.jpg', b'1' * 40), _upload('new.jpg', b'2' * 40), _upload('big.jpg', b'3' * 40)]
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(save_uploads_concurrently(
+            uploads, lambda upload: str(tmp_path / upload.filename), budget=UploadBudget(100)
+        ))
+
+    assert os.listdir(tmp_path) == ['old.jpg']
+
+
+def test_budget_overflow_keeps_files_already_handed_off(tmp_path):
+    handed_off = []
+    uploads = [_upload('first.jpg', b'1' * 40), _upload('second.jpg', b'2' * 80)]
+
+    async def run():
+        # Ảnh đầu ghi xong (và được giao cho phiên) trước khi ảnh thứ hai vượt budget
+        return await save_uploads_concurrently(
+            uploads, lambda upload: str(tmp_path / upload.filename), budget=UploadBudget(100),
+            on_saved=lambda upload, result: handed_off.append(result['filename'])
+        )
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(run())
+
+    assert handed_off == ['first.jpg']
+    assert os.listdir(tmp_path) == ['first.jpg']
@@ -0,0 +1,95 @@
+"""
+Backend ONNX cho YOLO chấm phiếu: shape input, giải mã box và parity với ultralytics
+
+Test parity chạy cả hai backend trên vùng bảng trả lời cắt từ một phiếu tổng
+hợp (benchmarks/synthetic_sheets.py) và yêu cầu cùng số box, cùng nhãn, IoU
+>= 0.9. Cần ultralytics, onnxruntime và file trọng số (YOLO_MODEL_PATH, mặc
+định models/final_model.pt); thiếu thứ nào thì bỏ qua.
+
+    python -m pytest -q test_yolo_onnx.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from utils.yolo_onnx import DEFAULT_IMGSZ, check_input_shape, decode_predictions, letterbox
+
+YOLO_MODEL_PATH = os.environ.get('YOLO_MODEL_PATH', os.path.join('models', 'final_model.pt'))
+MAX_CONF_DIFF = 0.05
+
+
+@pytest.mark.parametrize('shape', [(1200, 800), (800, 1200), (300, 200), (640, 640)])
+def test_letterbox_pads_to_fixed_square(shape):
+    image = np.zeros((*shape, 3), dtype=np.uint8)
+
+    padded, ratio, (left, top) = letterbox(image, DEFAULT_IMGSZ)
+
+    assert padded.shape == (DEFAULT_IMGSZ, DEFAULT_IMGSZ, 3)
+    assert ratio == pytest.approx(min(DEFAULT_IMGSZ / shape[0], DEFAULT_IMGSZ / shape[1]))
+    assert left == 0 or top == 0
+
+
+def test_input_shape_accepts_symbolic_batch_and_rejects_other_sizes():
+    assert check_input_shape(['batch', 3, 'height', 'width'], 640) == (1, 3, 640, 640)
+    assert check_input_shape([1, 3, 640, 640], 640) == (1, 3, 640, 640)
+    with pytest.raises(ValueError):
+        check_input_shape([1, 3, 320, 320], 640)
+    with pytest.raises(ValueError):
+        check_input_shape([1, 3, 640], 640)
+
+
+def test_decode_maps_boxes_back_to_original_image():
+    image = np.zeros((1200, 800, 3), dtype=np.uint8)
+    _, ratio, pad = letterbox(image, DEFAULT_IMGSZ)
+    original = np.array([100.0, 200.0, 300.0, 260.0])
+
+    # Một dự đoán (cx, cy, w, h) trong không gian letterbox, 2 class
+    x1, y1, x2, y2 = original * ratio + np.array([pad[0], pad[1], pad[0], pad[1]])
+    pred = np.zeros((6, 3), dtype=np.float32)
+    pred[:4, 0] = [(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1]
+    pred[4:, 0] = [0.1, 0.9]
+    pred[4:, 1] = [0.05, 0.1]  # dưới ngưỡng conf
+
+    boxes, cls_ids, confidences = decode_predictions(pred, 0.25, 0.7, ratio, pad, image.shape[:2])
+
+    assert boxes.shape == (1, 4)
+    np.testing.assert_allclose(boxes[0], original, atol=1.0)
+    assert cls_ids.tolist() == [1]
+    assert confidences[0] == pytest.approx(0.9)
+
+
+@pytest.fixture(scope='module')
+def grading_crop(tmp_path_factory):
+    """Vùng bảng trả lời của một phiếu tổng hợp, cắt bằng image_processing"""
+    from benchmarks.synthetic_sheets import generate_dataset
+    from utils.image_processing import image_processing
+
+    out_dir = tmp_path_factory.mktemp('sheets')
+    dataset = generate_dataset(str(out_dir), count=1, seed=3, noise='none')
+    work_dir = out_dir / 'work'
+    work_dir.mkdir()
+    result = image_processing(dataset['sheets'][0]['path'], temp_dir=str(work_dir))
+    crop = result['paths'].get('table_grading')
+    assert crop and os.path.exists(crop)
+    return crop
+
+
+def test_onnx_matches_ultralytics(grading_crop):
+    pytest.importorskip('ultralytics')
+    pytest.importorskip('onnxruntime')
+    if not os.path.exists(YOLO_MODEL_PATH):
+        pytest.skip(f"Không có trọng số YOLO: {YOLO_MODEL_PATH}")
+    from utils.yolo_onnx import check_backend_parity, get_onnx_backend
+
+    assert get_onnx_backend(YOLO_MODEL_PATH).input_shape == (1, 3, DEFAULT_IMGSZ, DEFAULT_IMGSZ)
+
+    report = check_backend_parity(grading_crop, YOLO_MODEL_PATH, iou_threshold=0.9)
+
+    assert report['pytorch_boxes'] > 0, report
+    assert report['parity'], report
+    assert report['pytorch_labels'] == report['onnx_labels']
+    assert report['max_conf_diff'] <= MAX_CONF_DIFF, report
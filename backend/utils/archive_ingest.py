@@ -0,0 +1,225 @@
+"""
+Tách trang từ file ZIP hoặc PDF nhiều trang và đưa thẳng vào phiên ingest
+
+Archive được ghi xuống đĩa theo chunk (upload_storage), sau đó từng trang được
+lấy ra lần lượt: ZIP copy từng member theo chunk, PDF render từng trang một.
+Tại mỗi thời điểm chỉ có một trang trong bộ nhớ, và trang được đưa vào pipeline
+ngay khi ghi xong nên việc tách trang và xử lý ảnh chồng lên nhau.
+
+Tổng số byte tách ra từ một archive được tính vào một UploadBudget
+(MAX_ARCHIVE_EXTRACT_BYTES); vượt budget thì dừng, xóa file đang ghi và bỏ các
+trang chưa xử lý khỏi phiên. Trang PDF bị giới hạn số pixel khi render
+(MAX_PDF_PAGE_PIXELS) và kích thước file như ảnh upload (MAX_IMAGE_BYTES).
+"""
+
+import logging
+import os
+import re
+import zipfile
+
+from utils.upload_storage import UPLOAD_CHUNK_SIZE, MAX_IMAGE_BYTES, MAX_UPLOAD_REQUEST_BYTES, UploadBudget, UploadTooLarge
+
+# PyMuPDF là optional: chỉ cần khi nhận file PDF
+try:
+    import fitz
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+ARCHIVE_EXTENSIONS = ('.zip', '.pdf')
+# Độ phân giải render trang PDF (phiếu A4 ở 200 DPI ~ 1654x2339)
+PDF_RENDER_DPI = int(os.environ.get('PDF_RENDER_DPI', 200))
+# Giới hạn số trang mỗi archive để tránh zip bomb / PDF bất thường
+MAX_ARCHIVE_PAGES = int(os.environ.get('MAX_ARCHIVE_PAGES', 2000))
+# Tổng số byte được tách ra từ một archive (mặc định bằng giới hạn một request upload)
+MAX_ARCHIVE_EXTRACT_BYTES = int(os.environ.get('MAX_ARCHIVE_EXTRACT_BYTES', MAX_UPLOAD_REQUEST_BYTES))
+# Số pixel tối đa của một trang PDF khi render (A4 ở 200 DPI ~ 3.9 MP)
+MAX_PDF_PAGE_PIXELS = int(os.environ.get('MAX_PDF_PAGE_PIXELS', 25_000_000))
+
+
+class ArchiveError(Exception):
+    """Archive không đọc được hoặc không được hỗ trợ"""
+
+
+def _safe_stem(name):
+    """Tên file an toàn (không có thư mục / ký tự lạ) từ tên member hoặc archive"""
+    stem = os.path.splitext(os.path.basename(name.replace('\\', '/')))[0]
+    stem = re.sub(r'[^\w\-]+', '_', stem).strip('_')
+    return stem or 'page'
+
+
+def page_filename(archive_name, index, member_name, ext):
+    """Tên file ảnh cho một trang: <archive>_p<số thứ tự>_<member><ext>"""
+    return f"{_safe_stem(archive_name)}_p{index:04d}_{_safe_stem(member_name)}{ext}"
+
+
+def _remove_quietly(path):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {e}")
+
+
+def _iter_zip_pages(archive_path, archive_name, dest_dir, budget):
+    with zipfile.ZipFile(archive_path) as zf:
+        members = [
+            info for info in zf.infolist()
+            if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in IMAGE_EXTENSIONS
+            and not os.path.basename(info.filename).startswith('.')
+        ]
+        members.sort(key=lambda info: info.filename)
+        if len(members) > MAX_ARCHIVE_PAGES:
+            raise ArchiveError(f"Archive có {len(members)} ảnh, vượt giới hạn {MAX_ARCHIVE_PAGES}")
+
+        for index, info in enumerate(members, start=1):
+            if info.file_size > MAX_IMAGE_BYTES:
+                logger.warning(f"Skipping {info.filename}: {info.file_size} bytes exceeds {MAX_IMAGE_BYTES}")
+                continue
+
+            ext = os.path.splitext(info.filename)[1].lower()
+            filename = page_filename(archive_name, index, info.filename, ext)
+            dest_path = os.path.join(dest_dir, filename)
+            tmp_path = f"{dest_path}.part"
+            # Copy theo chunk, giới hạn cả số byte thực sự giải nén (không tin file_size trong header)
+            written = 0
+            try:
+                with zf.open(info) as src, open(tmp_path, 'wb') as dst:
+                    while True:
+                        chunk = src.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        written += len(chunk)
+                        if written > MAX_IMAGE_BYTES:
+                            break
+                        budget.consume(len(chunk))
+                        dst.write(chunk)
+            except BaseException:
+                _remove_quietly(tmp_path)
+                raise
+            if written > MAX_IMAGE_BYTES:
+                os.remove(tmp_path)
+                logger.warning(f"Skipping {info.filename}: decompressed size exceeds {MAX_IMAGE_BYTES}")
+                continue
+            os.replace(tmp_path, dest_path)
+            yield filename
+
+
+def _pdf_page_matrix(page):
+    """Matrix render ở PDF_RENDER_DPI, thu nhỏ nếu trang vượt MAX_PDF_PAGE_PIXELS"""
+    zoom = PDF_RENDER_DPI / 72.0
+    pixels = page.rect.width * zoom * page.rect.height * zoom
+    if pixels > MAX_PDF_PAGE_PIXELS:
+        zoom *= (MAX_PDF_PAGE_PIXELS / pixels) ** 0.5
+        logger.warning(f"PDF page {page.number + 1} is {page.rect.width:.0f}x{page.rect.height:.0f} pt, "
+                       f"rendering at {zoom * 72:.0f} DPI to stay under {MAX_PDF_PAGE_PIXELS} pixels")
+    return fitz.Matrix(zoom, zoom)
+
+
+def _iter_pdf_pages(archive_path, archive_name, dest_dir, budget):
+    if not PYMUPDF_AVAILABLE:
+        raise ArchiveError("Cần cài PyMuPDF (pymupdf) để nhận file PDF")
+
+    try:
+        doc = fitz.open(archive_path)
+    except Exception as e:
+        raise ArchiveError(f"Không đọc được PDF: {e}")
+
+    try:
+        if doc.page_count > MAX_ARCHIVE_PAGES:
+            raise ArchiveError(f"PDF có {doc.page_count} trang, vượt giới hạn {MAX_ARCHIVE_PAGES}")
+
+        for index in range(doc.page_count):
+            page = doc.load_page(index)
+            pixmap = page.get_pixmap(matrix=_pdf_page_matrix(page), alpha=False)
+            filename = page_filename(archive_name, index + 1, f"page{index + 1}", '.png')
+            dest_path = os.path.join(dest_dir, filename)
+            tmp_path = f"{dest_path}.part"
+            try:
+                pixmap.save(tmp_path, output='png')
+                size = os.path.getsize(tmp_path)
+                if size > MAX_IMAGE_BYTES:
+                    os.remove(tmp_path)
+                    logger.warning(f"Skipping PDF page {index + 1}: {size} bytes exceeds {MAX_IMAGE_BYTES}")
+                    continue
+                budget.consume(size)
+            except BaseException:
+                _remove_quietly(tmp_path)
+                raise
+            finally:
+                # Nhả bộ nhớ của trang trước khi render trang tiếp theo
+                del pixmap, page
+            os.replace(tmp_path, dest_path)
+            yield filename
+    finally:
+        doc.close()
+
+
+def iter_archive_pages(archive_path, archive_name, dest_dir, budget=None):
+    """
+    Lần lượt tách từng trang của archive ra dest_dir.
+
+    Args:
+        archive_path (str): Đường dẫn file ZIP/PDF đã lưu.
+        archive_name (str): Tên file gốc (dùng để đặt tên trang).
+        dest_dir (str): Thư mục ghi ảnh trang (uploads/images).
+        budget (UploadBudget): Tổng byte được tách ra (mặc định MAX_ARCHIVE_EXTRACT_BYTES).
+
+    Yields:
+        str: Tên file ảnh của từng trang ngay khi ghi xong.
+
+    Raises:
+        ArchiveError: Định dạng không hỗ trợ hoặc archive hỏng.
+        UploadTooLarge: Tổng dung lượng tách ra vượt budget (file đang ghi đã bị xóa).
+    """
+    budget = budget or UploadBudget(MAX_ARCHIVE_EXTRACT_BYTES)
+    os.makedirs(dest_dir, exist_ok=True)
+    ext = os.path.splitext(archive_name)[1].lower()
+    if ext == '.zip':
+        try:
+            yield from _iter_zip_pages(archive_path, archive_name, dest_dir, budget)
+        except zipfile.BadZipFile as e:
+            raise ArchiveError(f"File ZIP không hợp lệ: {e}")
+    elif ext == '.pdf':
+        yield from _iter_pdf_pages(archive_path, archive_name, dest_dir, budget)
+    else:
+        raise ArchiveError(f"Định dạng không hỗ trợ: {ext or archive_name}")
+
+
+def ingest_archive(archive_path, archive_name, session, dest_dir=os.path.join('uploads', 'images'), budget=None):
+    """
+    Tách trang và đưa từng trang vào phiên ingest ngay khi có.
+
+    Returns:
+        list: Tên file ảnh của các trang đã đưa vào phiên.
+
+    Raises:
+        UploadTooLarge: Archive tách ra vượt budget; các trang của archive bị bỏ
+            khỏi phiên và file của trang chưa bắt đầu xử lý bị xóa.
+    """
+    pages = []
+    try:
+        for filename in iter_archive_pages(archive_path, archive_name, dest_dir, budget):
+            session.submit(filename)
+            pages.append(filename)
+    except UploadTooLarge:
+        cancelled = session.discard(pages)
+        for filename in cancelled:
+            _remove_quietly(os.path.join(dest_dir, filename))
+        logger.warning(f"Archive {archive_name} exceeded the extraction budget after {len(pages)} pages; "
+                       f"discarded them ({len(cancelled)} files removed)")
+        raise
+    logger.info(f"Ingested {len(pages)} pages from {archive_name} into session {session.session_id}")
+    return pages
+
+
+def remove_archive(archive_path):
+    """Xóa archive tạm sau khi đã tách trang"""
+    try:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+    except OSError as e:
+        logger.warning(f"Could not remove archive {archive_path}: {e}")
@@ -0,0 +1,131 @@
+"""
+Cache các artifact đã biên dịch (danh sách sinh viên, đáp án) theo hash nội dung file
+
+Artifact được giữ trong bộ nhớ với LRU eviction và lưu xuống đĩa dạng pickle
+nhị phân, nên các lần chấm lại cùng file Excel không phải parse lại Excel hay
+chuyển JSON → DataFrame.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_CACHE_DIR = os.path.join('uploads', 'cache', 'artifacts')
+ARTIFACT_CACHE_SIZE = int(os.environ.get('ARTIFACT_CACHE_SIZE', 32))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_sha256(content: bytes) -> str:
+    """SHA-256 của nội dung đã có trong bộ nhớ"""
+    return hashlib.sha256(content).hexdigest()
+
+
+# Ghi nhớ hash theo (đường dẫn, kích thước, mtime) để không đọc lại file không đổi
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 của file, đọc theo từng chunk"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        if key in _file_digests:
+            return _file_digests[key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    with _file_digests_lock:
+        _file_digests[key] = digest.hexdigest()
+        return _file_digests[key]
+
+
+class ArtifactCache:
+    """LRU cache trong bộ nhớ, có bản lưu pickle trên đĩa"""
+
+    def __init__(self, cache_dir: str = ARTIFACT_CACHE_DIR, max_entries: int = ARTIFACT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{kind}_{digest}.pkl")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, kind: str, digest: str):
+        """Lấy artifact từ bộ nhớ, sau đó từ đĩa; trả về None nếu chưa có"""
+        key = (kind, digest)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        path = self._disk_path(kind, digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable artifact {path}: {e}")
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, kind: str, digest: str, value):
+        """Lưu artifact vào bộ nhớ và ghi nguyên tử xuống đĩa"""
+        self._remember((kind, digest), value)
+        path = self._disk_path(kind, digest)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not persist artifact {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_or_build(self, kind: str, digest: str, builder):
+        """
+        Trả về artifact đã cache hoặc gọi builder() để tạo mới.
+        Kết quả None hoặc dict có khóa 'error' không được cache.
+        """
+        value = self.get(kind, digest)
+        if value is not None:
+            logger.info(f"Artifact cache hit: {kind} {digest[:12]}")
+            return value
+
+        value = builder()
+        if value is None or (isinstance(value, dict) and 'error' in value):
+            return value
+        self.put(kind, digest, value)
+        return value
+
+
+# Global cache instance
+_cache_instance = None
+
+
+def get_artifact_cache() -> ArtifactCache:
+    """Get singleton artifact cache"""
+    global _cache_instance
+    if _cache_instance is None:
+        _cache_instance = ArtifactCache()
+    return _cache_instance
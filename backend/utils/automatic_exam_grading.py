@@ -3,6 +3,7 @@ import cv2
 import numpy as np
 import os
 import pandas as pd
+import torch
 from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 from PIL import Image
 import matplotlib.pyplot as plt
@@ -13,6 +14,8 @@ import easyocr
 import uuid
 from collections import Counter
 from ultralytics import YOLO
+from utils.tesseract_engine import get_digits_engine, get_tesseract_engine
+from utils.grading import score_answers, calculate_score
 
 # Cấu hình đường dẫn tesseract
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
@@ -258,8 +261,8 @@ def detect_code_box(image_path):
     image = cv2.imread(image_path)
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # Dùng OCR nhận diện nội dung
-    text = pytesseract.image_to_string(gray, config="--psm 6 digits")
+    # Dùng OCR nhận diện nội dung (engine Tesseract thường trú, chỉ chữ số)
+    text = get_digits_engine().recognize(gray)
 
     # Sử dụng biểu thức chính quy để tìm tất cả các số trong văn bản
     numbers = re.findall(r'\d+', text)  # Tìm tất cả các chuỗi số
@@ -281,17 +284,15 @@ def detect_code_box(image_path):
 reader = easyocr.Reader(['vi'])
 def detect_name_student(image_path, student_names):
     try:
-        # Đọc ảnh và chuyển sang RGB
+        # Đọc ảnh (BGR); TesseractEngine.recognize tự chuyển ndarray BGR sang RGB
         image = cv2.imread(image_path)
         if image is None:
             print(f"Không thể mở ảnh: {image_path}")
             return None
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
         # Cắt phần 2/3 dưới ảnh
         h = image.shape[0]
-        cropped_image = image_rgb[h // 3:, :, :]
+        cropped_image = image[h // 3:, :, :]
 
         # # Hiển thị phần ảnh được cắt (tuỳ chọn)
         # plt.imshow(cropped_image)
@@ -300,7 +301,7 @@ def detect_name_student(image_path, student_names):
         # plt.show()
 
         # OCR tiếng Việt
-        text = pytesseract.image_to_string(cropped_image, lang='vie')
+        text = get_tesseract_engine(lang='vie').recognize(cropped_image)
         print(f"Văn bản OCR nhận diện được:\n{text}")
 
         # Lọc ký tự để debug (chỉ lấy A-Z và số)
@@ -330,26 +331,104 @@ import warnings
 warnings.filterwarnings("ignore", message="Some weights of VisionEncoderDecoderModel were not initialized")
 warnings.filterwarnings("ignore", message="You should probably TRAIN this model")
 
+# Cấu hình inference cho TrOCR trên CPU
+# - TROCR_PRECISION: 'float32' (mặc định) hoặc 'int8' (dynamic quantization các
+#   lớp Linear). Chỉ bật int8 sau khi test_trocr_precision.py cho thấy độ chính
+#   xác tương đương trên bộ crop MSSV của bạn.
+# - Số luồng torch được đặt một lần khi server khởi động (utils/torch_threads.py),
+#   không đặt khi import module này
+TROCR_MODEL_NAME = 'microsoft/trocr-base-handwritten'
+TROCR_PRECISION = os.environ.get('TROCR_PRECISION', 'float32').lower()
+TROCR_PRECISIONS = ('float32', 'int8')
+
+
+def load_trocr_model(precision=TROCR_PRECISION):
+    """
+    Load TrOCR ở chế độ eval với độ chính xác cho trước.
+
+    Args:
+        precision (str): 'float32' hoặc 'int8'.
+
+    Returns:
+        VisionEncoderDecoderModel: Model sẵn sàng cho inference trên CPU.
+    """
+    if precision not in TROCR_PRECISIONS:
+        raise ValueError(f"precision phải là một trong {TROCR_PRECISIONS}, nhận được: {precision}")
+
+    trocr_model = VisionEncoderDecoderModel.from_pretrained(
+        TROCR_MODEL_NAME,
+        local_files_only=False,
+        trust_remote_code=False
+    )
+    trocr_model.eval()
+
+    if precision == 'int8':
+        # Lượng tử hóa động: trọng số Linear lưu INT8, activation lượng tử hóa khi chạy
+        trocr_model = torch.quantization.quantize_dynamic(trocr_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    return trocr_model
+
+
+def recognize_handwritten_text(image, trocr_model=None):
+    """Chạy TrOCR trên một ảnh PIL (RGB) và trả về chuỗi nhận diện được."""
+    trocr_model = trocr_model or model
+    with torch.inference_mode():
+        pixel_values = processor(images=image, return_tensors="pt").pixel_values
+        generated_ids = trocr_model.generate(pixel_values)
+    return processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+
+
+def evaluate_trocr_precision(labeled_samples, precisions=TROCR_PRECISIONS):
+    """
+    So sánh độ chính xác và độ trễ của TrOCR giữa các chế độ precision
+    trên một tập ảnh đã gán nhãn.
+
+    Args:
+        labeled_samples (list): Danh sách (image_path, expected_text).
+        precisions (tuple): Các chế độ cần đánh giá.
+
+    Returns:
+        dict: {precision: {'accuracy', 'char_accuracy', 'avg_latency_ms', 'samples'}}
+    """
+    import time
+    from fuzzywuzzy import fuzz
+
+    images = [(Image.open(path).convert("RGB"), str(expected)) for path, expected in labeled_samples]
+    report = {}
+    for precision in precisions:
+        candidate = model if precision == TROCR_PRECISION else load_trocr_model(precision)
+        exact = 0
+        char_scores = []
+        elapsed = 0.0
+        for image, expected in images:
+            start = time.perf_counter()
+            text = recognize_handwritten_text(image, candidate)
+            elapsed += time.perf_counter() - start
+            predicted = ''.join(re.findall(r'[A-Z0-9]', text))
+            exact += int(predicted == expected)
+            char_scores.append(fuzz.ratio(predicted, expected))
+        total = len(images) or 1
+        report[precision] = {
+            'accuracy': exact / total,
+            'char_accuracy': sum(char_scores) / total / 100,
+            'avg_latency_ms': elapsed / total * 1000,
+            'samples': len(images),
+        }
+    return report
+
+
 # Load model và processor 1 lần khi import với cấu hình tốt hơn
-processor = TrOCRProcessor.from_pretrained('microsoft/trocr-base-handwritten', use_fast=True)
-
-# Load model with better configuration to reduce warnings
-model = VisionEncoderDecoderModel.from_pretrained(
-    'microsoft/trocr-base-handwritten',
-    local_files_only=False,
-    trust_remote_code=False
-)
+processor = TrOCRProcessor.from_pretrained(TROCR_MODEL_NAME, use_fast=True)
+model = load_trocr_model(TROCR_PRECISION)
+
+
 def detect_id_student(image_path, student_ids, show_image=False):
     try:
         # Mở ảnh và chuyển sang RGB
         image = Image.open(image_path).convert("RGB")
 
-        # Tiền xử lý ảnh
-        pixel_values = processor(images=image, return_tensors="pt").pixel_values
-
         # Sinh text từ model
-        generated_ids = model.generate(pixel_values)
-        generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        generated_text = recognize_handwritten_text(image)
 
         # Hiển thị ảnh nếu cần
         if show_image:
@@ -557,57 +636,7 @@ def predict_grade(path_image, model_path = r"F:\KHMT0121\Do_An_4\Resource\AuGrad
 
     return path_image, student_result
 
-# Grading
-
-def calculate_score(answers, df_key, exam_code):
-    try:
-        exam_code = str(exam_code).strip()
-        
-        # Lấy mã đề từ cột đầu tiên (không phải index)
-        first_column = df_key.iloc[:, 0]  # Cột đầu tiên
-        exam_codes_available = [str(val).strip().replace('.0', '') for val in first_column.dropna() if pd.notna(val)]
-        
-        print(f"Available exam codes in df_key (from first column): {exam_codes_available}")
-        print(f"Checking exam_code: '{exam_code}' (type: {type(exam_code)})")
-
-        if exam_code not in exam_codes_available:
-            print(f"Exam code '{exam_code}' not found in answer key: {exam_codes_available}")
-            return 0
-
-        # Tìm index của row có mã đề khớp
-        matching_row_index = None
-        for idx in df_key.index:
-            val = df_key.iloc[df_key.index.get_loc(idx), 0]  # Lấy giá trị cột đầu tiên
-            if pd.notna(val) and str(val).strip().replace('.0', '') == exam_code:
-                matching_row_index = df_key.index.get_loc(idx)  # Lấy vị trí iloc
-                break
-        
-        if matching_row_index is None:
-            print(f"Could not find matching row for exam code '{exam_code}'")
-            return 0
-            
-        print(f"Found exam code '{exam_code}' at row index: {matching_row_index}")
-
-        # Lấy đáp án đúng từ hàng đó (bỏ qua cột đầu tiên là mã đề)
-        correct_answers = df_key.iloc[matching_row_index, 1:].values  # Bỏ cột đầu tiên
-        num_questions = len(correct_answers)
-        print(f"Correct answers (length: {num_questions}): {correct_answers}")
-
-        answers = answers or [''] * num_questions
-        if len(answers) != num_questions:
-            print(f"Cảnh báo: Số câu trả lời ({len(answers)}) không khớp với số câu hỏi ({num_questions})")
-            answers = answers + [''] * (num_questions - len(answers)) if len(answers) < num_questions else answers[
-                                                                                                           :num_questions]
-        print(f"Student answers (length: {len(answers)}): {answers}")
-
-        score = sum(1 for student_answer, correct_answer in zip(answers, correct_answers)
-                    if student_answer and correct_answer and student_answer.upper() == correct_answer.upper())
-
-        print(f"Calculated score for exam_code {exam_code}: {score}/{num_questions}")
-        return score
-    except Exception as e:
-        print(f"Error calculating score for exam_code {exam_code}: {e}")
-        return 0
+# Grading: calculate_score nằm trong utils.grading
 
 # --------------------Synchronize student--------------------
 def synchronize_student_data(student, df_part):
@@ -0,0 +1,192 @@
+"""
+Contact sheet (sprite) các vùng phiếu trả lời theo kỳ thi + phòng thi
+
+Sau khi một lô bài được chấm xong, ảnh vùng phiếu trả lời của từng bài được thu
+nhỏ và ghép thành một hoặc vài ảnh sprite, kèm file JSON ghi vị trí của từng
+bài trong sprite. Màn hình tổng quan của phòng thi chỉ cần tải file JSON và
+sprite thay vì một request ảnh cho mỗi sinh viên.
+
+Sprite được đặt tên theo (exam, room): hai kỳ thi có phòng trùng tên không ghi
+đè lên nhau. Mỗi lần tạo lại lấy toàn bộ bài của (exam, room) trong results
+store nên các lô chấm sau cộng dồn thay vì thay thế lô trước, và sprite thừa
+của lần tạo trước (khi số sprite giảm) bị xoá.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import uuid
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+CONTACT_SHEET_DIR = os.path.join('uploads', 'cache', 'contact_sheets')
+TILE_WIDTH = int(os.environ.get('CONTACT_SHEET_TILE_WIDTH', 160))
+TILE_HEIGHT = int(os.environ.get('CONTACT_SHEET_TILE_HEIGHT', 200))
+TILE_COLUMNS = int(os.environ.get('CONTACT_SHEET_COLUMNS', 12))
+MAX_TILES_PER_SPRITE = int(os.environ.get('CONTACT_SHEET_MAX_TILES', 144))
+SPRITE_QUALITY = 80
+
+TEMP_IMAGES_DIR = os.path.join('uploads', 'images', 'temp')
+GRADING_CROP_NAMES = ('table_grading_bounding_box_with_bboxes.jpg', 'table_grading_bounding_box.jpg')
+
+
+_build_lock = threading.Lock()
+
+
+def sheet_key(exam, room):
+    """
+    Tên file an toàn cho (kỳ thi, phòng thi). Phần hash giữ các cặp khác nhau
+    tách biệt kể cả khi tên sau khi làm sạch trùng nhau (vd. 'A-1' và 'A 1').
+    """
+    safe_room = re.sub(r'[^\w\-]+', '_', str(room)).strip('_') or 'room'
+    digest = hashlib.sha1(f"{exam}\0{room}".encode('utf-8')).hexdigest()[:12]
+    return f"{safe_room}_{digest}"
+
+
+def manifest_path(exam, room):
+    return os.path.join(CONTACT_SHEET_DIR, f"{sheet_key(exam, room)}.json")
+
+
+def sprite_path(exam, room, index):
+    return os.path.join(CONTACT_SHEET_DIR, f"{sheet_key(exam, room)}_{index}.webp")
+
+
+def _remove_stale_sprites(exam, room, sprite_count):
+    """Xoá sprite có chỉ số >= sprite_count còn lại từ lần tạo trước"""
+    prefix = f"{sheet_key(exam, room)}_"
+    for name in os.listdir(CONTACT_SHEET_DIR):
+        if not (name.startswith(prefix) and name.endswith('.webp')):
+            continue
+        index = name[len(prefix):-len('.webp')]
+        if index.isdigit() and int(index) >= sprite_count:
+            try:
+                os.remove(os.path.join(CONTACT_SHEET_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def grading_crop_path(image_name):
+    """Ảnh vùng phiếu trả lời (ưu tiên bản có bounding box) của một bài"""
+    for crop_name in GRADING_CROP_NAMES:
+        path = os.path.join(TEMP_IMAGES_DIR, image_name, crop_name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _fit_tile(image):
+    """Thu nhỏ ảnh vào ô TILE_WIDTH x TILE_HEIGHT, giữ tỉ lệ, căn giữa trên nền trắng"""
+    if image.format == 'JPEG':
+        image.draft('RGB', (TILE_WIDTH, TILE_HEIGHT))
+    image = image.convert('RGB')
+    image.thumbnail((TILE_WIDTH, TILE_HEIGHT), Image.LANCZOS)
+    tile = Image.new('RGB', (TILE_WIDTH, TILE_HEIGHT), 'white')
+    tile.paste(image, ((TILE_WIDTH - image.width) // 2, (TILE_HEIGHT - image.height) // 2))
+    return tile
+
+
+def _save_atomic(image, path):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp_path, format='WEBP', quality=SPRITE_QUALITY, method=4)
+    os.replace(tmp_path, path)
+
+
+def build_contact_sheet(exam, room, image_names):
+    """
+    Tạo sprite và file map cho các bài của một phòng thi trong một kỳ thi.
+
+    Args:
+        exam (str): Kỳ thi (mặc định là file đáp án).
+        room (str): Phòng thi.
+        image_names (list): imageName của từng bài (tên thư mục trong uploads/images/temp).
+
+    Returns:
+        dict: Nội dung file map: kích thước ô, số sprite, vị trí từng bài.
+    """
+    os.makedirs(CONTACT_SHEET_DIR, exist_ok=True)
+    entries = [(name, grading_crop_path(name)) for name in dict.fromkeys(image_names) if name]
+    entries = [(name, path) for name, path in entries if path is not None]
+
+    tiles = {}
+    sprites = []
+    for sprite_index, offset in enumerate(range(0, len(entries), MAX_TILES_PER_SPRITE)):
+        chunk = entries[offset:offset + MAX_TILES_PER_SPRITE]
+        columns = min(TILE_COLUMNS, len(chunk))
+        rows = math.ceil(len(chunk) / columns)
+        sheet = Image.new('RGB', (columns * TILE_WIDTH, rows * TILE_HEIGHT), 'white')
+
+        for position, (name, path) in enumerate(chunk):
+            x = (position % columns) * TILE_WIDTH
+            y = (position // columns) * TILE_HEIGHT
+            try:
+                with Image.open(path) as crop:
+                    sheet.paste(_fit_tile(crop), (x, y))
+            except Exception as e:
+                logger.warning(f"Skipping {path} in contact sheet: {e}")
+                continue
+            tiles[name] = {'sprite': sprite_index, 'x': x, 'y': y, 'w': TILE_WIDTH, 'h': TILE_HEIGHT}
+
+        _save_atomic(sheet, sprite_path(exam, room, sprite_index))
+        sprites.append({'index': sprite_index, 'width': sheet.width, 'height': sheet.height})
+
+    manifest = {
+        'exam': exam,
+        'room': room,
+        # Đổi sau mỗi lần tạo lại: URL sprite mang version để cache trình duyệt không trả sprite cũ
+        'version': uuid.uuid4().hex[:12],
+        'tile_width': TILE_WIDTH,
+        'tile_height': TILE_HEIGHT,
+        'sprites': sprites,
+        'tiles': tiles,
+    }
+    path = manifest_path(exam, room)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    _remove_stale_sprites(exam, room, len(sprites))
+
+    logger.info(f"Built contact sheet for exam {exam} room {room}: {len(tiles)} tiles in {len(sprites)} sprite(s)")
+    return manifest
+
+
+def _stored_image_names(exam, room):
+    """imageName của mọi bài đã lưu cho (exam, room), theo thứ tự lưu"""
+    from utils.results_store import get_results_store
+
+    return [sheet.get('imageName') for sheet in get_results_store().list_sheets(exam=exam, room=room)]
+
+
+def build_contact_sheet_for_results(exam, room, results):
+    """
+    Background task sau khi chấm xong một lô: tạo lại sprite từ toàn bộ bài của
+    (exam, room) trong results store, cộng thêm các bài của lô vừa chấm nếu
+    store chưa có. Lỗi chỉ được ghi log.
+    """
+    try:
+        try:
+            image_names = _stored_image_names(exam, room)
+        except Exception as e:
+            logger.warning(f"Results store unavailable for contact sheet {exam}/{room}: {e}")
+            image_names = []
+        image_names += [student.get('imageName') for student in results]
+        # Các lô của cùng phòng có thể kết thúc đồng thời; tạo lần lượt để file map khớp sprite
+        with _build_lock:
+            build_contact_sheet(exam, room, image_names)
+    except Exception as e:
+        logger.error(f"Error building contact sheet for exam {exam} room {room}: {e}")
+
+
+def load_contact_sheet(exam, room):
+    """Đọc file map đã tạo; None nếu phòng chưa có contact sheet"""
+    path = manifest_path(exam, room)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -1,38 +1,69 @@
+import logging
 import cv2
 import pytesseract
 import numpy as np
 import matplotlib.pyplot as plt
 import re  # Thêm thư viện re để sử dụng biểu thức chính quy
 
-# Cấu hình đường dẫn tesseract
+from utils.metrics import timed_stage
+from utils.tesseract_engine import get_digits_engine
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình đường dẫn tesseract (chỉ dùng khi fallback về pytesseract)
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-def detect_code_box(image_path):
-    # Đọc ảnh từ đường dẫn
-    image = cv2.imread(image_path)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # Dùng OCR nhận diện nội dung
-    text = pytesseract.image_to_string(gray, config="--psm 6 digits")
+def _to_gray(image):
+    """Đọc ảnh (đường dẫn hoặc mảng NumPy) và chuyển sang ảnh xám"""
+    if isinstance(image, str):
+        image = cv2.imread(image)
+        if image is None:
+            return None
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
 
+def _first_number(text):
     # Sử dụng biểu thức chính quy để tìm tất cả các số trong văn bản
     numbers = re.findall(r'\d+', text)  # Tìm tất cả các chuỗi số
 
-    # Nếu có số, in ra và trả về số đầu tiên
+    # Nếu có số, trả về số đầu tiên
     if numbers:
-        detected_number = numbers[0]  # Lấy số đầu tiên
-        # print("Detected number:", detected_number)
-        return detected_number  # Trả về số đầu tiên
-    else:
-        print("No numbers detected.")
-        return None  # Trả về None nếu không tìm thấy số
-
-    # # Hiển thị kết quả
-    # plt.figure(figsize=(10, 6))
-    # plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    # plt.title("Detected Exam Code Box")
-    # plt.axis("off")
-    # plt.show()
+        return numbers[0]
+    logger.debug("No numbers detected.")
+    return None  # Trả về None nếu không tìm thấy số
+
+
+@timed_stage('ocr_code_box', 'tesseract')
+def detect_code_box(image):
+    """
+    Nhận diện mã đề từ ảnh ô mã đề.
+
+    Args:
+        image: Đường dẫn ảnh hoặc mảng NumPy (BGR hoặc xám).
+
+    Returns:
+        str | None: Dãy số đầu tiên nhận diện được.
+    """
+    gray = _to_gray(image)
+    if gray is None:
+        logger.warning("Không thể đọc ảnh: %s", image if isinstance(image, str) else '<array>')
+        return None
+
+    # Dùng OCR nhận diện nội dung bằng engine Tesseract thường trú (chỉ chữ số)
+    text = get_digits_engine().recognize(gray)
+    return _first_number(text)
+
+
+@timed_stage('ocr_code_box_batch', 'tesseract')
+def detect_code_boxes(images):
+    """Nhận diện mã đề cho nhiều ảnh trên cùng một engine, trả về list kết quả theo thứ tự"""
+    grays = [_to_gray(image) for image in images]
+    valid = [gray for gray in grays if gray is not None]
+    texts = iter(get_digits_engine().recognize_batch(valid))
+    return [_first_number(next(texts)) if gray is not None else None for gray in grays]
 
 # Ví dụ gọi hàm
 # final_number = detect_code_box('path_to_your_image.jpg')
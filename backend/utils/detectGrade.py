@@ -1,155 +1,185 @@
 import cv2
 import numpy as np
 import os
+import threading
 from collections import Counter
-from ultralytics import YOLO
 import uuid
 
-def predict_grade(path_image, model_path = "models/final_model.pt", save_processed_image=True):
-    """
-    Xử lý ảnh bảng chấm điểm, lưu kết quả đè lên ảnh đầu vào và trả về mảng kết quả ký tự.
+from utils.metrics import stage_timer
 
-    Args:
-        path_image (str): Đường dẫn tới ảnh đầu vào, cũng là nơi lưu ảnh kết quả.
-        model_path (str): Đường dẫn tới mô hình YOLO (mặc định: /content/final_model.pt).
-        save_processed_image (bool): Có lưu ảnh đã xử lý không (mặc định: True).
+# Backend inference cho YOLO: 'pytorch' (ultralytics) hoặc 'onnx' (ONNX Runtime)
+YOLO_BACKEND = os.environ.get('YOLO_BACKEND', 'pytorch').lower()
+YOLO_BACKENDS = ('pytorch', 'onnx')
 
-    Returns:
-        tuple: (processed_image_path, student_result)
-            - processed_image_path (str): Đường dẫn tới ảnh kết quả đã lưu với bounding boxes.
-            - student_result (dict): Mảng chứa các ký tự từ 1 đến 60.
-    """
-    # Load mô hình
-    model = YOLO(model_path)
+# Predictor của ultralytics giữ trạng thái theo lần gọi và không thread-safe, nên
+# mỗi worker thread của grading executor giữ model riêng (như tesseract_engine)
+_local = threading.local()
 
-    # Đọc ảnh và chuyển màu
-    img = cv2.imread(path_image)
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-    # Dự đoán bằng YOLO
-    results = model.predict(source=img, save=False, conf=0.25)
+def get_yolo_model(model_path):
+    """Load model YOLO (ultralytics) một lần cho mỗi file trọng số trên thread hiện tại"""
+    models = getattr(_local, 'yolo_models', None)
+    if models is None:
+        models = _local.yolo_models = {}
+    if model_path not in models:
+        from ultralytics import YOLO
+        models[model_path] = YOLO(model_path)
+    return models[model_path]
+
+
+def run_yolo(img, model_path="models/final_model.pt", backend=None, conf=0.25):
+    """
+    Chạy YOLO trên ảnh BGR bằng backend được chọn.
+
+    Returns:
+        tuple: (boxes, cls_ids, confidences, names) - boxes dạng xyxy theo tọa độ ảnh gốc.
+    """
+    backend = (backend or YOLO_BACKEND).lower()
+    if backend not in YOLO_BACKENDS:
+        raise ValueError(f"backend phải là một trong {YOLO_BACKENDS}, nhận được: {backend}")
+
+    if backend == 'onnx':
+        from utils.yolo_onnx import get_onnx_backend
+        onnx_backend = get_onnx_backend(model_path)
+        with stage_timer('yolo_inference', 'onnx'):
+            return onnx_backend.predict(img, conf=conf)
+
+    model = get_yolo_model(model_path)
+    with stage_timer('yolo_inference', 'pytorch'):
+        results = model.predict(source=img, save=False, conf=conf)
     boxes = results[0].boxes.xyxy.cpu().numpy()
     cls_ids = results[0].boxes.cls.cpu().numpy().astype(int)
     confidences = results[0].boxes.conf.cpu().numpy()
-    names = results[0].names
-    labels = [names[i] for i in cls_ids]
+    return boxes, cls_ids, confidences, results[0].names
 
-    # Tính center cho mỗi bounding box
+
+# --------------------Hậu xử lý kết quả YOLO--------------------
+
+def box_centers(boxes):
+    """Tâm (x, y) của từng bounding box xyxy"""
     centers = []
     for box in boxes:
         x1, y1, x2, y2 = box
         center_x = (x1 + x2) / 2
         center_y = (y1 + y2) / 2
         centers.append([center_x, center_y])
-    centers = np.array(centers)
-
-    # Hàm tính khoảng cách
-    def is_near(center1, center2, threshold=20):
-        return np.linalg.norm(np.array(center1) - np.array(center2)) <= threshold
-
-    # Gom nhóm các box gần nhau
-    def group_nearby_boxes(boxes, labels, centers, confidences, threshold=20):
-        groups = []
-        used = set()
-        for i in range(len(centers)):
-            if i in used:
+    return np.array(centers)
+
+
+def is_near(center1, center2, threshold=20):
+    return np.linalg.norm(np.array(center1) - np.array(center2)) <= threshold
+
+
+def group_nearby_boxes(boxes, labels, centers, confidences, threshold=20):
+    """Gom các box có tâm cách nhau không quá threshold (px) thành một cụm"""
+    groups = []
+    used = set()
+    for i in range(len(centers)):
+        if i in used:
+            continue
+        group = [(boxes[i], labels[i], centers[i], confidences[i])]
+        used.add(i)
+        for j in range(i + 1, len(centers)):
+            if j in used:
                 continue
-            group = [(boxes[i], labels[i], centers[i], confidences[i])]
-            used.add(i)
-            for j in range(i + 1, len(centers)):
-                if j in used:
-                    continue
-                if is_near(centers[i], centers[j], threshold):
-                    group.append((boxes[j], labels[j], centers[j], confidences[j]))
-                    used.add(j)
-            groups.append(group)
-        return groups
-
-    # Chọn nhãn đại diện trong cụm
-    def select_final_label_and_box(group):
-        label_suffixes = [label[-1] for _, label, _, _ in group]
-        most_common = Counter(label_suffixes).most_common(1)[0][0]
-        filtered = [item for item in group if item[1].endswith(most_common)]
-        best_item = max(filtered, key=lambda x: x[3])  # theo confidence
-        return most_common, best_item
-
-    # Gom cụm
-    all_groups = group_nearby_boxes(boxes, labels, centers, confidences, threshold=20)
-
-    # Tạo mảng lưu kết quả
-    cluster_results = {}
-
-    # In kết quả
-    # print("\nCác cụm bounding box gần nhau:")
-    for idx, group in enumerate(all_groups):
-        final_char, best_box = select_final_label_and_box(group)
-        x1, y1, x2, y2 = best_box[0]
-        label = best_box[1]
-        center = best_box[2]
-        cluster_results[idx + 1] = final_char
-        # print(f"\nCụm {idx + 1} (số lượng {len(group)}): Chọn ký tự cuối là '{final_char}'")
-        # for b in group:
-    # print(f"  {b[1]} | Center: ({b[2][0]:.1f}, {b[2][1]:.1f}) | Box: ({int(b[0][0])}, {int(b[0][1])}) - ({int(b[0][2])}, {int(b[0][3])}) | Conf: {b[3]:.2f}")
-    # print(f"=> Được chọn: {label} | Center: ({center[0]:.1f}, {center[1]:.1f}) | Box: ({int(x1)}, {int(y1)}) - ({int(x2)}, {int(y2)})")
-
-    # In mảng kết quả
-    # print("\nMảng kết quả:")
-    # print(cluster_results)
-
-    # Tạo danh sách các box và final_char từ các cụm
-    cluster_boxes = []
-    for idx, group in enumerate(all_groups):
-        final_char, best_box = select_final_label_and_box(group)
-        box = best_box[0]  # Box coordinates [x1, y1, x2, y2]
-        cluster_boxes.append((box, final_char))
+            if is_near(centers[i], centers[j], threshold):
+                group.append((boxes[j], labels[j], centers[j], confidences[j]))
+                used.add(j)
+        groups.append(group)
+    return groups
 
-    # Sắp xếp theo x1 coordinate để chia thành 3 cụm
-    cluster_boxes.sort(key=lambda x: x[0][0])  # Sắp xếp theo x1
 
-    # Chia thành 3 cụm dựa trên x1 coordinate
+def select_final_label_and_box(group):
+    """Chọn nhãn đại diện trong cụm (ký tự cuối xuất hiện nhiều nhất) và box có confidence cao nhất"""
+    label_suffixes = [label[-1] for _, label, _, _ in group]
+    most_common = Counter(label_suffixes).most_common(1)[0][0]
+    filtered = [item for item in group if item[1].endswith(most_common)]
+    best_item = max(filtered, key=lambda x: x[3])  # theo confidence
+    return most_common, best_item
+
+
+def split_columns(cluster_boxes, num_columns=3):
+    """
+    Chia các (box, ký tự) thành num_columns cột theo x1, mỗi cột sắp theo y1.
+
+    Returns:
+        list | None: Danh sách cột; None nếu không đủ cụm để chia.
+    """
+    # Sắp xếp theo x1 coordinate để chia thành 3 cụm
+    cluster_boxes = sorted(cluster_boxes, key=lambda x: x[0][0])
     n = len(cluster_boxes)
-    if n < 3:
-        # print("Không đủ cụm để chia thành 3 nhóm!")
-        return None, None
-    else:
-        third = n // 3
-        x1_clusters = [
-            cluster_boxes[:third],
-            cluster_boxes[third:2 * third],
-            cluster_boxes[2 * third:]
-        ]
-
-        # Sắp xếp từng cụm theo y1 coordinate
-        for i in range(3):
-            x1_clusters[i].sort(key=lambda x: x[0][1])  # Sắp xếp theo y1
-
-        # In kết quả 3 cụm
-        # print("\nBa cụm được chia theo x1 coordinate và sắp xếp theo y1 coordinate:")
-        for i, cluster in enumerate(x1_clusters, 1):
-            # print(f"\nCụm X1 {i} (số lượng {len(cluster)}):")
-            for box, final_char in cluster:
-                x1, y1, x2, y2 = box
-                # print(f"  Ký tự: {final_char} | Coordinates: (x1={x1:.1f}, y1={y1:.1f}) | Box: ({int(x1)}, {int(y1)}) - ({int(x2)}, {int(y2)})")
+    if n < num_columns:
+        return None
+    size = n // num_columns
+    columns = [cluster_boxes[i * size:(i + 1) * size] for i in range(num_columns - 1)]
+    columns.append(cluster_boxes[(num_columns - 1) * size:])
+    # Sắp xếp từng cụm theo y1 coordinate
+    for column in columns:
+        column.sort(key=lambda x: x[0][1])
+    return columns
+
+
+def postprocess_detections(boxes, cls_ids, confidences, names, threshold=20):
+    """
+    Từ kết quả YOLO tới đáp án theo số câu.
+
+    Returns:
+        tuple: (representatives, student_result)
+            - representatives (list): (ký tự, box đại diện) của từng cụm, dùng để vẽ.
+            - student_result (dict | None): {số câu: ký tự}, None nếu không đủ cụm.
+    """
+    labels = [names[i] for i in cls_ids]
+    centers = box_centers(boxes)
+    all_groups = group_nearby_boxes(boxes, labels, centers, confidences, threshold=threshold)
+    representatives = [select_final_label_and_box(group) for group in all_groups]
+
+    columns = split_columns([(best_box[0], final_char) for final_char, best_box in representatives])
+    if columns is None:
+        return representatives, None
 
     # Tạo mảng student_result từ 1 đến 60
     student_result = {}
     index = 1
-    for cluster in x1_clusters:
-        for _, final_char in cluster:
+    for column in columns:
+        for _, final_char in column:
             student_result[index] = final_char
             index += 1
+    return representatives, student_result
+
+
+def predict_grade(path_image, model_path = "models/final_model.pt", save_processed_image=True, backend=None):
+    """
+    Xử lý ảnh bảng chấm điểm, lưu kết quả đè lên ảnh đầu vào và trả về mảng kết quả ký tự.
 
-    # In mảng student_result
-    # print("\nMảng student_result:")
-    # for idx in range(1, 61):
-    # print(f"{idx}:{student_result[idx]}")
+    Args:
+        path_image (str): Đường dẫn tới ảnh đầu vào, cũng là nơi lưu ảnh kết quả.
+        model_path (str): Đường dẫn tới mô hình YOLO (mặc định: /content/final_model.pt).
+        save_processed_image (bool): Có lưu ảnh đã xử lý không (mặc định: True).
+        backend (str): 'pytorch' hoặc 'onnx' (mặc định: YOLO_BACKEND).
+
+    Returns:
+        tuple: (processed_image_path, student_result)
+            - processed_image_path (str): Đường dẫn tới ảnh kết quả đã lưu với bounding boxes.
+            - student_result (dict): Mảng chứa các ký tự từ 1 đến 60.
+    """
+    # Đọc ảnh
+    with stage_timer('decode', 'opencv'):
+        img = cv2.imread(path_image)
+
+    # Dự đoán bằng YOLO
+    boxes, cls_ids, confidences, names = run_yolo(img, model_path, backend=backend)
+
+    # Hậu xử lý: gom cụm, chọn nhãn, chia cột và sắp xếp
+    with stage_timer('yolo_postprocess', 'python'):
+        representatives, student_result = postprocess_detections(boxes, cls_ids, confidences, names)
+    if student_result is None:
+        return None, None
 
     # Copy ảnh để vẽ lên
     img_result = img.copy()
 
     # Vẽ các box đại diện
-    for idx, group in enumerate(all_groups):
-        final_char, best_box = select_final_label_and_box(group)
+    for final_char, best_box in representatives:
         x1, y1, x2, y2 = map(int, best_box[0])
 
         # Vẽ khung chữ nhật
@@ -174,13 +204,15 @@ def predict_grade(path_image, model_path = "models/final_model.pt", save_process
         name, ext = os.path.splitext(filename)
         processed_image_path = os.path.join(dir_path, f"{name}_with_bboxes{ext}")
         
-        cv2.imwrite(processed_image_path, img_result)
+        with stage_timer('disk_write', 'opencv'):
+            cv2.imwrite(processed_image_path, img_result)
         # print(f"Ảnh đã xử lý được lưu tại: {processed_image_path}")
         
         return processed_image_path, student_result
     else:
         # Đè lên ảnh gốc (behavior cũ)
-        cv2.imwrite(path_image, img_result)
+        with stage_timer('disk_write', 'opencv'):
+            cv2.imwrite(path_image, img_result)
         # print(f"Ảnh đã được lưu tại: {path_image}")
         
         return path_image, student_result
\ No newline at end of file
@@ -1,4 +1,5 @@
 
+import logging
 import ollama
 from PIL import Image
 import matplotlib.pyplot as plt
@@ -12,6 +13,10 @@ import base64
 import io
 import json
 
+from utils.metrics import timed_stage
+
+logger = logging.getLogger(__name__)
+
 def image_to_base64(image):
     """Chuyển đổi ảnh PIL hoặc numpy array thành base64"""
     if isinstance(image, np.ndarray):
@@ -36,14 +41,15 @@ def query_ollama_vision(image_base64, prompt):
         )
         return response['message']['content']
     except Exception as e:
-        print(f"Lỗi khi gọi Ollama: {e}")
+        logger.warning("Lỗi khi gọi Ollama: %s", e)
         return ""
+@timed_stage('ocr_name', 'ollama')
 def detect_name_student(image_path, student_names):
     try:
         # Đọc ảnh và chuyển sang RGB
         image = cv2.imread(image_path)
         if image is None:
-            print(f"Không thể mở ảnh: {image_path}")
+            logger.warning("Không thể mở ảnh: %s", image_path)
             return None
 
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -67,27 +73,28 @@ Chỉ trả về tên sinh viên, không thêm bất kỳ thông tin nào khác.
         
         # OCR bằng Ollama/Qwen
         text = query_ollama_vision(image_base64, prompt)
-        print(f"Văn bản OCR nhận diện được:\n{text}")
+        logger.debug("Văn bản OCR nhận diện được: %r", text)
 
 
         # So khớp fuzzy
         if text.strip():
             matched = process.extractOne(text.strip(), student_names)
             if matched:
-                print(f"Khớp với: {matched[0]} (Điểm tương đồng: {matched[1]})")
+                logger.debug("Khớp với: %s (Điểm tương đồng: %s)", matched[0], matched[1])
                 return matched[0]
             else:
-                print("Không tìm thấy tên phù hợp.")
+                logger.debug("Không tìm thấy tên phù hợp.")
                 return None
         else:
-            print("Không nhận diện được văn bản.")
+            logger.debug("Không nhận diện được văn bản.")
             return None
 
     except Exception as e:
-        print("Lỗi:", e)
+        logger.warning("Lỗi trong detect_name_student: %s", e)
         return None
 
 
+@timed_stage('ocr_id', 'ollama')
 def detect_id_student(image_path, student_ids, show_image=False):
     try:
         # Mở ảnh và chuyển sang RGB
@@ -110,26 +117,27 @@ Chỉ trả về mã số sinh viên, không thêm bất kỳ thông tin nào kh
         # OCR bằng Ollama/Qwen
         generated_text = query_ollama_vision(image_base64, prompt)
 
-        print("Initial text detected for image", image_path, ":", generated_text)
+        logger.debug("Initial text detected for image %s: %r", image_path, generated_text)
 
 
         # So khớp với danh sách MSSV
         if generated_text.strip():
             matched_text = process.extractOne(generated_text, student_ids)
             if matched_text:
-                print("Matched student ID:", matched_text[0], "with similarity score:", matched_text[1])
+                logger.debug("Matched student ID: %s with similarity score: %s", matched_text[0], matched_text[1])
                 return matched_text[0]
             else:
-                print("No good match found.")
+                logger.debug("No good match found.")
                 return None
         else:
-            print("No valid text found.")
+            logger.debug("No valid text found.")
             return None
 
     except Exception as e:
-        print("Error in detect_id_student:", str(e))
+        logger.warning("Error in detect_id_student: %s", e)
         return None
 
+@timed_stage('ocr_index', 'ollama')
 def detect_index_student(image):
     try:
         # Đọc ảnh (nếu là đường dẫn) hoặc sử dụng trực tiếp (nếu là numpy array)
@@ -137,7 +145,7 @@ def detect_index_student(image):
             # Nếu là đường dẫn file
             img = cv2.imread(image)
             if img is None:
-                print(f"Không thể mở ảnh: {image}")
+                logger.warning("Không thể mở ảnh: %s", image)
                 return []
             img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         else:
@@ -159,12 +167,12 @@ Chỉ trả về các số được tìm thấy, cách nhau bằng dấu cách.
 
         image_name = os.path.basename(image) if isinstance(image, str) else "image_array"
         if numbers:
-            print(f"[{image_name}] ➜ {' '.join(numbers)}")
+            logger.debug("[%s] ➜ %s", image_name, ' '.join(numbers))
         else:
-            print(f"[{image_name}] ➜ Không tìm thấy số")
+            logger.debug("[%s] ➜ Không tìm thấy số", image_name)
 
         return numbers
         
     except Exception as e:
-        print(f"Lỗi trong detect_index_student: {e}")
+        logger.warning("Lỗi trong detect_index_student: %s", e)
         return []
@@ -0,0 +1,45 @@
+"""
+Executor riêng cho các tác vụ chặn (OpenCV, pandas, Tesseract, TrOCR, YOLO)
+
+Các endpoint async gọi run_blocking() để đẩy công việc nặng sang thread pool,
+nhờ vậy event loop vẫn phục vụ /ping, /api/images/* và các upload khác trong
+lúc một lô bài đang được chấm. Dùng thread pool thay vì process pool vì các
+model (TrOCR, EasyOCR, YOLO) được load một lần trong process và phần lớn thời
+gian nằm trong code native đã nhả GIL; process pool sẽ phải nhân bản toàn bộ
+model cho mỗi worker.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Số tác vụ chặn chạy đồng thời; các request còn lại chờ trên event loop (không chiếm thread)
+GRADING_WORKERS = int(os.environ.get('GRADING_WORKERS', 2))
+
+_executor = ThreadPoolExecutor(max_workers=GRADING_WORKERS, thread_name_prefix='grading')
+_semaphore = asyncio.Semaphore(GRADING_WORKERS)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Chạy hàm đồng bộ trên grading executor với số lượng đồng thời giới hạn"""
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def submit_blocking(func, *args, **kwargs):
+    """
+    Đưa hàm đồng bộ vào hàng đợi của grading executor, trả về concurrent Future.
+    Dùng cho các bước nhỏ theo từng ảnh (không đi qua semaphore của run_blocking).
+    """
+    return _executor.submit(func, *args, **kwargs)
+
+
+def shutdown_executor(wait=True):
+    """Dừng executor khi tắt server"""
+    logger.info("Shutting down grading executor")
+    _executor.shutdown(wait=wait)
@@ -1,5 +1,91 @@
+import logging
+
+import numpy as np
 import pandas as pd
 
+from utils.log_utils import lazy
+from utils.processing_result_file import compile_answer_key
+
+logger = logging.getLogger(__name__)
+
+
+def score_answers(answers, answer_key, exam_code):
+    """
+    Tính số câu đúng của một bài so với đáp án đã biên dịch.
+
+    Args:
+        answers (list): Đáp án của sinh viên theo thứ tự câu ('' nếu bỏ trống).
+        answer_key (pd.DataFrame): Kết quả compile_answer_key (mã đề × câu hỏi).
+        exam_code: Mã đề của bài làm.
+
+    Returns:
+        int: Số câu đúng (0 nếu mã đề không có trong đáp án).
+    """
+    exam_code = str(exam_code).strip() if exam_code is not None else ''
+    if exam_code not in answer_key.index:
+        logger.warning("Exam code '%s' not found in answer key (%d codes)", exam_code, len(answer_key.index))
+        logger.debug("Answer key codes: %s", lazy(lambda: list(answer_key.index)))
+        return 0
+
+    correct_answers = answer_key.loc[exam_code].to_numpy(dtype=object)
+    num_questions = len(correct_answers)
+
+    student_answers = np.full(num_questions, '', dtype=object)
+    normalized = [str(a).strip().upper() if a else '' for a in (answers or [])[:num_questions]]
+    student_answers[:len(normalized)] = normalized
+
+    return int(((student_answers == correct_answers) & (correct_answers != '')).sum())
+
+
+def calculate_score(answers, df_key, exam_code):
+    """
+    Tính điểm từ DataFrame đáp án thô (cột đầu là mã đề).
+    Nếu chấm nhiều bài, nên compile_answer_key một lần rồi gọi score_answers.
+    """
+    try:
+        return score_answers(answers, compile_answer_key(df_key), exam_code)
+    except Exception as e:
+        logger.error("Error calculating score for exam_code %s: %s", exam_code, e)
+        return 0
+
+
+def score_answer_matrix(choices, exam_codes, answer_key, blank='-'):
+    """
+    Chấm cùng lúc nhiều bài từ chuỗi câu trả lời đã lưu (một ký tự / câu).
+
+    Args:
+        choices (list): Chuỗi câu trả lời của từng bài, ví dụ 'AB-D' ('-' là bỏ trống).
+        exam_codes (list): Mã đề của từng bài.
+        answer_key (pd.DataFrame): Kết quả compile_answer_key (mã đề × câu hỏi).
+
+    Returns:
+        tuple: (np.ndarray số câu đúng, np.ndarray bool mã đề có trong đáp án)
+    """
+    num_questions = len(answer_key.columns)
+    num_sheets = len(choices)
+    if num_sheets == 0 or num_questions == 0:
+        return np.zeros(num_sheets, dtype=np.int32), np.zeros(num_sheets, dtype=bool)
+
+    # Ma trận đáp án: dòng 0 dành cho mã đề không có trong đáp án (toàn \0, không khớp câu nào)
+    key_rows = [''.join(answer or '\0' for answer in row) for row in answer_key.to_numpy(dtype=object)]
+    # errors='replace': ký tự ngoài latin-1 thành '?' (vẫn 1 byte / câu, không khớp đáp án nào)
+    key_matrix = np.frombuffer(('\0' * num_questions + ''.join(key_rows)).encode('latin-1', errors='replace'),
+                               dtype=np.uint8)
+    key_matrix = key_matrix.reshape(len(key_rows) + 1, num_questions)
+
+    code_index = {str(code): i + 1 for i, code in enumerate(answer_key.index)}
+    row_index = np.fromiter((code_index.get(str(code).strip() if code is not None else '', 0) for code in exam_codes),
+                            dtype=np.intp, count=num_sheets)
+
+    # Ma trận câu trả lời N × Q (cắt / bù '-' cho đủ số câu của đáp án)
+    padded = ''.join((text or '')[:num_questions].ljust(num_questions, blank) for text in choices)
+    answer_matrix = np.frombuffer(padded.encode('latin-1', errors='replace'),
+                                  dtype=np.uint8).reshape(num_sheets, num_questions)
+
+    scores = (answer_matrix == key_matrix[row_index]).sum(axis=1).astype(np.int32)
+    return scores, row_index > 0
+
+
 def grading_result(df_answer_student, df_key):
 
     # Số lượng câu hỏi
@@ -12,9 +98,8 @@ def grading_result(df_answer_student, df_key):
     ma_de = 212
 
     # Kiểm tra kiểu dữ liệu của ma_de
-    print("ma_de:", ma_de, "type:", type(ma_de))
-    print("df_key.index:", df_key.index.tolist())
-    print("df_key.index types:", [type(x) for x in df_key.index])
+    logger.debug("ma_de: %s (%s)", ma_de, type(ma_de).__name__)
+    logger.debug("df_key.index: %s", lazy(lambda: [(x, type(x).__name__) for x in df_key.index]))
 
     # Đảm bảo kiểu dữ liệu khớp nếu cần
     if isinstance(ma_de, int):  # Nếu ma_de là số nguyên, đảm bảo df_key.index cũng là số nguyên
@@ -32,11 +117,11 @@ def grading_result(df_answer_student, df_key):
     correct_answers = df_key.loc[ma_de].reset_index(drop=True)
 
     # Kiểm tra chỉ mục của df_answer_first_40
-    print(df_answer_student.index)
+    logger.debug("df_answer_student.index: %s", df_answer_student.index)
 
     # Nếu chỉ mục không phải là số nguyên, reset lại chỉ mục
     df_answer_first_40 = df_answer_student.reset_index(drop=True)
-    print(df_answer_first_40)
+    logger.debug("Student answers:\n%s", df_answer_first_40)
     # Lấy câu trả lời của sinh viên
     student_answers = df_answer_first_40.iloc[0].reset_index(drop=True)
 
@@ -48,5 +133,5 @@ def grading_result(df_answer_student, df_key):
     result = {'Index': ma_de, 'Score': score}
 
     # In kết quả
-    print(pd.DataFrame([result]))
+    logger.debug("Result: %s", result)
     return 0
\ No newline at end of file
@@ -0,0 +1,385 @@
+"""
+Pipeline chấm một bài thi, tách theo giai đoạn
+
+- extract_sheet: phần thị giác (cắt vùng, mã đề, STT, YOLO) và nhận diện tên/MSSV
+  nếu đã có danh sách sinh viên
+- score_sheet: validate thông tin sinh viên theo danh sách và tính điểm theo đáp án
+
+/api/process_images chạy hai giai đoạn liền nhau cho từng ảnh; phiên ingest chạy
+giai đoạn thị giác ngay khi ảnh được upload và chỉ chấm điểm khi kết thúc phiên.
+"""
+
+import logging
+import os
+
+from utils.image_processing import image_processing
+from utils.detectCodeBox import detect_code_box
+from utils.detectInfo import detect_name_student, detect_id_student, detect_index_student
+from utils.detectGrade import predict_grade
+from utils.grading import score_answers
+from utils.student_validation import validate_and_correct_student_info
+from utils.processing_result_file import load_student_artifact, load_answer_key_artifact
+from utils.image_normalization import resolve_working_image
+from utils.job_workspace import JobWorkspace, sheet_key_for, sheet_dir_for
+from utils.metrics import sheet_timings, stage_timer
+from utils.memory_guard import sheet_memory_slot
+from utils.log_utils import lazy, log_event
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = os.path.join('uploads', 'images')
+
+
+class GradingInputError(Exception):
+    """Đáp án, danh sách sinh viên hoặc phòng thi không dùng được để chấm"""
+
+
+def normalize_path(path):
+    """Normalize path separators to forward slashes for web compatibility"""
+    return path.replace("\\", "/")
+
+
+def load_roster_context(student_list_filename, room):
+    """
+    Lấy phần danh sách sinh viên ứng với phòng thi.
+
+    Returns:
+        dict: df_part, student_ids, student_names, stt_list
+    """
+    df_parts_file = os.path.join('uploads', 'student', student_list_filename)
+    if not os.path.exists(df_parts_file):
+        raise GradingInputError('Không có dữ liệu danh sách học sinh.')
+
+    # Lấy df_parts đã biên dịch từ artifact cache (chỉ parse Excel khi file chưa được cache)
+    try:
+        roster = load_student_artifact(df_parts_file)
+    except Exception as e:
+        logger.error(f"Error reading df_parts file: {e}")
+        raise GradingInputError(f'Lỗi đọc file df_parts: {str(e)}')
+    if 'error' in roster:
+        raise GradingInputError(f"Lỗi đọc danh sách sinh viên: {roster['error']}")
+
+    # Reset index để đảm bảo index là số nguyên (bản sao, không sửa artifact trong cache)
+    df_parts = {key: part.reset_index(drop=True) for key, part in roster['df_parts'].items()}
+    logger.debug("Loaded df_parts from artifact cache: %s", lazy(lambda: list(df_parts)))
+
+    # Xử lý phòng thi - tìm part phù hợp
+    available_parts = list(df_parts.keys())
+    part_key = None
+    room_number = room.replace('A', '').replace('B', '').replace('C', '')
+    try:
+        room_num = int(room_number)
+        part_key = f"df_part{room_num}"
+        if part_key not in available_parts:
+            # Nếu không tìm thấy, sử dụng part đầu tiên
+            part_key = available_parts[0]
+            logger.info(f"Room {room} not found, using first part: {part_key}")
+    except ValueError:
+        # Nếu không parse được số phòng, sử dụng part đầu tiên
+        part_key = available_parts[0] if available_parts else None
+        logger.info(f"Invalid room format, using first part: {part_key}")
+
+    if part_key is None:
+        raise GradingInputError(f'Không tìm thấy part phù hợp cho phòng thi {room}.')
+
+    logger.info(f"Using part: {part_key}")
+    df_part = df_parts[part_key]
+
+    required_columns = ['STT', 'MSSV']
+    missing_columns = [col for col in required_columns if col not in df_part.columns]
+    if missing_columns:
+        raise GradingInputError(f'File danh sách học sinh thiếu cột: {", ".join(missing_columns)}')
+
+    student_ids = df_part['MSSV'].astype(str).tolist()
+    if 'HoDem' in df_part.columns and 'Ten' in df_part.columns:
+        student_names = (df_part['HoDem'].astype(str) + ' ' + df_part['Ten'].astype(str)).tolist()
+    elif 'Ten' in df_part.columns:
+        student_names = df_part['Ten'].astype(str).tolist()
+    else:
+        student_names = []
+    stt_list = df_part['STT'].astype(str).tolist()
+
+    logger.info(f"Processing for {room}: {len(student_ids)} students")
+
+    return {
+        'df_part': df_part,
+        'student_ids': student_ids,
+        'student_names': student_names,
+        'stt_list': stt_list,
+    }
+
+
+def load_key_context(answer_key_filename):
+    """
+    Lấy đáp án đã biên dịch.
+
+    Returns:
+        dict: df_key (mã đề × câu hỏi), num_questions
+    """
+    data_path_process = os.path.join('uploads', 'key', answer_key_filename)
+    if not os.path.exists(data_path_process):
+        raise GradingInputError('Không có file đáp án được tải lên hoặc xử lý.')
+
+    try:
+        df_key = load_answer_key_artifact(data_path_process)
+    except Exception as e:
+        logger.error(f"Error reading answer key file: {e}")
+        df_key = None
+    if df_key is None:
+        raise GradingInputError('Không thể xử lý file đáp án.')
+
+    # Số câu hỏi của đáp án đã biên dịch (mã đề nằm ở index)
+    num_questions = len(df_key.columns)
+    logger.info(f"df_key shape: {df_key.shape}, số câu hỏi: {num_questions}")
+
+    return {'df_key': df_key, 'num_questions': num_questions}
+
+
+def load_grading_context(answer_key_filename, student_list_filename, room):
+    """Gộp danh sách sinh viên của phòng thi và đáp án thành context chấm điểm"""
+    context = load_roster_context(student_list_filename, room)
+    context.update(load_key_context(answer_key_filename))
+    return context
+
+
+def detect_identity(sheet, roster):
+    """Nhận diện tên và MSSV của bài thi, so khớp với danh sách sinh viên"""
+    paths = sheet['paths']
+    sheet['raw_name'] = detect_name_student(paths['name'], roster['student_names'])
+    sheet['raw_id'] = detect_id_student(paths['id_student'], roster['student_ids'])
+    sheet['identity_detected'] = True
+    return sheet
+
+
+def extract_sheet(image_filename, roster=None):
+    """
+    Giai đoạn thị giác cho một ảnh bài thi.
+
+    Args:
+        image_filename (str): Tên file trong uploads/images.
+        roster (dict): Context danh sách sinh viên; nếu None thì tên/MSSV được
+            nhận diện sau bằng detect_identity.
+
+    Returns:
+        dict | None: Kết quả nhận diện thô (kèm 'stage_timings': ms theo stage),
+            None nếu không có file ảnh.
+
+    Raises:
+        Exception: Khi YOLO không xử lý được bảng trả lời.
+    """
+    # Dùng bản làm việc đã chuẩn hóa (EXIF, độ phân giải) thay vì ảnh gốc
+    image_path = resolve_working_image(image_filename)
+    if image_path is None:
+        logger.warning(f"Image file not found: {os.path.join(IMAGES_DIR, image_filename)}")
+        return None
+    logger.debug("Processing image: %s", image_path)
+
+    # Thư mục artifact riêng cho lần xử lý này (hash ảnh gốc + hậu tố ngẫu nhiên):
+    # ảnh trùng tên ở các phòng, hay cùng ảnh trong hai job song song, không đè nhau
+    temp_file_name = sheet_key_for(os.path.join(IMAGES_DIR, image_filename))
+
+    # Các bước ghi file chạy trong thư mục riêng của job, publish nguyên tử khi xong.
+    # Phần giữ ảnh độ phân giải đầy đủ chờ slot của memory guard khi RSS gần ngưỡng
+    timings = {}
+    with sheet_memory_slot(image_filename), sheet_timings(timings), JobWorkspace() as workspace:
+        # Xử lý ảnh và lấy tọa độ vùng phiếu thi
+        processing_result = image_processing(image_path, temp_dir=workspace.path)
+        paths = processing_result.get('paths', {})
+
+        crop_paths = {
+            'code_box': paths.get('code_box', os.path.join(workspace.path, 'code_box_bounding_box.jpg')),
+            'name': paths.get('name', os.path.join(workspace.path, 'name_bounding_box.jpg')),
+            'table_grading': paths.get('table_grading', os.path.join(workspace.path, 'table_grading_bounding_box.jpg')),
+            'id_student': paths.get('id_student', os.path.join(workspace.path, 'id_student.jpg')),
+            'index_student': paths.get('index_student', os.path.join(workspace.path, 'index_student.jpg')),
+        }
+        logger.debug("Processing paths: %s", lazy(lambda: {k: normalize_path(v) for k, v in crop_paths.items()}))
+
+        # Detect thông tin từ các vùng ảnh (raw detection)
+        exam_code = detect_code_box(crop_paths['code_box'])
+        raw_index = detect_index_student(crop_paths['index_student'])
+
+        # Xử lý ảnh để lấy đáp án bằng YOLO model với bounding boxes
+        grading_path = crop_paths['table_grading']
+        try:
+            processed_image_path, student_result = predict_grade(grading_path, save_processed_image=True)
+            logger.debug("YOLO processing completed: %s", processed_image_path)
+        except Exception as e:
+            logger.error(f"Error in predict_grade: {str(e)}")
+            raise Exception(f"Error in YOLO processing: {str(e)}")
+
+        if not student_result:
+            logger.error("No answers detected by YOLO model")
+            raise Exception("No answers detected by YOLO model")
+
+        # Publish vùng cắt sang uploads/images/temp/<sheet_key>; thư mục job bị xóa khi ra khỏi with
+        sheet_dir = sheet_dir_for(temp_file_name)
+        with stage_timer('disk_write', 'fs'):
+            workspace.publish(sheet_dir)
+        crop_paths = {key: os.path.join(sheet_dir, os.path.basename(path)) for key, path in crop_paths.items()}
+        processed_image_path = os.path.join(sheet_dir, os.path.basename(processed_image_path))
+
+    sheet = {
+        'image_filename': image_filename,
+        'temp_file_name': temp_file_name,
+        'paths': crop_paths,
+        'exam_code': exam_code,
+        'raw_index': raw_index,
+        'student_result': student_result,
+        'processed_image_path': processed_image_path,
+        'raw_name': None,
+        'raw_id': None,
+        'identity_detected': False,
+        'stage_timings': timings,
+    }
+    if roster is not None:
+        with sheet_timings(timings):
+            detect_identity(sheet, roster)
+    return sheet
+
+
+# Các stage có thể chạy lại riêng cho một bài -> file vùng cắt trong thư mục của bài
+STAGE_CROPS = {
+    'code_box': 'code_box_bounding_box.jpg',
+    'name': 'name_bounding_box.jpg',
+    'id': 'id_student.jpg',
+    'index': 'index_student.jpg',
+    'grading': 'table_grading_bounding_box.jpg',
+}
+DESKEWED_IMAGE = 'deskewed.jpg'
+
+
+def run_stage(stage, crop_path, roster=None):
+    """
+    Chạy một detector trên vùng cắt của bài thi.
+
+    Returns:
+        dict: Kết quả thô của stage: exam_code | raw_name | raw_id | raw_index |
+        (student_result, processed_image_path).
+    """
+    if stage == 'code_box':
+        return {'exam_code': detect_code_box(crop_path)}
+    if stage == 'name':
+        return {'raw_name': detect_name_student(crop_path, roster['student_names'])}
+    if stage == 'id':
+        return {'raw_id': detect_id_student(crop_path, roster['student_ids'])}
+    if stage == 'index':
+        return {'raw_index': detect_index_student(crop_path)}
+    if stage == 'grading':
+        processed_image_path, student_result = predict_grade(crop_path, save_processed_image=True)
+        if not student_result:
+            raise Exception("No answers detected by YOLO model")
+        return {'student_result': student_result, 'processed_image_path': processed_image_path}
+    raise GradingInputError(f"Stage không hỗ trợ: {stage}")
+
+
+def score_sheet(sheet, context):
+    """
+    Validate thông tin sinh viên và tính điểm cho kết quả của extract_sheet.
+
+    Returns:
+        dict: Bản ghi kết quả theo format của /api/process_images.
+    """
+    timings = sheet.setdefault('stage_timings', {})
+    if not sheet['identity_detected']:
+        with sheet_timings(timings):
+            detect_identity(sheet, context)
+
+    df_key = context['df_key']
+    num_questions = context['num_questions']
+    exam_code = sheet['exam_code']
+    raw_name = sheet['raw_name']
+    raw_id = sheet['raw_id']
+    student_result = sheet['student_result']
+
+    # Lấy STT đầu tiên nếu có
+    raw_index = sheet['raw_index']
+    raw_stt = raw_index[0] if raw_index else None
+
+    # Validate và correct thông tin sinh viên
+    with sheet_timings(timings), stage_timer('validation', 'pandas'):
+        validation_result = validate_and_correct_student_info(
+            detected_name=raw_name,
+            detected_mssv=raw_id,
+            detected_stt=raw_stt,
+            df_students=context['df_part']
+        )
+
+    # Lấy thông tin đã được correct
+    corrected_name = validation_result['name']
+    corrected_mssv = validation_result['mssv']
+    corrected_stt = validation_result['stt']
+    correction_status = validation_result['status']
+
+    # Chuyển student_result thành danh sách câu trả lời
+    answers = [student_result.get(i, '') for i in range(1, num_questions + 1)]
+
+    # Tính điểm
+    with sheet_timings(timings), stage_timer('scoring', 'numpy'):
+        score = score_answers(answers, df_key, exam_code)
+
+    # Kiểm tra có vấn đề gì không
+    has_issue = (
+        exam_code not in df_key.index or
+        not corrected_name or
+        not corrected_mssv or
+        not corrected_stt or
+        correction_status != 'exact_match'
+    )
+
+    temp_file_name = sheet['temp_file_name']
+    processed_filename = os.path.basename(sheet['processed_image_path'])
+
+    log_event(logger, 'sheet_scored', image=sheet['image_filename'], sheet=temp_file_name,
+              exam_code=exam_code, score=score, status=correction_status, has_issue=has_issue,
+              stage_ms=timings)
+
+    return {
+        'id': corrected_mssv,
+        'name': corrected_name,
+        'testVariant': exam_code,
+        'score': score,
+        'answers': answers,
+        'image': normalize_path(sheet['image_filename']),
+        'imageName': temp_file_name,  # Tên folder cho processed images
+        'processedGradingImage': normalize_path(f"temp/{temp_file_name}/{processed_filename}"),  # Đường dẫn ảnh đã xử lý với bounding boxes
+        'has_issue': has_issue,
+        'num_questions': num_questions,
+        'index_student': corrected_stt or 'N/A',
+        'correction_status': correction_status,
+        'correction_reason': validation_result['correction_reason'],
+        'raw_detection': {
+            'name': raw_name,
+            'mssv': raw_id,
+            'stt': raw_stt
+        },
+        'stage_timings': dict(timings)
+    }
+
+
+def grade_sheet(image_filename, context):
+    """Chạy toàn bộ pipeline cho một ảnh; trả về None nếu không có file ảnh"""
+    sheet = extract_sheet(image_filename, context)
+    if sheet is None:
+        return None
+    return score_sheet(sheet, context)
+
+
+def summarize_results(students, num_questions):
+    """Tạo response tổng hợp cho một lô bài đã chấm"""
+    successful_recognitions = sum(
+        1 for s in students
+        if s['name'] and s['id'] and s['index_student'] != 'N/A' and s['score'] is not None and s['score'] > 0
+    )
+    total_students = len(students)
+    recognition_rate = (successful_recognitions / total_students * 100) if total_students > 0 else 0
+
+    logger.info(f"Processing completed. Total students: {total_students}, Recognition rate: {recognition_rate:.2f}%")
+
+    return {
+        'message': 'Processing completed',
+        'results': students,
+        'total_students': total_students,
+        'recognition_rate': round(recognition_rate, 2),
+        'num_questions': num_questions
+    }
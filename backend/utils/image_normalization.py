@@ -0,0 +1,118 @@
+"""
+Chuẩn hóa ảnh bài thi lúc upload: xoay theo EXIF và giảm về độ phân giải làm việc
+
+Ảnh chụp điện thoại (12–48 MP) được lưu thêm một bản làm việc trong
+uploads/images/working/ cùng tên file: đã xoay theo EXIF orientation và cạnh dài
+không quá WORKING_MAX_SIDE. Pipeline chấm và giao diện review dùng bản làm việc;
+ảnh gốc vẫn giữ nguyên để tải về khi cần.
+
+WORKING_MAX_SIDE mặc định 2200px: image_processing dùng HoughLinesP với
+minLineLength=500 và cắt vùng theo tỉ lệ, nên phiếu A4 cần cạnh ngắn ~1500px để
+các đường kẻ và ô trả lời vẫn đủ rõ cho YOLO/OCR.
+"""
+
+import logging
+import os
+import uuid
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = os.path.join('uploads', 'images')
+WORKING_DIR = os.path.join(IMAGES_DIR, 'working')
+WORKING_MAX_SIDE = int(os.environ.get('WORKING_MAX_SIDE', 2200))
+WORKING_JPEG_QUALITY = int(os.environ.get('WORKING_JPEG_QUALITY', 90))
+
+# Tag EXIF Orientation
+EXIF_ORIENTATION = 0x0112
+
+
+def working_path_for(image_filename):
+    return os.path.join(WORKING_DIR, image_filename)
+
+
+def _is_fresh(working_path, original_path):
+    return (os.path.exists(working_path)
+            and os.path.getmtime(working_path) >= os.path.getmtime(original_path))
+
+
+def create_working_copy(image_filename, max_side=WORKING_MAX_SIDE):
+    """
+    Tạo bản làm việc cho một ảnh trong uploads/images.
+
+    Chỉ ghi bản làm việc khi ảnh cần xoay theo EXIF hoặc lớn hơn max_side;
+    ngược lại ảnh gốc được dùng trực tiếp.
+
+    Returns:
+        dict | None: {'path', 'width', 'height', 'original_width', 'original_height'}
+        hoặc None nếu không đọc được ảnh.
+    """
+    original_path = os.path.join(IMAGES_DIR, image_filename)
+    try:
+        with Image.open(original_path) as image:
+            original_size = image.size
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            needs_resize = max(original_size) > max_side
+            if orientation in (None, 1) and not needs_resize:
+                # Bỏ bản làm việc cũ (nếu ảnh gốc vừa được upload lại)
+                if os.path.exists(working_path_for(image_filename)):
+                    os.remove(working_path_for(image_filename))
+                return {
+                    'path': original_path,
+                    'width': original_size[0],
+                    'height': original_size[1],
+                    'original_width': original_size[0],
+                    'original_height': original_size[1],
+                }
+
+            # JPEG: giải mã trực tiếp ở tỉ lệ 1/2, 1/4, 1/8 gần nhất (nhanh hơn và ít bộ nhớ hơn)
+            if needs_resize and image.format == 'JPEG':
+                scale = max_side / max(original_size)
+                image.draft('RGB', (int(original_size[0] * scale) + 1, int(original_size[1] * scale) + 1))
+
+            image = ImageOps.exif_transpose(image)
+            if max(image.size) > max_side:
+                image.thumbnail((max_side, max_side), Image.LANCZOS)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            working_path = working_path_for(image_filename)
+            os.makedirs(os.path.dirname(working_path), exist_ok=True)
+            tmp_path = f"{working_path}.{uuid.uuid4().hex}.tmp"
+            ext = os.path.splitext(image_filename)[1].lower()
+            if ext in ('.jpg', '.jpeg'):
+                image.save(tmp_path, format='JPEG', quality=WORKING_JPEG_QUALITY)
+            else:
+                image.save(tmp_path, format=Image.registered_extensions().get(ext, 'PNG'))
+            os.replace(tmp_path, working_path)
+            working_size = image.size
+    except Exception as e:
+        logger.error(f"Error normalizing {image_filename}: {e}")
+        return None
+
+    logger.info(f"Working copy {image_filename}: {original_size} -> {working_size} (orientation {orientation})")
+    return {
+        'path': working_path,
+        'width': working_size[0],
+        'height': working_size[1],
+        'original_width': original_size[0],
+        'original_height': original_size[1],
+    }
+
+
+def resolve_working_image(image_filename):
+    """
+    Đường dẫn ảnh dùng cho pipeline / review: bản làm việc nếu có (tạo nếu chưa
+    có hoặc cũ hơn ảnh gốc), ngược lại là ảnh gốc. None nếu không có ảnh gốc.
+    """
+    original_path = os.path.join(IMAGES_DIR, image_filename)
+    if not os.path.exists(original_path):
+        return None
+
+    working_path = working_path_for(image_filename)
+    if _is_fresh(working_path, original_path):
+        return working_path
+
+    info = create_working_copy(image_filename)
+    return info['path'] if info else original_path
@@ -1,13 +1,23 @@
 
+import logging
 import cv2
 import numpy as np
 import os
 
+from utils.metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+def _imwrite(path, image):
+    with stage_timer('disk_write', 'opencv'):
+        return cv2.imwrite(path, image)
+
 
 def divide_image(image_path):
     image = cv2.imread(image_path)
     if image is None:
-        print("Không thể đọc ảnh:", image_path)
+        logger.warning("Không thể đọc ảnh: %s", image_path)
         return None, None
 
     height, width = image.shape[:2]
@@ -28,13 +38,15 @@ def divide_image(image_path):
     return id_student, index_student
 
 
-def image_processing(path):
+def image_processing(path, temp_dir=None):
     """
     Xử lý ảnh bài thi để cắt các vùng: mã đề, tên, phiếu thi, mã SV, STT.
     Trả về đường dẫn các vùng cắt và tọa độ vùng phiếu thi.
 
     Args:
         path (str): Đường dẫn đến ảnh gốc.
+        temp_dir (str): Thư mục ghi các vùng cắt (thư mục làm việc riêng của job);
+            mặc định là ./uploads/images/temp/<tên ảnh>.
 
     Returns:
         dict:
@@ -43,74 +55,77 @@ def image_processing(path):
     """
     # Kiểm tra xem tệp có tồn tại không
     if not os.path.exists(path):
-        print(f"Tệp không tồn tại: {path}")
+        logger.warning("Tệp không tồn tại: %s", path)
         return {'paths': {}, 'grading_box': None}
 
     # Đọc hình ảnh
-    image = cv2.imread(path)
+    with stage_timer('decode', 'opencv'):
+        image = cv2.imread(path)
     if image is None:
-        print("Không thể đọc hình ảnh. Kiểm tra lại đường dẫn hoặc định dạng tệp.")
+        logger.warning("Không thể đọc hình ảnh %s. Kiểm tra lại đường dẫn hoặc định dạng tệp.", path)
         return {'paths': {}, 'grading_box': None}
 
-    # Tạo thư mục mới trong thư mục temp
-    base_temp_dir = './uploads/images/temp'
-    if not os.path.exists(base_temp_dir):
-        os.makedirs(base_temp_dir)
-
-    # Tạo tên thư mục dựa trên tên tệp ảnh
-    image_name = os.path.basename(path).split('.')[0]
-    temp_dir = os.path.join(base_temp_dir, image_name)
+    if temp_dir is None:
+        # Tạo tên thư mục dựa trên tên tệp ảnh (bỏ phần mở rộng cuối cùng)
+        image_name = os.path.splitext(os.path.basename(path))[0]
+        temp_dir = os.path.join('./uploads/images/temp', image_name)
     os.makedirs(temp_dir, exist_ok=True)
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Detect edges
-    edges = cv2.Canny(gray, 50, 150)
-
-    # Detect lines
-    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=10, minLineLength=500, maxLineGap=50)
-
-    # Variable to store the longest line
-    longest_line = None
-    max_length = 0
-
-    # Find the longest line
-    if lines is not None:
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            length = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)  # Calculate the length of the line
-            if length > max_length:
-                max_length = length
-                longest_line = (x1, y1, x2, y2)
-
-    # Rotate the image if the longest line is found
-    if longest_line is not None:
-        x1, y1, x2, y2 = longest_line
-        angle = np.arctan2(y2 - y1, x2 - x1) * 180.0 / np.pi  # Calculate the angle of inclination
-
-        # Rotate the image
-        (h, w) = image.shape[:2]
-        center = (w // 2, h // 2)
-        M = cv2.getRotationMatrix2D(center, angle, 1)
-        rotated = cv2.warpAffine(image, M, (w, h))
-        white_background = np.ones((h, w, 3), dtype=np.uint8) * 127
-        result = np.where(rotated == 0, white_background, rotated)
-        # Use the rotated image for further processing
-        image = result
-    else:
-        print("No lines found.")
-
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    # Enhance contrast
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(gray)
-    # Blur to reduce noise
-    blurred = cv2.GaussianBlur(enhanced, (5, 5), 0)
-    # Binarization
-    binary = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
-    # Find contours
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    with stage_timer('deskew', 'opencv'):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        # Detect edges
+        edges = cv2.Canny(gray, 50, 150)
+
+        # Detect lines
+        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=10, minLineLength=500, maxLineGap=50)
+
+        # Variable to store the longest line
+        longest_line = None
+        max_length = 0
+
+        # Find the longest line
+        if lines is not None:
+            for line in lines:
+                x1, y1, x2, y2 = line[0]
+                length = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)  # Calculate the length of the line
+                if length > max_length:
+                    max_length = length
+                    longest_line = (x1, y1, x2, y2)
+
+        # Rotate the image if the longest line is found
+        if longest_line is not None:
+            x1, y1, x2, y2 = longest_line
+            angle = np.arctan2(y2 - y1, x2 - x1) * 180.0 / np.pi  # Calculate the angle of inclination
+
+            # Rotate the image
+            (h, w) = image.shape[:2]
+            center = (w // 2, h // 2)
+            M = cv2.getRotationMatrix2D(center, angle, 1)
+            rotated = cv2.warpAffine(image, M, (w, h))
+            white_background = np.ones((h, w, 3), dtype=np.uint8) * 127
+            result = np.where(rotated == 0, white_background, rotated)
+            # Use the rotated image for further processing
+            image = result
+        else:
+            logger.debug("No lines found: %s", path)
+
+    # Lưu ảnh đã xoay thẳng để có thể cắt lại từng vùng mà không chạy lại cả pipeline
+    deskewed_path = os.path.join(temp_dir, "deskewed.jpg")
+    _imwrite(deskewed_path, image)
+
+    with stage_timer('layout', 'opencv'):
+        # Convert the image to grayscale
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # Enhance contrast
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(gray)
+        # Blur to reduce noise
+        blurred = cv2.GaussianBlur(enhanced, (5, 5), 0)
+        # Binarization
+        binary = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+        # Find contours
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     # Get the dimensions of the image
     height, width = image.shape[:2]
@@ -155,7 +170,7 @@ def image_processing(path):
             second_largest_box = (diagonal, (x, y, w, h))
             break
 
-    paths = {}
+    paths = {'deskewed': deskewed_path}
 
     # Draw the largest bounding box in green if found (Name + id student)
     if largest_box:
@@ -167,7 +182,7 @@ def image_processing(path):
 
         # Save the extracted region of interest as an image
         infor_path = os.path.join(temp_dir, "infor_student_bounding_box.jpg")
-        cv2.imwrite(infor_path, infor_student)
+        _imwrite(infor_path, infor_student)
         paths['infor_student'] = infor_path
 
         # Draw the largest rectangle on the image with green color
@@ -184,14 +199,14 @@ def image_processing(path):
         name_student = infor_student[0:grid_height, 0:grid_width]
 
         name_path = os.path.join(temp_dir, "name_bounding_box.jpg")
-        cv2.imwrite(name_path, name_student)
+        _imwrite(name_path, name_student)
         paths['name'] = name_path
 
         # Extract the bottom-left region of the grid from infor_student
         id_student = infor_student[grid_height:height, 0:grid_width]
 
         id_path = os.path.join(temp_dir, "id_bounding_box.jpg")
-        cv2.imwrite(id_path, id_student)
+        _imwrite(id_path, id_student)
         paths['id_bounding_box'] = id_path
 
         id_student_part, index_student_part = divide_image(id_path)
@@ -199,19 +214,19 @@ def image_processing(path):
         if id_student_part is not None and index_student_part is not None:
             id_student_path = os.path.join(temp_dir, "id_student.jpg")
             index_student_path = os.path.join(temp_dir, "index_student.jpg")
-            cv2.imwrite(id_student_path, id_student_part)
-            cv2.imwrite(index_student_path, index_student_part)
+            _imwrite(id_student_path, id_student_part)
+            _imwrite(index_student_path, index_student_part)
             paths['id_student'] = id_student_path
             paths['index_student'] = index_student_path
         else:
-            print("Không thể chia ảnh id_bounding_box.jpg")
+            logger.warning("Không thể chia ảnh id_bounding_box.jpg")
 
     # Draw the second largest bounding box in blue if found (code box)
     if second_largest_box:
         _, (x, y, w, h) = second_largest_box
         code_box = image[y:y + h, x:x + w]
         code_path = os.path.join(temp_dir, "code_box_bounding_box.jpg")
-        cv2.imwrite(code_path, code_box)
+        _imwrite(code_path, code_box)
         paths['code_box'] = code_path
         cv2.rectangle(image_with_rectangles, (x, y), (x + w, y + h), (255, 0, 0), 2)
 
@@ -227,7 +242,7 @@ def image_processing(path):
         # Extract and save the bounding box around the largest contour
         table_grading = image[y:y + h, x:x + w]
         grading_path = os.path.join(temp_dir, "table_grading_bounding_box.jpg")
-        cv2.imwrite(grading_path, table_grading)
+        _imwrite(grading_path, table_grading)
         paths['table_grading'] = grading_path
         cv2.rectangle(image_with_rectangles, (x, y), (x + w, y + h), (255, 0, 0), 2)
 
@@ -0,0 +1,184 @@
+"""
+Ảnh dẫn xuất (thumbnail, medium) và response file có HTTP caching cho bước review
+
+Mỗi variant được tạo một lần từ ảnh nguồn, lưu trong uploads/cache/variants với
+tên theo hash của (đường dẫn nguồn, kích thước, mtime, variant, định dạng), nên
+ảnh nguồn thay đổi thì variant tự được tạo lại. Response gửi ETag,
+Last-Modified, Cache-Control, trả 304 cho request có điều kiện và hỗ trợ Range.
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi.responses import Response, StreamingResponse
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+VARIANT_CACHE_DIR = os.path.join('uploads', 'cache', 'variants')
+# Cạnh dài tối đa của từng variant
+IMAGE_VARIANTS = {
+    'thumb': int(os.environ.get('THUMB_MAX_SIDE', 320)),
+    'medium': int(os.environ.get('MEDIUM_MAX_SIDE', 1024)),
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True}),
+}
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 3600))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+}
+
+
+class ImageVariantError(Exception):
+    """Variant hoặc định dạng không hợp lệ"""
+
+
+def is_safe_name(name):
+    """Tên file/thư mục đơn, không chứa đường dẫn"""
+    return bool(name) and name == os.path.basename(name) and not name.startswith('.')
+
+
+def negotiate_format(accept_header, requested=None):
+    """Chọn định dạng variant: theo ?format=, nếu không thì WebP khi trình duyệt hỗ trợ"""
+    if requested:
+        requested = requested.lower().replace('jpg', 'jpeg')
+        if requested not in VARIANT_FORMATS:
+            raise ImageVariantError(f"Định dạng không hỗ trợ: {requested}")
+        return requested
+    return 'webp' if 'image/webp' in (accept_header or '') else 'jpeg'
+
+
+def get_variant_path(source_path, variant, fmt='jpeg'):
+    """
+    Đường dẫn variant của ảnh nguồn, tạo nếu chưa có.
+
+    Returns:
+        tuple: (đường dẫn, media type)
+    """
+    if variant not in IMAGE_VARIANTS:
+        raise ImageVariantError(f"Variant không hỗ trợ: {variant}")
+    pil_format, media_type, save_options = VARIANT_FORMATS[fmt]
+
+    stat = os.stat(source_path)
+    key = f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{variant}|{fmt}"
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+    variant_path = os.path.join(VARIANT_CACHE_DIR, f"{digest}.{fmt}")
+    if os.path.exists(variant_path):
+        return variant_path, media_type
+
+    max_side = IMAGE_VARIANTS[variant]
+    with Image.open(source_path) as image:
+        if image.format == 'JPEG':
+            image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        os.makedirs(VARIANT_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{variant_path}.{uuid.uuid4().hex}.tmp"
+        image.save(tmp_path, format=pil_format, **save_options)
+    os.replace(tmp_path, variant_path)
+    logger.info(f"Created {variant}/{fmt} variant for {source_path}")
+    return variant_path, media_type
+
+
+def _etag_for(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _not_modified(request_headers, etag, mtime):
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+    if_modified_since = request_headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(range_header, file_size):
+    """Parse một khoảng 'bytes=start-end'; trả về (start, end) hoặc None nếu không dùng được"""
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_text, _, end_text = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start_text == '':
+            # bytes=-N: N byte cuối
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            return max(file_size - length, 0), file_size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else file_size - 1
+    except ValueError:
+        raise ImageVariantError('Range không hợp lệ')
+    if start >= file_size or start > end:
+        raise ImageVariantError('Range không hợp lệ')
+    return start, min(end, file_size - 1)
+
+
+def _iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def cached_file_response(request, path, media_type=None, max_age=IMAGE_CACHE_MAX_AGE, vary_accept=False):
+    """
+    Response cho file tĩnh với ETag/Last-Modified/Cache-Control, 304 và Range.
+    """
+    stat = os.stat(path)
+    etag = _etag_for(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Cache-Control': f"private, max-age={max_age}",
+        'Accept-Ranges': 'bytes',
+    }
+    if vary_accept:
+        headers['Vary'] = 'Accept'
+    media_type = media_type or MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+
+    if _not_modified(request.headers, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    file_size = stat.st_size
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = _parse_range(range_header, file_size)
+        except ImageVariantError:
+            headers['Content-Range'] = f"bytes */{file_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers['Content-Range'] = f"bytes {start}-{end}/{file_size}"
+            headers['Content-Length'] = str(length)
+            return StreamingResponse(_iter_file(path, start, length), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    headers['Content-Length'] = str(file_size)
+    return StreamingResponse(_iter_file(path, 0, file_size), media_type=media_type, headers=headers)
@@ -0,0 +1,216 @@
+"""
+Phiên ingest theo phòng thi: chấm từng ảnh ngay khi upload xong
+
+Mỗi ảnh được đưa vào grading executor cho giai đoạn thị giác (extract_sheet)
+ngay khi đã nằm trên đĩa, nên thời gian upload và thời gian xử lý chồng lên
+nhau. Khi kết thúc phiên (finalize), các bài được validate theo danh sách sinh
+viên và chấm điểm theo đáp án.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+
+from utils.executor import submit_blocking
+from utils.results_store import persist_results
+from utils.grading_pipeline import (
+    GradingInputError, extract_sheet, score_sheet, summarize_results, load_roster_context, load_key_context
+)
+
+logger = logging.getLogger(__name__)
+
+# Phiên không hoạt động quá lâu bị bỏ bởi sweeper nền (và khi tạo phiên mới)
+SESSION_IDLE_TTL_SECONDS = int(os.environ.get('SESSION_IDLE_TTL_SECONDS', 6 * 3600))
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.environ.get('SESSION_SWEEP_INTERVAL_SECONDS', 10 * 60))
+
+
+class SessionFinalized(RuntimeError):
+    """Phiên đã kết thúc: không nhận thêm ảnh, không finalize lại"""
+
+
+class IngestSession:
+    """Trạng thái một phiên ingest: ảnh đã nhận, future của giai đoạn thị giác"""
+
+    def __init__(self, room):
+        self.session_id = uuid.uuid4().hex
+        self.room = room
+        self.answer_key_filename = None
+        self.student_list_filename = None
+        self.roster = None
+        self.key = None
+        self.futures = {}
+        self.finalized = False
+        self.last_activity = time.time()
+        self._lock = threading.Lock()
+
+    def configure(self, answer_key_filename=None, student_list_filename=None):
+        """Cập nhật file đáp án / danh sách sinh viên (raise GradingInputError nếu không dùng được)"""
+        with self._lock:
+            if student_list_filename:
+                self.roster = load_roster_context(student_list_filename, self.room)
+                self.student_list_filename = student_list_filename
+            if answer_key_filename:
+                self.key = load_key_context(answer_key_filename)
+                self.answer_key_filename = answer_key_filename
+            self.last_activity = time.time()
+
+    def submit(self, image_filename):
+        """Đưa ảnh vừa upload vào giai đoạn thị giác"""
+        with self._lock:
+            if self.finalized:
+                raise SessionFinalized(f"Session {self.session_id} đã kết thúc")
+            self.futures[image_filename] = submit_blocking(extract_sheet, image_filename, self.roster)
+            self.last_activity = time.time()
+
+    def discard(self, image_filenames):
+        """
+        Bỏ các ảnh khỏi phiên (vd. trang của archive bị hủy giữa chừng).
+
+        Returns:
+            list: Các ảnh chưa bắt đầu xử lý (future đã hủy) - người gọi có thể xóa file;
+            ảnh đang chạy chỉ bị bỏ khỏi phiên, file được giữ cho tới khi retention dọn.
+        """
+        cancelled = []
+        with self._lock:
+            for image_filename in image_filenames:
+                future = self.futures.pop(image_filename, None)
+                if future is not None and future.cancel():
+                    cancelled.append(image_filename)
+            self.last_activity = time.time()
+        return cancelled
+
+    def status(self):
+        with self._lock:
+            futures = dict(self.futures)
+        done = [f for f in futures.values() if f.done()]
+        failed = [f for f in done if f.exception() is not None]
+        return {
+            'session_id': self.session_id,
+            'room': self.room,
+            'answer_key_filename': self.answer_key_filename,
+            'student_list_filename': self.student_list_filename,
+            'received': len(futures),
+            'processed': len(done) - len(failed),
+            'failed': len(failed),
+            'pending': len(futures) - len(done),
+            'finalized': self.finalized,
+        }
+
+    def close(self):
+        """
+        Kết thúc nhận ảnh và trả về future giai đoạn thị giác của từng ảnh.
+        Người gọi chờ các future xong (không chiếm thread của executor) rồi gọi score_all.
+        Gọi lần thứ hai raise SessionFinalized (tránh lưu kết quả của phiên hai lần).
+        """
+        with self._lock:
+            if self.finalized:
+                raise SessionFinalized(f"Session {self.session_id} đã kết thúc")
+            if self.roster is None or self.key is None:
+                raise GradingInputError('Phiên chưa có đáp án hoặc danh sách sinh viên.')
+            self.finalized = True
+            self.last_activity = time.time()
+            return dict(self.futures)
+
+    def score_all(self):
+        """
+        Chấm điểm mọi ảnh đã qua giai đoạn thị giác (gọi sau close).
+
+        Returns:
+            dict: Response cùng format với /api/process_images.
+        """
+        context = dict(self.roster)
+        context.update(self.key)
+
+        students = []
+        for image_filename, future in self.futures.items():
+            try:
+                sheet = future.result()
+                if sheet is None:
+                    continue
+                students.append(score_sheet(sheet, context))
+            except Exception as e:
+                logger.error(f"Error processing {image_filename}: {e}")
+                continue
+
+        return persist_results(
+            summarize_results(students, context['num_questions']),
+            self.answer_key_filename, self.room, self.answer_key_filename, self.student_list_filename
+        )
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def evict_idle_sessions(ttl=SESSION_IDLE_TTL_SECONDS, now=None):
+    """
+    Bỏ các phiên không hoạt động quá ttl giây: hủy các ảnh chưa bắt đầu xử lý
+    để giải phóng hàng đợi executor và kết quả giữ trong future. Phiên còn ảnh
+    đang chạy được giữ tới lần quét sau.
+
+    Returns:
+        int: Số phiên đã bỏ.
+    """
+    now = time.time() if now is None else now
+    with _sessions_lock:
+        idle = [s for s in _sessions.values() if now - s.last_activity > ttl]
+        evicted = []
+        for session in idle:
+            futures = list(session.futures.values())
+            if any(f.running() for f in futures):
+                continue
+            for future in futures:
+                future.cancel()
+            del _sessions[session.session_id]
+            evicted.append(session)
+    for session in evicted:
+        logger.info(f"Evicted idle ingest session {session.session_id} (room {session.room}, "
+                    f"{len(session.futures)} images, finalized={session.finalized})")
+    return len(evicted)
+
+
+def create_session(room, answer_key_filename=None, student_list_filename=None):
+    """Tạo phiên mới (đáp án / danh sách có thể bổ sung sau bằng configure)"""
+    session = IngestSession(room)
+    session.configure(answer_key_filename, student_list_filename)
+
+    evict_idle_sessions()
+    with _sessions_lock:
+        _sessions[session.session_id] = session
+    logger.info(f"Created ingest session {session.session_id} for room {room}")
+    return session
+
+
+def get_session(session_id):
+    with _sessions_lock:
+        return _sessions.get(session_id)
+
+
+_sweeper_task = None
+
+
+async def _sweep_sessions_forever(interval):
+    while True:
+        try:
+            evict_idle_sessions()
+        except Exception as e:
+            logger.error(f"Ingest session sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_session_sweeper(interval=SESSION_SWEEP_INTERVAL_SECONDS):
+    """Chạy sweeper phiên ingest trên event loop hiện tại (gọi lúc startup)"""
+    global _sweeper_task
+    if _sweeper_task is None and interval > 0:
+        _sweeper_task = asyncio.get_running_loop().create_task(_sweep_sessions_forever(interval))
+    return _sweeper_task
+
+
+def stop_session_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        _sweeper_task = None
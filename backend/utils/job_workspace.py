@@ -0,0 +1,171 @@
+"""
+Thư mục làm việc riêng cho từng job chấm và tên artifact theo nội dung
+
+Mỗi lần xử lý một ảnh chạy trong một thư mục tạm riêng (uploads/jobs/<job>),
+nên các lô chấm song song không ghi đè file của nhau dù ảnh trùng tên. Khi xong,
+các vùng cắt được publish nguyên tử (os.replace từng file) vào
+uploads/images/temp/<sheet_key>, và thư mục tạm luôn bị xóa kể cả khi lỗi.
+
+sheet_key gồm hash nội dung ảnh gốc và một hậu tố ngẫu nhiên cho mỗi lần xử lý:
+hai job chấm cùng một ảnh cùng lúc có thư mục artifact riêng, không đè lên nhau.
+
+Tên thư mục job chứa PID của process tạo ra nó (<prefix><pid>_<random>). Lúc
+khởi động, cleanup_stale_jobs chỉ xóa thư mục của process đã chết hoặc cũ hơn
+JOB_WORKSPACE_STALE_SECONDS, không đụng vào job đang chạy của worker khác dùng
+chung uploads/.
+"""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from utils.artifact_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.path.join('uploads', 'jobs')
+SHEETS_DIR = os.path.join('uploads', 'images', 'temp')
+# Số ký tự hex của SHA-256 dùng trong tên file / thư mục (64 bit)
+DIGEST_PREFIX_LENGTH = 16
+# Hậu tố ngẫu nhiên của sheet_key (mỗi lần xử lý một ảnh)
+RUN_SUFFIX_LENGTH = 8
+# Thư mục job cũ hơn ngưỡng này bị coi là sót lại dù không xác định được process
+JOB_WORKSPACE_STALE_SECONDS = int(os.environ.get('JOB_WORKSPACE_STALE_SECONDS', 6 * 3600))
+
+_WORKSPACE_PID_RE = re.compile(r'^[A-Za-z]+_(\d+)_')
+
+
+def safe_filename(filename):
+    """Bỏ thư mục và ký tự lạ khỏi tên file, giữ phần mở rộng"""
+    stem, ext = os.path.splitext(os.path.basename(filename.replace('\\', '/')))
+    stem = re.sub(r'[^\w\-.]+', '_', stem).strip('._') or 'image'
+    return f"{stem}{ext.lower()}"
+
+
+def content_addressed_name(digest, filename):
+    """Tên lưu trữ của upload: <hash nội dung>_<tên gốc an toàn>"""
+    return f"{digest[:DIGEST_PREFIX_LENGTH]}_{safe_filename(filename)}"
+
+
+def sheet_key_for(image_path):
+    """
+    Tên thư mục artifact cho một lần xử lý bài thi: <hash nội dung ảnh>_<ngẫu nhiên>.
+    Mỗi lần gọi trả về một key mới.
+    """
+    return f"{file_sha256(image_path)[:DIGEST_PREFIX_LENGTH]}_{uuid.uuid4().hex[:RUN_SUFFIX_LENGTH]}"
+
+
+def rerun_sheet_key(sheet_id):
+    """Thư mục artifact cho một lần chạy lại stage của bài đã lưu: sheet<id>_<ngẫu nhiên>"""
+    return f"sheet{sheet_id}_{uuid.uuid4().hex[:RUN_SUFFIX_LENGTH]}"
+
+
+def sheet_dirs_for(image_path):
+    """Mọi thư mục artifact đã publish cho ảnh này (các lần xử lý khác nhau)"""
+    if not os.path.isdir(SHEETS_DIR):
+        return []
+    prefix = f"{file_sha256(image_path)[:DIGEST_PREFIX_LENGTH]}_"
+    return [os.path.join(SHEETS_DIR, name) for name in os.listdir(SHEETS_DIR) if name.startswith(prefix)]
+
+
+def sheet_dir_for(sheet_key):
+    return os.path.join(SHEETS_DIR, sheet_key)
+
+
+class JobWorkspace:
+    """
+    Thư mục tạm của một job. Dùng với `with`:
+
+        with JobWorkspace() as workspace:
+            ... ghi file vào workspace.path ...
+            published = workspace.publish(sheet_dir)
+    """
+
+    def __init__(self, prefix='job_'):
+        self.prefix = prefix
+        self.path = None
+
+    def __enter__(self):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f"{self.prefix}{os.getpid()}_", dir=JOBS_DIR)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+    def publish(self, dest_dir):
+        """
+        Chuyển mọi file trong workspace sang dest_dir, mỗi file bằng một os.replace
+        (người đọc không bao giờ thấy file ghi dở).
+
+        Returns:
+            dict: Tên file -> đường dẫn mới.
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        published = {}
+        for name in os.listdir(self.path):
+            src = os.path.join(self.path, name)
+            if not os.path.isfile(src):
+                continue
+            dst = os.path.join(dest_dir, name)
+            os.replace(src, dst)
+            published[name] = dst
+        return published
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # os.kill trên Windows kết thúc process thay vì kiểm tra; chỉ dựa vào tuổi thư mục
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Process tồn tại nhưng thuộc user khác
+        return True
+    return True
+
+
+def _is_stale(path, name, now, max_age):
+    try:
+        if now - os.path.getmtime(path) > max_age:
+            return True
+    except FileNotFoundError:
+        return False
+    match = _WORKSPACE_PID_RE.match(name)
+    return match is not None and not _pid_alive(int(match.group(1)))
+
+
+def cleanup_stale_jobs(max_age=None, now=None):
+    """
+    Xóa thư mục job còn sót lại (server bị dừng giữa chừng); gọi lúc khởi động.
+    Chỉ xóa thư mục của process đã chết hoặc cũ hơn max_age (mặc định
+    JOB_WORKSPACE_STALE_SECONDS); job đang chạy của process khác được giữ nguyên.
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return 0
+    max_age = JOB_WORKSPACE_STALE_SECONDS if max_age is None else max_age
+    now = time.time() if now is None else now
+    removed = 0
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        if not _is_stale(path, name, now, max_age):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale job workspace(s)")
+    return removed
@@ -0,0 +1,73 @@
+"""
+Logging có cấu trúc cho đường xử lý nóng
+
+- configure_logging(): mức log chung (LOG_LEVEL) và theo từng module
+  (LOG_LEVELS="utils.detectInfo=DEBUG,utils.grading_pipeline=WARNING")
+- lazy(): giá trị chỉ được tính khi bản ghi log thực sự được ghi ra, dùng với
+  định dạng %-style của logging:
+      logger.debug("Roster parts: %s", lazy(lambda: list(df_parts)))
+- log_event(): một dòng JSON gọn cho mỗi sự kiện (vd. mỗi bài đã chấm); không
+  dựng payload khi mức log đang tắt
+"""
+
+import json
+import logging
+import os
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Danh sách "tên_logger=MỨC" cách nhau bằng dấu phẩy
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', logging.BASIC_FORMAT)
+
+
+def parse_levels(spec):
+    """'a=DEBUG,b.c=WARNING' -> {'a': 'DEBUG', 'b.c': 'WARNING'} (bỏ qua mục sai)"""
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        name, level = name.strip(), level.strip().upper()
+        if name and isinstance(logging.getLevelName(level), int):
+            levels[name] = level
+    return levels
+
+
+def configure_logging(level=LOG_LEVEL, levels=LOG_LEVELS):
+    """Cấu hình root logger một lần và mức riêng cho từng module"""
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+class _Lazy:
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+    __repr__ = __str__
+
+
+def lazy(func):
+    """Bọc một hàm không tham số; hàm chỉ được gọi khi bản ghi log được định dạng"""
+    return _Lazy(func)
+
+
+class _Event:
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps({'event': self.event, **self.fields},
+                          ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Ghi một sự kiện dạng JSON một dòng, ví dụ {"event":"sheet_scored","score":42,...}"""
+    if logger.isEnabledFor(level):
+        logger.log(level, '%s', _Event(event, fields))
@@ -0,0 +1,366 @@
+"""
+Theo dõi bộ nhớ và giới hạn số bài đang xử lý khi RSS gần ngưỡng
+
+Một lô lớn ảnh độ phân giải cao, cộng với TrOCR / EasyOCR / YOLO thường trú
+trong cùng process, có thể đẩy server vào swap hoặc bị OOM-kill. Module này:
+
+- Đọc RSS hiện tại: psutil nếu có, nếu không thì /proc/self/status.
+- Lấy mẫu RSS quanh mỗi stage_timer (hook của utils.metrics): mức tăng RSS lớn
+  nhất và đỉnh RSS theo (stage, engine). RSS là của cả process nên khi nhiều
+  bài chạy song song, số liệu theo stage chỉ mang tính gần đúng.
+- MemoryGovernor: mỗi bài (extract_sheet) lấy một slot trước khi chạy. Dưới
+  ngưỡng mềm được chạy tối đa GRADING_WORKERS bài, trên ngưỡng mềm chỉ còn một
+  bài, trên ngưỡng cứng thì chờ các bài khác xong (gc + trả bộ nhớ cho OS) rồi
+  chạy tuần tự. Lô bài chậm lại thay vì làm chết worker.
+- tracemalloc (MEMORY_TRACEMALLOC=1 hoặc bật qua /debug/memory?trace=start)
+  để liệt kê các dòng code cấp phát nhiều nhất.
+
+/debug/memory lộ vị trí mã nguồn và có thể bật tracemalloc (làm chậm mọi cấp
+phát), nên chỉ mở khi đã đặt MEMORY_DEBUG_TOKEN (hoặc PROFILE_TOKEN) và request
+gửi đúng token trong header X-Debug-Token.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import hmac
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:  # Tùy chọn: fallback đọc /proc/self/status
+    psutil = None
+
+from utils.executor import GRADING_WORKERS
+from utils.metrics import add_stage_hook
+
+logger = logging.getLogger(__name__)
+
+# Ngưỡng bộ nhớ của process (MB); 0 = tự xác định từ cgroup hoặc RAM máy
+MEMORY_LIMIT_MB = int(os.environ.get('MEMORY_LIMIT_MB', 0))
+# Khi tự xác định: dùng phần này của giới hạn cgroup / RAM
+MEMORY_LIMIT_FRACTION = float(os.environ.get('MEMORY_LIMIT_FRACTION', 0.8))
+# Trên ngưỡng mềm chỉ chạy một bài; trên ngưỡng cứng chờ bài khác xong trước
+MEMORY_SOFT_RATIO = float(os.environ.get('MEMORY_SOFT_RATIO', 0.8))
+MEMORY_HARD_RATIO = float(os.environ.get('MEMORY_HARD_RATIO', 0.95))
+MEMORY_POLL_SECONDS = float(os.environ.get('MEMORY_POLL_SECONDS', 0.5))
+MEMORY_GUARD_ENABLED = os.environ.get('MEMORY_GUARD_ENABLED', '1') == '1'
+MEMORY_STAGE_SAMPLING = os.environ.get('MEMORY_STAGE_SAMPLING', '1') == '1'
+MEMORY_TRACEMALLOC = os.environ.get('MEMORY_TRACEMALLOC', '0') == '1'
+MEMORY_TRACEMALLOC_FRAMES = int(os.environ.get('MEMORY_TRACEMALLOC_FRAMES', 1))
+# Token cho /debug/memory (header X-Debug-Token); không đặt thì endpoint trả 404
+MEMORY_DEBUG_TOKEN = os.environ.get('MEMORY_DEBUG_TOKEN', '') or os.environ.get('PROFILE_TOKEN', '')
+MEMORY_DEBUG_HEADER = 'x-debug-token'
+
+_CGROUP_LIMIT_FILES = (
+    '/sys/fs/cgroup/memory.max',                    # cgroup v2
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroup v1
+)
+# cgroup v1 báo "không giới hạn" bằng một số rất lớn
+_UNLIMITED_THRESHOLD = 1 << 60
+
+
+def current_rss_bytes():
+    """RSS hiện tại của process (byte); 0 nếu không đọc được"""
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception:
+            pass
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def _read_int(path):
+    try:
+        with open(path, encoding='ascii') as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def _total_memory_bytes():
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    try:
+        with open('/proc/meminfo', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def detect_memory_limit():
+    """Ngưỡng bộ nhớ (byte): MEMORY_LIMIT_MB, hoặc một phần giới hạn cgroup / RAM; 0 = không rõ"""
+    if MEMORY_LIMIT_MB > 0:
+        return MEMORY_LIMIT_MB * 1024 * 1024
+    limits = [_read_int(path) for path in _CGROUP_LIMIT_FILES]
+    limits = [limit for limit in limits if limit and limit < _UNLIMITED_THRESHOLD]
+    total = _total_memory_bytes()
+    if total:
+        limits.append(total)
+    return int(min(limits) * MEMORY_LIMIT_FRACTION) if limits else 0
+
+
+_libc = None
+
+
+def release_memory():
+    """gc.collect() rồi trả vùng heap trống cho OS (malloc_trim, chỉ glibc)"""
+    global _libc
+    collected = gc.collect()
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            _libc.malloc_trim.argtypes = [ctypes.c_size_t]
+        except (OSError, AttributeError):
+            _libc = False
+    if _libc:
+        _libc.malloc_trim(0)
+    return collected
+
+
+class MemoryGovernor:
+    """Giới hạn số bài đang xử lý theo RSS so với ngưỡng"""
+
+    def __init__(self, limit_bytes=None, max_in_flight=GRADING_WORKERS,
+                 soft_ratio=MEMORY_SOFT_RATIO, hard_ratio=MEMORY_HARD_RATIO, poll_seconds=MEMORY_POLL_SECONDS):
+        self.limit_bytes = detect_memory_limit() if limit_bytes is None else limit_bytes
+        self.max_in_flight = max(1, max_in_flight)
+        self.soft_bytes = int(self.limit_bytes * soft_ratio)
+        self.hard_bytes = int(self.limit_bytes * hard_ratio)
+        self.poll_seconds = poll_seconds
+        self.in_flight = 0
+        self.peak_rss = 0
+        self.metrics = {'throttled_total': 0, 'waited_seconds_total': 0.0, 'hard_limit_total': 0}
+        self._cond = threading.Condition()
+
+    def allowed_in_flight(self, rss):
+        if not self.limit_bytes or rss < self.soft_bytes:
+            return self.max_in_flight
+        return 1
+
+    def _can_start(self, rss):
+        if self.in_flight == 0:
+            return True
+        return rss < self.hard_bytes and self.in_flight < self.allowed_in_flight(rss)
+
+    @contextmanager
+    def sheet_slot(self, name=''):
+        """Chờ tới khi bộ nhớ cho phép rồi chạy một bài; luôn chạy được khi không còn bài nào khác"""
+        waited = None
+        with self._cond:
+            while True:
+                rss = current_rss_bytes()
+                self.peak_rss = max(self.peak_rss, rss)
+                if self._can_start(rss):
+                    break
+                if waited is None:
+                    waited = time.monotonic()
+                    self.metrics['throttled_total'] += 1
+                    logger.info("Memory guard: holding %s (rss=%d MB, in flight=%d, limit=%d MB)",
+                                name, rss >> 20, self.in_flight, self.limit_bytes >> 20)
+                self._cond.wait(self.poll_seconds)
+            self.in_flight += 1
+            if waited is not None:
+                self.metrics['waited_seconds_total'] += time.monotonic() - waited
+            over_hard_limit = self.limit_bytes and rss >= self.hard_bytes
+            if over_hard_limit:
+                self.metrics['hard_limit_total'] += 1
+
+        if over_hard_limit:
+            # Chạy một mình trên ngưỡng cứng: thu dọn trước để có chỗ cho bài này
+            release_memory()
+            logger.warning("Memory guard: rss %d MB above hard limit %d MB, grading %s serially",
+                           rss >> 20, self.hard_bytes >> 20, name)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def snapshot(self):
+        rss = current_rss_bytes()
+        with self._cond:
+            return {
+                'enabled': MEMORY_GUARD_ENABLED,
+                'rss_bytes': rss,
+                'peak_rss_bytes': max(self.peak_rss, rss),
+                'limit_bytes': self.limit_bytes,
+                'soft_limit_bytes': self.soft_bytes,
+                'hard_limit_bytes': self.hard_bytes,
+                'in_flight': self.in_flight,
+                'allowed_in_flight': self.allowed_in_flight(rss),
+                'metrics': {**self.metrics, 'waited_seconds_total': round(self.metrics['waited_seconds_total'], 3)},
+            }
+
+
+# Global governor instance
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_memory_governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = MemoryGovernor()
+                logger.info("Memory guard limit: %d MB (soft %d MB, hard %d MB)",
+                            _governor.limit_bytes >> 20, _governor.soft_bytes >> 20, _governor.hard_bytes >> 20)
+    return _governor
+
+
+@contextmanager
+def sheet_memory_slot(name=''):
+    """Slot của governor cho một bài; không làm gì nếu MEMORY_GUARD_ENABLED=0"""
+    if not MEMORY_GUARD_ENABLED:
+        yield
+        return
+    with get_memory_governor().sheet_slot(name):
+        yield
+
+
+# Mức dùng bộ nhớ theo (stage, engine)
+_stage_memory = {}
+_stage_memory_lock = threading.Lock()
+
+
+@contextmanager
+def stage_memory_hook(stage, engine):
+    """Hook cho metrics.stage_timer: RSS trước / sau stage"""
+    before = current_rss_bytes()
+    try:
+        yield
+    finally:
+        after = current_rss_bytes()
+        key = (stage, engine or '')
+        with _stage_memory_lock:
+            stats = _stage_memory.get(key)
+            if stats is None:
+                stats = _stage_memory[key] = {'count': 0, 'rss_delta_sum': 0, 'rss_delta_max': 0, 'rss_peak': 0}
+            stats['count'] += 1
+            stats['rss_delta_sum'] += after - before
+            stats['rss_delta_max'] = max(stats['rss_delta_max'], after - before)
+            stats['rss_peak'] = max(stats['rss_peak'], after)
+
+
+def stage_memory_snapshot():
+    """Mức tăng RSS theo stage, stage tăng nhiều nhất trước"""
+    with _stage_memory_lock:
+        items = [(key, dict(stats)) for key, stats in _stage_memory.items()]
+    return sorted(
+        (
+            {
+                'stage': stage,
+                'engine': engine,
+                'count': stats['count'],
+                'rss_delta_mean_bytes': stats['rss_delta_sum'] // stats['count'],
+                'rss_delta_max_bytes': stats['rss_delta_max'],
+                'rss_peak_bytes': stats['rss_peak'],
+            }
+            for (stage, engine), stats in items
+        ),
+        key=lambda item: -item['rss_delta_max_bytes'],
+    )
+
+
+def start_tracing(frames=MEMORY_TRACEMALLOC_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        logger.info("tracemalloc started (%d frame(s))", frames)
+
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        logger.info("tracemalloc stopped")
+
+
+def top_allocators(limit=20, group_by='lineno'):
+    """
+    Các vị trí cấp phát nhiều nhất theo tracemalloc; None nếu chưa bật tracing.
+    Chỉ thấy bộ nhớ cấp phát qua allocator của Python (NumPy có, phần lớn
+    bộ nhớ của OpenCV / torch thì không — xem RSS theo stage cho phần đó).
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    stats = snapshot.statistics(group_by)
+    return {
+        'traced_bytes': current,
+        'traced_peak_bytes': peak,
+        'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+        'top': [
+            {
+                'location': str(stat.traceback[0]) if group_by != 'traceback' else stat.traceback.format(),
+                'size_bytes': stat.size,
+                'count': stat.count,
+            }
+            for stat in stats[:limit]
+        ],
+    }
+
+
+def memory_debug_allowed(headers):
+    """Request được dùng /debug/memory không: đã cấu hình token và header mang đúng token"""
+    if not MEMORY_DEBUG_TOKEN:
+        return False
+    return hmac.compare_digest(headers.get(MEMORY_DEBUG_HEADER, '').strip(), MEMORY_DEBUG_TOKEN)
+
+
+def memory_report(limit=20, group_by='lineno'):
+    """Báo cáo cho /debug/memory"""
+    return {
+        'governor': get_memory_governor().snapshot(),
+        'stages': stage_memory_snapshot(),
+        'tracemalloc': top_allocators(limit, group_by),
+        'gc_counts': gc.get_count(),
+    }
+
+
+def memory_gauges():
+    """Gauge cho /metrics"""
+    snapshot = get_memory_governor().snapshot()
+    gauges = [
+        ('process_resident_memory_bytes', 'RSS hiện tại của process', {}, snapshot['rss_bytes']),
+        ('memory_guard_peak_rss_bytes', 'RSS lớn nhất governor từng thấy', {}, snapshot['peak_rss_bytes']),
+        ('memory_guard_limit_bytes', 'Ngưỡng bộ nhớ của governor (0 = không giới hạn)', {}, snapshot['limit_bytes']),
+        ('memory_guard_sheets_in_flight', 'Số bài đang xử lý', {}, snapshot['in_flight']),
+        ('memory_guard_throttled_total', 'Số lần một bài phải chờ vì bộ nhớ', {},
+         snapshot['metrics']['throttled_total']),
+    ]
+    for stats in stage_memory_snapshot():
+        gauges.append(('grading_stage_rss_delta_max_bytes', 'Mức tăng RSS lớn nhất trong một stage',
+                       {'stage': stats['stage'], 'engine': stats['engine']}, stats['rss_delta_max_bytes']))
+    return gauges
+
+
+def install_memory_guard(registry):
+    """Gọi khi startup: hook lấy mẫu theo stage, gauge, tracemalloc (nếu bật)"""
+    if MEMORY_STAGE_SAMPLING:
+        add_stage_hook(stage_memory_hook)
+    if MEMORY_TRACEMALLOC:
+        start_tracing()
+    registry.add_gauge_provider(memory_gauges)
+    get_memory_governor()
@@ -0,0 +1,206 @@
+"""
+Đo thời gian từng stage của pipeline chấm và xuất dạng Prometheus
+
+stage_timer() bọc một stage (decode, deskew, OCR từng trường, YOLO, hậu xử lý,
+validate, chấm điểm, ghi đĩa...): ghi vào histogram độ trễ, số lần chạy và số
+lỗi theo (stage, engine). Nếu thread hiện tại đang ở trong sheet_timings(),
+thời gian của stage cũng được cộng vào bảng phân rã của bài đó để gắn vào kết
+quả. GET /metrics trả text format của Prometheus.
+"""
+
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+
+logger = logging.getLogger(__name__)
+
+# Biên các bucket histogram (giây)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    __slots__ = ('bucket_counts', 'count', 'sum', 'errors')
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+
+class MetricsRegistry:
+    """Histogram độ trễ và bộ đếm lỗi theo (stage, engine)"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._gauge_providers = []
+
+    def observe(self, stage, engine, seconds, error=False):
+        key = (stage, engine or '')
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds, error)
+
+    def add_gauge_provider(self, provider):
+        """
+        Đăng ký hàm () -> list[(tên metric, help, {label: value}, giá trị)] được gọi khi render,
+        dùng cho số liệu do module khác giữ (retention, bộ nhớ...).
+        """
+        self._gauge_providers.append(provider)
+
+    def snapshot(self):
+        """Tóm tắt dạng JSON: count, lỗi, tổng và trung bình (ms) theo stage/engine"""
+        with self._lock:
+            items = [(key, h.count, h.errors, h.sum) for key, h in self._histograms.items()]
+        return [
+            {
+                'stage': stage,
+                'engine': engine,
+                'count': count,
+                'errors': errors,
+                'error_rate': round(errors / count, 4) if count else 0.0,
+                'total_ms': round(total * 1000, 2),
+                'mean_ms': round(total * 1000 / count, 2) if count else None,
+            }
+            for (stage, engine), count, errors, total in sorted(items)
+        ]
+
+    def render_prometheus(self):
+        """Text exposition format của Prometheus"""
+        with self._lock:
+            items = [(key, list(h.bucket_counts), h.count, h.sum, h.errors)
+                     for key, h in sorted(self._histograms.items())]
+
+        lines = [
+            '# HELP grading_stage_duration_seconds Thời gian chạy từng stage của pipeline chấm',
+            '# TYPE grading_stage_duration_seconds histogram',
+        ]
+        for (stage, engine), bucket_counts, count, total, _ in items:
+            labels = f'stage="{_escape(stage)}",engine="{_escape(engine)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'grading_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'grading_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'grading_stage_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'grading_stage_duration_seconds_count{{{labels}}} {count}')
+
+        lines.append('# HELP grading_stage_errors_total Số lần stage kết thúc bằng exception')
+        lines.append('# TYPE grading_stage_errors_total counter')
+        for (stage, engine), _, _, _, errors in items:
+            lines.append(f'grading_stage_errors_total{{stage="{_escape(stage)}",engine="{_escape(engine)}"}} {errors}')
+
+        declared = set()
+        for provider in self._gauge_providers:
+            try:
+                gauges = provider()
+            except Exception as e:
+                logger.warning(f"Metrics gauge provider failed: {e}")
+                continue
+            for name, help_text, labels, value in gauges:
+                if name not in declared:
+                    lines.append(f'# HELP {name} {help_text}')
+                    lines.append(f'# TYPE {name} gauge')
+                    declared.add(name)
+                label_text = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Global registry instance
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return _registry
+
+
+# Bảng phân rã theo stage của bài đang xử lý trên thread hiện tại
+_current = threading.local()
+
+
+@contextmanager
+def sheet_timings(timings=None):
+    """
+    Gom thời gian các stage chạy trên thread hiện tại vào dict {stage: ms}.
+    Lồng nhau được: bảng ngoài được khôi phục khi ra khỏi with.
+    """
+    timings = {} if timings is None else timings
+    previous = getattr(_current, 'timings', None)
+    _current.timings = timings
+    try:
+        yield timings
+    finally:
+        _current.timings = previous
+
+
+# Hook (stage, engine) -> context manager chạy quanh mỗi stage (vd. lấy mẫu bộ nhớ)
+_stage_hooks = []
+
+
+def add_stage_hook(hook):
+    """Đăng ký hook cho mọi stage_timer (không đăng ký trùng)"""
+    if hook not in _stage_hooks:
+        _stage_hooks.append(hook)
+
+
+@contextmanager
+def stage_timer(stage, engine=''):
+    """Đo một stage; exception vẫn được raise lại sau khi ghi nhận lỗi"""
+    if _stage_hooks:
+        with ExitStack() as stack:
+            for hook in _stage_hooks:
+                stack.enter_context(hook(stage, engine))
+            with _timed(stage, engine):
+                yield
+        return
+    with _timed(stage, engine):
+        yield
+
+
+@contextmanager
+def _timed(stage, engine):
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _registry.observe(stage, engine, elapsed, error)
+        timings = getattr(_current, 'timings', None)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 2)
+
+
+def timed_stage(stage, engine=''):
+    """Decorator tương đương stage_timer"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage, engine):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
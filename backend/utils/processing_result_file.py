@@ -4,6 +4,9 @@ import os
 import json
 import logging
 
+from utils.artifact_cache import get_artifact_cache, file_sha256
+from utils.log_utils import lazy
+
 logger = logging.getLogger(__name__)
 
 def process_df_key(file_path):
@@ -12,12 +15,51 @@ def process_df_key(file_path):
     """
     try:
         df = pd.read_excel(file_path)
-        logger.info(f"Processed answer key: shape={df.shape}, columns={list(df.columns)}")
+        logger.info("Processed answer key: shape=%s", df.shape)
+        logger.debug("Answer key columns: %s", lazy(lambda: list(df.columns)))
         return df
     except Exception as e:
         logger.error(f"Error processing answer key: {e}")
         return None
 
+VALID_ANSWERS = ['A', 'B', 'C', 'D']
+
+
+def normalize_exam_code(value):
+    """Chuẩn hóa mã đề từ ô Excel: 101.0 -> '101', ' 102 ' -> '102'"""
+    if pd.isna(value):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def compile_answer_key(df):
+    """
+    Biên dịch DataFrame đáp án (cột đầu là mã đề, các cột sau là đáp án từng câu)
+    thành ma trận mã đề × câu hỏi.
+
+    Returns:
+        pd.DataFrame: index là mã đề (str), cột là số câu 1..N, giá trị 'A'-'D'
+        hoặc '' cho ô trống / không hợp lệ. Mã đề trùng lấy dòng cuối cùng.
+        File rỗng hoặc chỉ có dòng tiêu đề cho DataFrame rỗng.
+    """
+    if df.empty:
+        return pd.DataFrame(index=pd.Index([], name='exam_code', dtype=object),
+                            columns=range(1, max(df.shape[1], 1)), dtype=object)
+
+    codes = df.iloc[:, 0].map(normalize_exam_code).astype(object)
+    is_code = codes.astype(str).str.fullmatch(r'\d+')
+
+    answers = df.loc[is_code.values].iloc[:, 1:]
+    answers = answers.apply(lambda col: col.astype(str).str.strip().str.upper())
+    answers = answers.where(answers.isin(VALID_ANSWERS), '')
+
+    answers.index = pd.Index(codes[is_code].values, name='exam_code')
+    answers.columns = range(1, answers.shape[1] + 1)
+    return answers[~answers.index.duplicated(keep='last')]
+
+
 def process_df_student(file):
     """
     Xử lý file danh sách sinh viên Excel theo cấu trúc đặc biệt
@@ -28,15 +70,13 @@ def process_df_student(file):
         df_student = df_student[pd.to_numeric(df_student.iloc[:, 0], errors='coerce').notnull()]
         df_student.reset_index(drop=True, inplace=True)
 
-        logger.info("=== Dữ liệu sau lọc ===")
-        logger.info(df_student.head())
+        logger.debug("=== Dữ liệu sau lọc ===\n%s", lazy(df_student.head))
 
         df_student.columns = [
             'STT', 'MSSV', 'HoDem', 'Ten', 'GioiTinh', 'NgaySinh', 'LopHoc', 'HeSo1', 'DuocDuThi', '', 'VangThi',
             'VPQuyChe', 'ThangDiem4', 'DiemChu', 'XepLoai', 'GhiChu', 'GhiChuCuoiKy'
         ]
         df_student.reset_index(drop=True, inplace=True)
-        logger.info(df_student.head())
 
         select_columns = ['STT', 'MSSV', 'HoDem', 'Ten', 'HeSo1', 'ThangDiem4']
         df_select_columns = df_student[select_columns]
@@ -67,9 +107,9 @@ def process_df_student(file):
             part.index = part.index + 1
             var_name = f"df_part{i + 1}"
             df_parts[var_name] = part
-            logger.info(f"\n=== {var_name} ({len(part)} dòng) ===")
-            logger.info(part)
+            logger.debug("=== %s (%d dòng) ===\n%s", var_name, len(part), part)
 
+        logger.info("Processed student list: %d students in %d part(s)", nums_row, num_parts)
         return {
             'student_ids': student_ids,
             'student_names': student_names,
@@ -81,5 +121,27 @@ def process_df_student(file):
         return {'error': str(e)}
 
 
+def load_answer_key_artifact(file_path, digest=None):
+    """
+    Lấy đáp án đã biên dịch (xem compile_answer_key) từ artifact cache theo
+    hash nội dung file, chỉ parse Excel khi chưa có trong cache.
+    """
+    def build():
+        df = process_df_key(file_path)
+        return compile_answer_key(df) if df is not None else None
+
+    digest = digest or file_sha256(file_path)
+    return get_artifact_cache().get_or_build('compiled_key', digest, build)
+
+
+def load_student_artifact(file_path, digest=None):
+    """
+    Lấy kết quả process_df_student từ artifact cache (theo hash nội dung file),
+    chỉ parse Excel khi chưa có trong cache.
+    """
+    digest = digest or file_sha256(file_path)
+    return get_artifact_cache().get_or_build('roster', digest, lambda: process_df_student(file_path))
+
+
 # file = '../uploads/student/20250425114931_MauGhiDiem.xlsx'
 # print(process_df_student(file))
@@ -19,38 +19,72 @@ except ImportError:
     Qwen2VLForConditionalGeneration = None
     AutoProcessor = None
 
-# Import qwen_vl_utils with fallback
-try:
-    from qwen_vl_utils import process_vision_info
-except ImportError:
-    try:
-        import sys
-        sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-        from qwen_vl_utils import process_vision_info
-    except ImportError:
-        def process_vision_info(messages):
-            """Fallback implementation"""
-            image_inputs = []
-            video_inputs = []
-            
-            for message in messages:
-                if "content" in message:
-                    for content_item in message["content"]:
-                        if content_item.get("type") == "image":
-                            image_path = content_item.get("image")
-                            if image_path and os.path.exists(image_path):
-                                try:
-                                    image = Image.open(image_path).convert('RGB')
-                                    image_inputs.append(image)
-                                except Exception as e:
-                                    logging.warning(f"Failed to load image {image_path}: {e}")
-            
-            return image_inputs, video_inputs
-
 from fuzzywuzzy import process
 
 logger = logging.getLogger(__name__)
 
+# Mỗi visual token của Qwen2.5-VL ứng với một ô 28x28 pixel (patch 14 + merge 2x2)
+IMAGE_FACTOR = 28
+
+# Chính sách độ phân giải và sinh text theo từng trường.
+# min_pixels / max_pixels giới hạn số visual token; max_new_tokens và stop_strings
+# cắt ngắn phần sinh vì kết quả mong đợi chỉ là một dòng ngắn.
+FIELD_POLICIES = {
+    'name': {
+        'min_pixels': 64 * IMAGE_FACTOR * IMAGE_FACTOR,
+        'max_pixels': 384 * IMAGE_FACTOR * IMAGE_FACTOR,
+        'max_new_tokens': 24,
+        'stop_strings': ['\n'],
+    },
+    'id': {
+        'min_pixels': 32 * IMAGE_FACTOR * IMAGE_FACTOR,
+        'max_pixels': 192 * IMAGE_FACTOR * IMAGE_FACTOR,
+        'max_new_tokens': 16,
+        'stop_strings': ['\n'],
+    },
+    'default': {
+        'min_pixels': 64 * IMAGE_FACTOR * IMAGE_FACTOR,
+        'max_pixels': 1024 * IMAGE_FACTOR * IMAGE_FACTOR,
+        'max_new_tokens': 128,
+        'stop_strings': [],
+    },
+}
+
+
+def resize_for_policy(image: Image.Image, min_pixels: int, max_pixels: int) -> Image.Image:
+    """
+    Resize giữ tỉ lệ sao cho diện tích nằm trong [min_pixels, max_pixels] và
+    mỗi cạnh là bội số của IMAGE_FACTOR, để processor không phải resize lại.
+    """
+    width, height = image.size
+    area = width * height
+    scale = 1.0
+    if area > max_pixels:
+        scale = (max_pixels / area) ** 0.5
+    elif area < min_pixels:
+        scale = (min_pixels / area) ** 0.5
+
+    new_width = max(IMAGE_FACTOR, int(width * scale) // IMAGE_FACTOR * IMAGE_FACTOR)
+    new_height = max(IMAGE_FACTOR, int(height * scale) // IMAGE_FACTOR * IMAGE_FACTOR)
+    if (new_width, new_height) == (width, height):
+        return image
+    return image.resize((new_width, new_height), Image.BICUBIC)
+
+
+def _truncate_at_stop(text: str, stop_strings: List[str]) -> str:
+    """Cắt kết quả tại stop string đầu tiên (sau khi bỏ khoảng trắng đầu chuỗi)"""
+    text = text.strip()
+    for stop in stop_strings:
+        if stop in text:
+            text = text.split(stop, 1)[0]
+    return text
+
+def _is_stop_strings_error(error: Exception) -> bool:
+    """Lỗi của generate do transformers không nhận tham số stop_strings / tokenizer"""
+    message = str(error)
+    return 'stop_strings' in message or 'tokenizer' in message
+
+
 class QwenDetector:
     """Qwen2.5-VL-3B-Instruct model wrapper for text detection"""
     
@@ -58,6 +92,9 @@ class QwenDetector:
         self.model = None
         self.processor = None
         self.device = "cpu"  # Force CPU to avoid accelerate requirement
+        # transformers cũ không nhận stop_strings (TypeError / ValueError "model_kwargs are not used");
+        # phát hiện ở lần generate đầu tiên rồi không truyền nữa
+        self.stop_strings_supported = True
         self._load_model()
     
     def _load_model(self):
@@ -133,8 +170,26 @@ class QwenDetector:
         """Check if model is loaded and available"""
         return self.model is not None and self.processor is not None
     
-    def extract_text_from_image(self, image_path: str, prompt: str) -> Optional[str]:
-        """Extract text from image using Qwen model"""
+    def _generate(self, inputs, generate_kwargs):
+        """model.generate; nếu transformers không hỗ trợ stop_strings thì bỏ và chạy lại"""
+        try:
+            return self.model.generate(**inputs, **generate_kwargs)
+        except (TypeError, ValueError) as e:
+            # Chỉ fallback khi lỗi đúng là do stop_strings / tokenizer; lỗi khác (input, processor) raise lại
+            if 'stop_strings' not in generate_kwargs or not _is_stop_strings_error(e):
+                raise
+            logger.warning(f"stop_strings not supported by this transformers version, disabling: {e}")
+            self.stop_strings_supported = False
+            generate_kwargs = {k: v for k, v in generate_kwargs.items() if k not in ('stop_strings', 'tokenizer')}
+            return self.model.generate(**inputs, **generate_kwargs)
+    
+    def extract_text_from_image(self, image_path: str, prompt: str, field: str = 'default') -> Optional[str]:
+        """
+        Extract text from image using Qwen model
+
+        Ảnh được đọc một lần và resize theo FIELD_POLICIES[field] trước khi đưa
+        vào processor, nên số visual token và số token sinh ra bị giới hạn theo trường.
+        """
         if not self.is_available():
             logger.warning("❌ Qwen model not available")
             return None
@@ -143,18 +198,20 @@ class QwenDetector:
             logger.warning(f"❌ Image file not found: {image_path}")
             return None
         
+        policy = FIELD_POLICIES.get(field, FIELD_POLICIES['default'])
+        
         try:
-            logger.info(f"🔍 Processing image: {os.path.basename(image_path)}")
+            logger.info(f"🔍 Processing image: {os.path.basename(image_path)} (field={field})")
+            
+            image = Image.open(image_path).convert('RGB')
+            image = resize_for_policy(image, policy['min_pixels'], policy['max_pixels'])
             
             # Prepare messages
             messages = [
                 {
                     "role": "user",
                     "content": [
-                        {
-                            "type": "image",
-                            "image": image_path,
-                        },
+                        {"type": "image"},
                         {"type": "text", "text": prompt},
                     ],
                 }
@@ -165,11 +222,9 @@ class QwenDetector:
                 messages, tokenize=False, add_generation_prompt=True
             )
             
-            image_inputs, video_inputs = process_vision_info(messages)
             inputs = self.processor(
                 text=[text],
-                images=image_inputs,
-                videos=video_inputs,
+                images=[image],
                 padding=True,
                 return_tensors="pt",
             )
@@ -177,15 +232,18 @@ class QwenDetector:
             # Ensure everything is on CPU
             inputs = inputs.to("cpu")
             
+            generate_kwargs = {
+                'max_new_tokens': policy['max_new_tokens'],
+                'do_sample': False,
+            }
+            if policy['stop_strings'] and self.stop_strings_supported:
+                generate_kwargs['stop_strings'] = policy['stop_strings']
+                generate_kwargs['tokenizer'] = self.processor.tokenizer
+            
             # Inference with error handling
-            with torch.no_grad():
+            with torch.inference_mode():
                 try:
-                    generated_ids = self.model.generate(
-                        **inputs, 
-                        max_new_tokens=128,
-                        do_sample=False,
-                        temperature=0.1
-                    )
+                    generated_ids = self._generate(inputs, generate_kwargs)
                 except Exception as e:
                     logger.error(f"Generation failed: {e}")
                     return None
@@ -201,7 +259,7 @@ class QwenDetector:
             )
             
             if output_text and len(output_text) > 0:
-                result = output_text[0].strip()
+                result = _truncate_at_stop(output_text[0], policy['stop_strings'])
                 logger.info(f"✅ Qwen extracted: '{result}'")
                 return result
             else:
@@ -261,7 +319,7 @@ Example output: NGUYEN VAN AN
 Do not include any explanation or additional text."""
         
         # Extract text using Qwen
-        extracted_text = detector.extract_text_from_image(image_path, name_prompt)
+        extracted_text = detector.extract_text_from_image(image_path, name_prompt, field='name')
         
         if not extracted_text:
             logger.warning(f"⚠️ No text extracted from {image_path}")
@@ -322,7 +380,7 @@ Examples: 20181234 or KHMT2101395
 Do not include any additional text."""
         
         # Extract text using Qwen
-        extracted_text = detector.extract_text_from_image(image_path, id_prompt)
+        extracted_text = detector.extract_text_from_image(image_path, id_prompt, field='id')
         
         if not extracted_text:
             logger.warning(f"⚠️ No text extracted from {image_path}")
@@ -0,0 +1,277 @@
+"""
+Profile theo yêu cầu cho từng request (sampling profiler)
+
+Gửi header `X-Profile: 1` hoặc query `?profile=1` để profile một request. Một
+thread lấy mẫu stack của mọi thread Python (event loop, grading executor, thread
+pool của Starlette) qua sys._current_frames() mỗi PROFILE_SAMPLE_INTERVAL_MS,
+trong suốt thời gian request chạy. Kết quả được lưu vào uploads/profiles/ dưới
+hai dạng: <id>.speedscope.json (mở bằng https://www.speedscope.app) và
+<id>.collapsed.txt (collapsed stacks cho flamegraph.pl / inferno). ID trả về
+trong header X-Profile-Id.
+
+Mẫu được lấy trên mọi thread nên nếu có request khác chạy cùng lúc, stack của
+chúng cũng xuất hiện (tách theo tên thread). Khi không bật, middleware chỉ kiểm
+tra header / query string rồi chuyển thẳng request đi.
+
+Mặc định chỉ bật khi đã đặt PROFILE_TOKEN: khi đó header X-Profile (cả khi gọi
+/api/profiles) phải mang đúng token. PROFILING_ENABLED=1 không kèm token cho
+phép mọi client profile và đọc profile, chỉ nên dùng khi chạy local.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = os.path.join('uploads', 'profiles')
+# Nếu đặt, header X-Profile phải mang đúng token này (query ?profile= bị bỏ qua)
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+# Mặc định tắt nếu không có token: profile lộ stack / đường dẫn và tốn CPU
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '1' if PROFILE_TOKEN else '0') == '1'
+if PROFILING_ENABLED and not PROFILE_TOKEN:
+    logger.warning("Request profiling is enabled without PROFILE_TOKEN; any client can profile requests")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5)) / 1000
+# Giới hạn thời gian lấy mẫu của một profile (giữ bộ nhớ có giới hạn)
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 600))
+
+PROFILE_HEADER = b'x-profile'
+PROFILE_ID_HEADER = b'x-profile-id'
+PROFILE_FORMATS = {
+    'speedscope': ('.speedscope.json', 'application/json'),
+    'collapsed': ('.collapsed.txt', 'text/plain; charset=utf-8'),
+}
+
+_PROFILE_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{6}_[0-9a-f]{8}$')
+
+# Frame lá của thread đang rảnh (chờ việc / chờ I/O) — không tính vào profile
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+}
+
+
+_STDLIB_DIR = sysconfig.get_paths()['stdlib'] + os.sep
+
+
+def _short_filename(filename):
+    """Rút gọn đường dẫn: bỏ phần trước site-packages / thư viện chuẩn / thư mục hiện tại"""
+    marker = 'site-packages' + os.sep
+    index = filename.find(marker)
+    if index >= 0:
+        return filename[index + len(marker):]
+    if filename.startswith(_STDLIB_DIR):
+        return filename[len(_STDLIB_DIR):]
+    cwd = os.getcwd() + os.sep
+    return filename[len(cwd):] if filename.startswith(cwd) else filename
+
+
+class SamplingProfiler:
+    """Lấy mẫu stack của mọi thread trong một thread nền cho tới khi stop()"""
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL, max_seconds=PROFILE_MAX_SECONDS):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.frames = []
+        self.samples = {}
+        self.started_at = None
+        self.duration = 0.0
+        self._frame_index = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.time() - self.started_at
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval):
+            if time.monotonic() > deadline:
+                logger.warning(f"Profile stopped after {self.max_seconds}s")
+                break
+            self._sample(own)
+
+    def _frame_id(self, code):
+        index = self._frame_index.get(code)
+        if index is None:
+            index = self._frame_index[code] = len(self.frames)
+            self.frames.append({
+                'name': code.co_name,
+                'file': _short_filename(code.co_filename),
+                'line': code.co_firstlineno,
+            })
+        return index
+
+    def _sample(self, own):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.setdefault(names.get(ident, str(ident)), []).append(stack)
+
+    def sample_count(self):
+        return sum(len(stacks) for stacks in self.samples.values())
+
+    def to_speedscope(self, name):
+        """File format 'sampled' của speedscope, mỗi thread một profile"""
+        end = round(self.duration, 6)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'exam-grading request profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': [
+                {
+                    'type': 'sampled',
+                    'name': thread_name,
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': end,
+                    'samples': stacks,
+                    'weights': [self.interval] * len(stacks),
+                }
+                for thread_name, stacks in sorted(self.samples.items(), key=lambda item: -len(item[1]))
+            ],
+        }
+
+    def to_collapsed(self):
+        """Collapsed stacks: 'thread;frame;frame... số_mẫu' mỗi dòng"""
+        labels = [f"{frame['name']} ({frame['file']}:{frame['line']})" for frame in self.frames]
+        counts = {}
+        for thread_name, stacks in self.samples.items():
+            for stack in stacks:
+                key = ';'.join([thread_name.replace(';', '_')] + [labels[i] for i in stack])
+                counts[key] = counts.get(key, 0) + 1
+        return ''.join(f"{key} {count}\n" for key, count in sorted(counts.items()))
+
+
+def new_profile_id():
+    return f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+
+def profile_path(profile_id, fmt='speedscope'):
+    """Đường dẫn file profile; None nếu ID / định dạng không hợp lệ"""
+    if fmt not in PROFILE_FORMATS or not _PROFILE_ID_RE.match(profile_id or ''):
+        return None
+    return os.path.join(PROFILES_DIR, profile_id + PROFILE_FORMATS[fmt][0])
+
+
+def save_profile(profiler, profile_id, name):
+    """Ghi profile ra hai định dạng (ghi tạm rồi os.replace)"""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    outputs = (
+        ('speedscope', json.dumps(profiler.to_speedscope(name))),
+        ('collapsed', profiler.to_collapsed()),
+    )
+    for fmt, content in outputs:
+        path = profile_path(profile_id, fmt)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    logger.info(f"Saved profile {profile_id} ({name}): {profiler.sample_count()} samples "
+                f"in {profiler.duration:.2f}s")
+
+
+def list_profiles():
+    """Các profile đã lưu, mới nhất trước"""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    suffix = PROFILE_FORMATS['speedscope'][0]
+    profiles = []
+    for entry in os.scandir(PROFILES_DIR):
+        if entry.name.endswith(suffix):
+            stat = entry.stat()
+            profiles.append({
+                'id': entry.name[:-len(suffix)],
+                'size': stat.st_size,
+                'created_at': stat.st_mtime,
+            })
+    return sorted(profiles, key=lambda p: p['created_at'], reverse=True)
+
+
+def profiling_requested(scope):
+    """Request có yêu cầu profile không (header X-Profile hoặc ?profile=1)"""
+    for name, value in scope['headers']:
+        if name == PROFILE_HEADER:
+            value = value.decode('latin-1').strip()
+            if PROFILE_TOKEN:
+                return value == PROFILE_TOKEN
+            return value not in ('', '0', 'false')
+    query = scope.get('query_string', b'')
+    if PROFILE_TOKEN or b'profile=' not in query:
+        return False
+    values = parse_qs(query.decode('latin-1')).get('profile', [])
+    return bool(values) and values[-1] not in ('', '0', 'false')
+
+
+def profiles_access_allowed(headers):
+    """Được xem profile đã lưu không: profiling bật và (nếu có token) header X-Profile đúng token"""
+    if not PROFILING_ENABLED:
+        return False
+    return not PROFILE_TOKEN or headers.get('x-profile', '').strip() == PROFILE_TOKEN
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: profile request khi được yêu cầu. Dạng ASGI thuần (không
+    qua BaseHTTPMiddleware) để request bình thường chỉ tốn một lần kiểm tra header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILING_ENABLED or scope['type'] != 'http' or not profiling_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = new_profile_id()
+        name = f"{scope['method']} {scope['path']}"
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((PROFILE_ID_HEADER, profile_id.encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        profiler = SamplingProfiler().start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            try:
+                await run_in_threadpool(save_profile, profiler, profile_id, name)
+            except Exception as e:
+                logger.error(f"Could not save profile {profile_id}: {e}")
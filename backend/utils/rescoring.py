@@ -0,0 +1,340 @@
+"""
+Chấm lại từ kết quả đã lưu, không chạy lại OCR/YOLO
+
+- edit_sheet: áp dụng sửa đổi của giáo viên cho một bài, chấm lại riêng bài đó
+  theo đáp án đã biên dịch và cập nhật tổng hợp phòng thi theo delta.
+- rescore_exam: chấm lại mọi bài của một đề theo phiên bản đáp án mới trong một
+  lượt numpy và ghi thành score set có version.
+- rerun_sheet_stage: chạy lại một detector cho một bài (có thể với vùng cắt do
+  giáo viên chỉnh) trên ảnh đã xoay thẳng được cache, rồi gộp kết quả. Artifact
+  của lần chạy lại được ghi vào thư mục mới của riêng bài đó (sheet<id>_...) và
+  đường dẫn được lưu vào dòng kết quả; thư mục của lần chấm gốc không bị sửa.
+"""
+
+import logging
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from utils.artifact_cache import file_sha256
+from utils.grading import score_answers, score_answer_matrix
+from utils.grading_pipeline import (
+    GradingInputError, STAGE_CROPS, DESKEWED_IMAGE, load_key_context, load_roster_context, normalize_path, run_stage
+)
+from utils.job_workspace import JobWorkspace, rerun_sheet_key, sheet_dir_for
+from utils.processing_result_file import VALID_ANSWERS, normalize_exam_code
+from utils.results_store import get_results_store
+from utils.student_validation import validate_and_correct_student_info
+
+logger = logging.getLogger(__name__)
+
+# Trạng thái khi giáo viên đã sửa tay thông tin sinh viên
+MANUAL_EDIT_STATUS = 'manual_edit'
+RESOLVED_STATUSES = ('exact_match', MANUAL_EDIT_STATUS)
+IDENTITY_STAGES = ('name', 'id', 'index')
+
+
+class EditError(Exception):
+    """Nội dung sửa không hợp lệ"""
+
+
+def _apply_answer_changes(answers, value, num_questions):
+    """
+    answers mới từ payload: list đầy đủ, hoặc dict {số câu (1-based): đáp án}.
+    """
+    if isinstance(value, list):
+        new_answers = [str(answer or '').strip().upper() for answer in value]
+        if len(new_answers) != num_questions:
+            raise EditError(f"Cần đủ {num_questions} câu trả lời")
+    elif isinstance(value, dict):
+        new_answers = list(answers) + [''] * (num_questions - len(answers))
+        for question, answer in value.items():
+            try:
+                index = int(question) - 1
+            except (TypeError, ValueError):
+                raise EditError(f"Số câu không hợp lệ: {question}")
+            if not 0 <= index < num_questions:
+                raise EditError(f"Số câu không hợp lệ: {question}")
+            new_answers[index] = str(answer or '').strip().upper()
+    else:
+        raise EditError("answers phải là list hoặc dict {câu: đáp án}")
+
+    invalid = [answer for answer in new_answers if answer and answer not in VALID_ANSWERS]
+    if invalid:
+        raise EditError(f"Đáp án không hợp lệ: {', '.join(sorted(set(invalid)))}")
+    return new_answers
+
+
+def _derived_fields(sheet, df_key):
+    """Điểm và has_issue tính từ các trường của bài"""
+    return {
+        'score': score_answers(sheet['answers'], df_key, sheet['testVariant']),
+        'has_issue': (
+            sheet['testVariant'] not in df_key.index or
+            not sheet['name'] or
+            not sheet['id'] or
+            not sheet['index_student'] or sheet['index_student'] == 'N/A' or
+            sheet['correction_status'] not in RESOLVED_STATUSES
+        ),
+    }
+
+
+def _edit_delta(sheet_id, before, after, room_stats):
+    changed_fields = [field for field in ('answers', 'testVariant', 'id', 'name', 'index_student')
+                      if before[field] != after[field]]
+    changed_questions = [
+        index + 1 for index, (old, new) in enumerate(zip(before['answers'], after['answers'])) if old != new
+    ]
+    logger.info(f"Updated sheet {sheet_id}: {changed_fields}, score {before['score']} -> {after['score']}")
+    return {
+        'sheet_id': sheet_id,
+        'changed_fields': changed_fields,
+        'changed_questions': changed_questions,
+        'score_before': before['score'],
+        'score_after': after['score'],
+        'score_delta': (after['score'] or 0) - (before['score'] or 0),
+        'has_issue': bool(after['has_issue']),
+        'result': after,
+        'room_stats': room_stats,
+    }
+
+
+def _load_job_key(store, sheet):
+    job = store.get_job(sheet['job_id'])
+    if not job or not job['answer_key_filename']:
+        raise GradingInputError('Lần chấm không có file đáp án.')
+    # Đáp án đã biên dịch lấy từ artifact cache, không đọc lại Excel
+    return job, load_key_context(job['answer_key_filename'])['df_key']
+
+
+def edit_sheet(sheet_id, payload):
+    """
+    Sửa một bài đã lưu và chấm lại riêng bài đó.
+
+    Args:
+        sheet_id (int): ID bài trong results store.
+        payload (dict): Các trường cần sửa: 'answers', 'testVariant', 'id', 'name', 'index_student'.
+
+    Returns:
+        dict | None: Delta của lần sửa (điểm trước/sau, trường đã đổi, tổng hợp phòng thi),
+        None nếu không có bài.
+
+    Raises:
+        EditError: Nội dung sửa không hợp lệ.
+        GradingInputError: Không đọc được đáp án của lần chấm.
+    """
+    allowed = {'answers', 'testVariant', 'id', 'name', 'index_student'}
+    unknown = set(payload) - allowed
+    if unknown:
+        raise EditError(f"Không sửa được trường: {', '.join(sorted(unknown))}")
+    if not payload:
+        raise EditError("Không có trường nào cần sửa")
+
+    store = get_results_store()
+    sheet = store.get_sheet(sheet_id)
+    if sheet is None:
+        return None
+    _, df_key = _load_job_key(store, sheet)
+
+    def mutate(current):
+        num_questions = current['num_questions'] or len(df_key.columns)
+        changes = {}
+        if 'answers' in payload:
+            changes['answers'] = _apply_answer_changes(current['answers'], payload['answers'], num_questions)
+        if 'testVariant' in payload:
+            changes['testVariant'] = normalize_exam_code(payload['testVariant'])
+        for field in ('id', 'name', 'index_student'):
+            if field in payload:
+                changes[field] = str(payload[field]).strip() if payload[field] is not None else None
+        if {'id', 'name', 'index_student'} & set(payload):
+            changes['correction_status'] = MANUAL_EDIT_STATUS
+            changes['correction_reason'] = 'Giáo viên sửa thông tin sinh viên'
+
+        changes.update(_derived_fields(dict(current, **changes), df_key))
+        return changes
+
+    outcome = store.update_sheet(sheet_id, mutate)
+    if outcome is None:
+        return None
+    return _edit_delta(sheet_id, *outcome)
+
+
+def _parse_rect(rect, image_shape):
+    """{'x', 'y', 'w', 'h'} -> (x, y, w, h) đã cắt theo kích thước ảnh"""
+    try:
+        x, y, w, h = (int(round(float(rect[k]))) for k in ('x', 'y', 'w', 'h'))
+    except (KeyError, TypeError, ValueError):
+        raise EditError("rect cần các trường số x, y, w, h")
+    height, width = image_shape[:2]
+    x, y = max(x, 0), max(y, 0)
+    w, h = min(w, width - x), min(h, height - y)
+    if w <= 0 or h <= 0:
+        raise EditError("rect nằm ngoài ảnh")
+    return x, y, w, h
+
+
+def rerun_sheet_stage(sheet_id, stage, rect=None):
+    """
+    Chạy lại một stage cho một bài đã lưu, trên ảnh đã xoay thẳng được cache.
+
+    Args:
+        sheet_id (int): ID bài trong results store.
+        stage (str): 'code_box' | 'name' | 'id' | 'index' | 'grading'.
+        rect (dict): Vùng cắt mới {'x', 'y', 'w', 'h'} trên ảnh đã xoay thẳng;
+            None thì dùng lại vùng cắt cũ.
+
+    Returns:
+        dict | None: Delta như edit_sheet kèm kết quả thô của stage, None nếu không có bài.
+
+    Raises:
+        EditError: Stage / rect không hợp lệ hoặc thiếu ảnh cache.
+        GradingInputError: Không đọc được đáp án / danh sách sinh viên của lần chấm.
+    """
+    if stage not in STAGE_CROPS:
+        raise EditError(f"Stage không hỗ trợ: {stage}")
+
+    store = get_results_store()
+    sheet = store.get_sheet(sheet_id)
+    if sheet is None:
+        return None
+    job, df_key = _load_job_key(store, sheet)
+    roster = None
+    if stage in IDENTITY_STAGES:
+        if not job['student_list_filename']:
+            raise GradingInputError('Lần chấm không có danh sách sinh viên.')
+        roster = load_roster_context(job['student_list_filename'], job['room'])
+
+    if not sheet['imageName']:
+        raise EditError('Bài này không có thư mục vùng cắt')
+    sheet_dir = sheet_dir_for(sheet['imageName'])
+    if not os.path.isdir(sheet_dir):
+        raise EditError('Thư mục vùng cắt của bài này đã bị dọn; cần chấm lại ảnh')
+    crop_name = STAGE_CROPS[stage]
+    # Thư mục chung (theo ảnh) không bị ghi đè: lần chạy lại có thư mục riêng của bài
+    rerun_key = rerun_sheet_key(sheet_id)
+    with JobWorkspace(prefix='stage_') as workspace:
+        # Bắt đầu từ bản sao đủ các artifact hiện tại, stage chạy lại ghi đè phần của nó
+        for name in os.listdir(sheet_dir):
+            src = os.path.join(sheet_dir, name)
+            if os.path.isfile(src):
+                shutil.copyfile(src, os.path.join(workspace.path, name))
+
+        crop_path = os.path.join(workspace.path, crop_name)
+        if rect is not None:
+            deskewed = cv2.imread(os.path.join(workspace.path, DESKEWED_IMAGE))
+            if deskewed is None:
+                raise EditError('Bài này không có ảnh đã xoay thẳng trong cache; cần chấm lại ảnh')
+            x, y, w, h = _parse_rect(rect, deskewed.shape)
+            cv2.imwrite(crop_path, deskewed[y:y + h, x:x + w])
+        elif not os.path.exists(crop_path):
+            raise EditError(f'Không có vùng cắt {crop_name} trong cache')
+
+        detection = run_stage(stage, crop_path, roster)
+        workspace.publish(sheet_dir_for(rerun_key))
+
+    if stage == 'grading':
+        processed_name = os.path.basename(detection['processed_image_path'])
+    else:
+        processed_name = os.path.basename(sheet['processedGradingImage'] or '')
+
+    def mutate(current):
+        # Dòng kết quả trỏ sang thư mục của lần chạy lại này
+        changes = {'imageName': rerun_key}
+        if processed_name:
+            changes['processedGradingImage'] = normalize_path(f"temp/{rerun_key}/{processed_name}")
+        raw = dict(current['raw_detection'])
+        if stage == 'code_box':
+            changes['testVariant'] = detection['exam_code']
+        elif stage == 'grading':
+            num_questions = current['num_questions'] or len(df_key.columns)
+            changes['answers'] = [detection['student_result'].get(i, '') for i in range(1, num_questions + 1)]
+        else:
+            if stage == 'name':
+                raw['name'] = detection['raw_name']
+            elif stage == 'id':
+                raw['mssv'] = detection['raw_id']
+            else:
+                raw['stt'] = detection['raw_index'][0] if detection['raw_index'] else None
+            validation = validate_and_correct_student_info(
+                detected_name=raw.get('name'),
+                detected_mssv=raw.get('mssv'),
+                detected_stt=raw.get('stt'),
+                df_students=roster['df_part']
+            )
+            changes.update({
+                'raw_detection': raw,
+                'name': validation['name'],
+                'id': validation['mssv'],
+                'index_student': validation['stt'] or 'N/A',
+                'correction_status': validation['status'],
+                'correction_reason': validation['correction_reason'],
+            })
+        changes.update(_derived_fields(dict(current, **changes), df_key))
+        return changes
+
+    outcome = store.update_sheet(sheet_id, mutate)
+    if outcome is None:
+        return None
+    delta = _edit_delta(sheet_id, *outcome)
+    delta['stage'] = stage
+    delta['detection'] = {k: v for k, v in detection.items() if k != 'processed_image_path'}
+    return delta
+
+
+def rescore_exam(exam, answer_key_filename):
+    """
+    Chấm lại toàn bộ bài đã lưu của một đề theo file đáp án (đã upload) mới.
+
+    Returns:
+        dict | None: Thông tin score set mới và thay đổi điểm, None nếu đề chưa có bài nào.
+
+    Raises:
+        GradingInputError: Không đọc được file đáp án.
+    """
+    started = time.perf_counter()
+    key = load_key_context(answer_key_filename)
+    df_key, num_questions = key['df_key'], key['num_questions']
+
+    store = get_results_store()
+    rows = store.load_exam_answers(exam)
+    if not rows:
+        return None
+
+    old_scores = np.fromiter((row['score'] or 0 for row in rows),
+                             dtype=np.int32, count=len(rows))
+    scores, known_code = score_answer_matrix([row['choices'] for row in rows],
+                                             [row['exam_code'] for row in rows], df_key)
+    identity_ok = np.fromiter(
+        (bool(row['name']) and bool(row['mssv']) and row['stt'] not in (None, '', 'N/A')
+         and row['correction_status'] in RESOLVED_STATUSES for row in rows),
+        dtype=bool, count=len(rows)
+    )
+    has_issue = ~known_code | ~identity_ok
+    scored = time.perf_counter()
+
+    sheet_ids = [row['id'] for row in rows]
+    key_digest = file_sha256(os.path.join('uploads', 'key', answer_key_filename))
+    score_set_id = store.write_score_set(exam, answer_key_filename, key_digest, num_questions,
+                                         sheet_ids, scores.tolist(), has_issue.tolist())
+    finished = time.perf_counter()
+
+    changed = scores != old_scores
+    logger.info(f"Rescored exam {exam}: {len(rows)} sheets, {int(changed.sum())} changed "
+                f"(score {1000 * (scored - started):.1f}ms, write {1000 * (finished - scored):.1f}ms)")
+    return {
+        'exam': exam,
+        'score_set_id': score_set_id,
+        'answer_key_filename': answer_key_filename,
+        'num_questions': num_questions,
+        'sheet_count': len(rows),
+        'changed_count': int(changed.sum()),
+        'unknown_exam_code_count': int((~known_code).sum()),
+        'changes': [
+            {'sheet_id': sheet_id, 'score_before': int(old), 'score_after': int(new)}
+            for sheet_id, old, new, is_changed in zip(sheet_ids, old_scores, scores, changed) if is_changed
+        ],
+        'elapsed_ms': round(1000 * (finished - started), 2),
+    }
@@ -0,0 +1,508 @@
+"""
+Lưu kết quả chấm phía server (SQLite, WAL)
+
+Mỗi lần chấm (process_images hoặc finalize phiên ingest) tạo một job; mỗi bài là
+một dòng trong sheets, kèm nhận diện thô (detections), câu trả lời (answers) và
+lịch sử sửa (edits). Review, export và thống kê đọc từ đây nên tải lại trang
+không phải chạy lại OCR/YOLO.
+
+Câu trả lời của một bài được lưu thành chuỗi cố định độ dài, mỗi ký tự là một
+câu ('-' là bỏ trống), để chấm lại cả đề có thể đọc thẳng thành mảng numpy.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', os.path.join('uploads', 'results.db'))
+BLANK_ANSWER = '-'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    exam TEXT NOT NULL,
+    room TEXT,
+    answer_key_filename TEXT,
+    student_list_filename TEXT,
+    num_questions INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sheets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    exam TEXT NOT NULL,
+    room TEXT,
+    image_filename TEXT NOT NULL,
+    image_name TEXT,
+    processed_image TEXT,
+    mssv TEXT,
+    name TEXT,
+    stt TEXT,
+    exam_code TEXT,
+    score INTEGER,
+    num_questions INTEGER,
+    has_issue INTEGER NOT NULL DEFAULT 0,
+    correction_status TEXT,
+    correction_reason TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (job_id, image_filename)
+);
+CREATE INDEX IF NOT EXISTS idx_sheets_exam_room ON sheets (exam, room);
+CREATE INDEX IF NOT EXISTS idx_sheets_room ON sheets (room);
+CREATE INDEX IF NOT EXISTS idx_sheets_mssv ON sheets (mssv);
+CREATE INDEX IF NOT EXISTS idx_sheets_job ON sheets (job_id);
+
+CREATE TABLE IF NOT EXISTS detections (
+    sheet_id INTEGER PRIMARY KEY REFERENCES sheets(id) ON DELETE CASCADE,
+    raw_name TEXT,
+    raw_mssv TEXT,
+    raw_stt TEXT,
+    extra TEXT
+);
+
+CREATE TABLE IF NOT EXISTS answers (
+    sheet_id INTEGER PRIMARY KEY REFERENCES sheets(id) ON DELETE CASCADE,
+    choices TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS edits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet_id INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    old_value TEXT,
+    new_value TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_edits_sheet ON edits (sheet_id);
+
+-- Tổng hợp theo lô chấm của một phòng thi, cập nhật tăng dần khi lưu / sửa bài
+CREATE TABLE IF NOT EXISTS room_stats (
+    job_id TEXT PRIMARY KEY REFERENCES jobs(id) ON DELETE CASCADE,
+    exam TEXT NOT NULL,
+    room TEXT,
+    sheet_count INTEGER NOT NULL DEFAULT 0,
+    score_sum INTEGER NOT NULL DEFAULT 0,
+    issue_count INTEGER NOT NULL DEFAULT 0,
+    passed_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Mỗi lần chấm lại cả đề theo một phiên bản đáp án tạo một score set
+CREATE TABLE IF NOT EXISTS score_sets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exam TEXT NOT NULL,
+    answer_key_filename TEXT NOT NULL,
+    key_digest TEXT,
+    num_questions INTEGER NOT NULL,
+    sheet_count INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_score_sets_exam ON score_sets (exam);
+
+CREATE TABLE IF NOT EXISTS sheet_scores (
+    score_set_id INTEGER NOT NULL REFERENCES score_sets(id) ON DELETE CASCADE,
+    sheet_id INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    score INTEGER NOT NULL,
+    PRIMARY KEY (score_set_id, sheet_id)
+);
+"""
+
+# Các trường của bài thi có thể sửa qua API -> cột trong bảng sheets
+EDITABLE_FIELDS = {
+    'id': 'mssv',
+    'name': 'name',
+    'index_student': 'stt',
+    'testVariant': 'exam_code',
+}
+
+
+def encode_answers(answers):
+    """['A', '', 'C'] -> 'A-C'"""
+    return ''.join((str(answer).strip().upper()[:1] or BLANK_ANSWER) if answer else BLANK_ANSWER
+                   for answer in answers)
+
+
+def decode_answers(choices):
+    """'A-C' -> ['A', '', 'C']"""
+    return ['' if choice == BLANK_ANSWER else choice for choice in choices]
+
+
+def is_passed(score, num_questions):
+    """Đạt khi điểm thang 10 >= 5"""
+    return bool(num_questions) and score is not None and score * 10.0 / num_questions >= 5
+
+
+def _sheet_stats(sheet):
+    """Đóng góp của một bài vào room_stats: (số bài, tổng điểm, số bài có vấn đề, số bài đạt)"""
+    return (1, sheet.get('score') or 0, int(bool(sheet.get('has_issue'))),
+            int(is_passed(sheet.get('score'), sheet.get('num_questions'))))
+
+
+class ResultsStore:
+    """Kết nối SQLite riêng cho từng thread; WAL cho phép đọc song song khi đang ghi"""
+
+    def __init__(self, db_path=RESULTS_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            self._backfill_room_stats(conn)
+
+    @staticmethod
+    def _backfill_room_stats(conn):
+        """Tạo room_stats cho các job được lưu trước khi có bảng tổng hợp"""
+        conn.execute(
+            "INSERT INTO room_stats (job_id, exam, room, sheet_count, score_sum, issue_count, passed_count) "
+            "SELECT job_id, exam, room, COUNT(*), COALESCE(SUM(score), 0), SUM(has_issue), "
+            "SUM(CASE WHEN num_questions > 0 AND score * 10.0 / num_questions >= 5 THEN 1 ELSE 0 END) "
+            "FROM sheets WHERE job_id NOT IN (SELECT job_id FROM room_stats) GROUP BY job_id"
+        )
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    # ---- Ghi ----
+
+    def create_job(self, exam, room, num_questions, answer_key_filename=None, student_list_filename=None):
+        job_id = uuid.uuid4().hex
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, exam, room, answer_key_filename, student_list_filename, num_questions, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, exam, room, answer_key_filename, student_list_filename, num_questions, time.time())
+            )
+        return job_id
+
+    def save_sheets(self, job_id, exam, room, students):
+        """
+        Lưu kết quả chấm (format của /api/process_images) trong một transaction.
+
+        Returns:
+            list: sheet_id theo thứ tự students.
+        """
+        now = time.time()
+        sheet_ids = []
+        saved = {}
+        with self.connection() as conn:
+            for student in students:
+                # Cùng một ảnh được gửi hai lần trong một lô: giữ bản đầu tiên
+                if student['image'] in saved:
+                    sheet_ids.append(saved[student['image']])
+                    continue
+                raw = student.get('raw_detection') or {}
+                cursor = conn.execute(
+                    "INSERT INTO sheets (job_id, exam, room, image_filename, image_name, processed_image, "
+                    "mssv, name, stt, exam_code, score, num_questions, has_issue, correction_status, "
+                    "correction_reason, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, exam, room, student['image'], student.get('imageName'),
+                     student.get('processedGradingImage'), student.get('id'), student.get('name'),
+                     student.get('index_student'), student.get('testVariant'), student.get('score'),
+                     student.get('num_questions'), int(bool(student.get('has_issue'))),
+                     student.get('correction_status'), student.get('correction_reason'), now)
+                )
+                sheet_id = cursor.lastrowid
+                conn.execute(
+                    "INSERT INTO detections (sheet_id, raw_name, raw_mssv, raw_stt, extra) VALUES (?, ?, ?, ?, ?)",
+                    (sheet_id, raw.get('name'), raw.get('mssv'), raw.get('stt'),
+                     json.dumps({k: v for k, v in raw.items() if k not in ('name', 'mssv', 'stt')}, ensure_ascii=False))
+                )
+                conn.execute("INSERT INTO answers (sheet_id, choices) VALUES (?, ?)",
+                             (sheet_id, encode_answers(student.get('answers', []))))
+                saved[student['image']] = sheet_id
+                sheet_ids.append(sheet_id)
+                self._apply_stats_delta(conn, job_id, exam, room, _sheet_stats(student))
+        return sheet_ids
+
+    @staticmethod
+    def _apply_stats_delta(conn, job_id, exam, room, delta):
+        conn.execute(
+            "INSERT INTO room_stats (job_id, exam, room, sheet_count, score_sum, issue_count, passed_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (job_id) DO UPDATE SET "
+            "sheet_count = sheet_count + excluded.sheet_count, score_sum = score_sum + excluded.score_sum, "
+            "issue_count = issue_count + excluded.issue_count, passed_count = passed_count + excluded.passed_count",
+            (job_id, exam, room) + tuple(delta)
+        )
+
+    def update_sheet(self, sheet_id, mutate):
+        """
+        Sửa một bài trong một transaction ghi (BEGIN IMMEDIATE, nên các lần sửa
+        cùng lúc không ghi đè nhau).
+
+        Args:
+            mutate: Hàm (bài hiện tại) -> dict các giá trị mới; khóa là tên trường
+                theo format kết quả ('id', 'name', 'index_student', 'testVariant',
+                'answers', 'score', 'has_issue', 'correction_status', 'correction_reason',
+                'raw_detection', 'imageName', 'processedGradingImage').
+
+        Returns:
+            tuple | None: (bài trước khi sửa, bài sau khi sửa, room_stats), None nếu không có bài.
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(f"{self._SELECT_SHEETS} WHERE s.id = ?", (sheet_id,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            before = self._row_to_result(row)
+            changes = mutate(dict(before, answers=list(before['answers'])))
+            after = dict(before, **changes)
+
+            now = time.time()
+            columns = dict(EDITABLE_FIELDS, score='score', has_issue='has_issue',
+                           correction_status='correction_status', correction_reason='correction_reason',
+                           imageName='image_name', processedGradingImage='processed_image')
+            assignments, params = [], []
+            for field, column in columns.items():
+                if field in changes:
+                    value = int(bool(changes[field])) if field == 'has_issue' else changes[field]
+                    assignments.append(f"{column} = ?")
+                    params.append(value)
+            conn.execute(f"UPDATE sheets SET {', '.join(assignments + ['updated_at = ?'])} WHERE id = ?",
+                         params + [now, sheet_id])
+            if 'answers' in changes:
+                conn.execute("UPDATE answers SET choices = ? WHERE sheet_id = ?",
+                             (encode_answers(after['answers']), sheet_id))
+            if 'raw_detection' in changes:
+                raw = after['raw_detection']
+                conn.execute("UPDATE detections SET raw_name = ?, raw_mssv = ?, raw_stt = ? WHERE sheet_id = ?",
+                             (raw.get('name'), raw.get('mssv'), raw.get('stt'), sheet_id))
+
+            # Lịch sử sửa: chỉ các trường người dùng đổi (điểm / has_issue là giá trị suy ra)
+            for field in list(EDITABLE_FIELDS) + ['answers']:
+                if field in changes and before[field] != after[field]:
+                    old_value, new_value = before[field], after[field]
+                    if field == 'answers':
+                        old_value, new_value = encode_answers(old_value), encode_answers(new_value)
+                    conn.execute(
+                        "INSERT INTO edits (sheet_id, field, old_value, new_value, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (sheet_id, field, old_value, new_value, now)
+                    )
+
+            old_stats, new_stats = _sheet_stats(before), _sheet_stats(after)
+            delta = (0,) + tuple(new - old for new, old in zip(new_stats[1:], old_stats[1:]))
+            self._apply_stats_delta(conn, before['job_id'], before['exam'], before['room'], delta)
+            stats = self._room_stats(conn, before['job_id'])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return before, after, stats
+
+    def load_exam_answers(self, exam):
+        """Các cột cần để chấm lại cả đề: id, mã đề, điểm hiện tại, chuỗi câu trả lời và thông tin sinh viên"""
+        rows = self.connection().execute(
+            "SELECT s.id, s.job_id, s.exam_code, s.score, s.mssv, s.name, s.stt, s.correction_status, a.choices "
+            "FROM sheets s JOIN answers a ON a.sheet_id = s.id WHERE s.exam = ? ORDER BY s.id", (exam,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def write_score_set(self, exam, answer_key_filename, key_digest, num_questions, sheet_ids, scores, has_issue):
+        """
+        Ghi một score set mới và đặt nó làm điểm hiện tại của các bài, trong một transaction.
+        room_stats của các job liên quan được tính lại từ sheets.
+
+        Returns:
+            int: ID score set.
+        """
+        now = time.time()
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute(
+                "INSERT INTO score_sets (exam, answer_key_filename, key_digest, num_questions, sheet_count, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (exam, answer_key_filename, key_digest, num_questions, len(sheet_ids), now)
+            )
+            score_set_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO sheet_scores (score_set_id, sheet_id, score) VALUES (?, ?, ?)",
+                ((score_set_id, sheet_id, score) for sheet_id, score in zip(sheet_ids, scores))
+            )
+            conn.executemany(
+                "UPDATE sheets SET score = ?, has_issue = ?, num_questions = ?, updated_at = ? WHERE id = ?",
+                ((score, int(issue), num_questions, now, sheet_id)
+                 for sheet_id, score, issue in zip(sheet_ids, scores, has_issue))
+            )
+            # Các lần sửa / chấm lại sau dùng đáp án mới
+            conn.execute("UPDATE jobs SET answer_key_filename = ?, num_questions = ? WHERE exam = ?",
+                         (answer_key_filename, num_questions, exam))
+            conn.execute("DELETE FROM room_stats WHERE exam = ?", (exam,))
+            self._backfill_room_stats(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return score_set_id
+
+    def list_score_sets(self, exam):
+        rows = self.connection().execute(
+            "SELECT * FROM score_sets WHERE exam = ? ORDER BY id", (exam,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_score_set_scores(self, score_set_id):
+        """{sheet_id: số câu đúng} của một score set"""
+        rows = self.connection().execute(
+            "SELECT sheet_id, score FROM sheet_scores WHERE score_set_id = ?", (score_set_id,)
+        ).fetchall()
+        return {row['sheet_id']: row['score'] for row in rows}
+
+    @staticmethod
+    def _room_stats(conn, job_id):
+        row = conn.execute("SELECT * FROM room_stats WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        stats = dict(row)
+        stats['mean_correct'] = round(stats['score_sum'] / stats['sheet_count'], 2) if stats['sheet_count'] else None
+        return stats
+
+    def get_room_stats(self, job_id):
+        """Tổng hợp của lô chấm (số bài, tổng số câu đúng, số bài có vấn đề, số bài đạt)"""
+        return self._room_stats(self.connection(), job_id)
+
+    # ---- Đọc ----
+
+    @staticmethod
+    def _row_to_result(row):
+        """Dòng sheets ⨝ detections ⨝ answers -> dict theo format của /api/process_images"""
+        return {
+            'sheet_id': row['id'],
+            'job_id': row['job_id'],
+            'exam': row['exam'],
+            'room': row['room'],
+            'id': row['mssv'],
+            'name': row['name'],
+            'testVariant': row['exam_code'],
+            'score': row['score'],
+            'answers': decode_answers(row['choices'] or ''),
+            'image': row['image_filename'],
+            'imageName': row['image_name'],
+            'processedGradingImage': row['processed_image'],
+            'has_issue': bool(row['has_issue']),
+            'num_questions': row['num_questions'],
+            'index_student': row['stt'],
+            'correction_status': row['correction_status'],
+            'correction_reason': row['correction_reason'],
+            'raw_detection': {
+                'name': row['raw_name'],
+                'mssv': row['raw_mssv'],
+                'stt': row['raw_stt'],
+            },
+        }
+
+    _SELECT_SHEETS = (
+        "SELECT s.*, d.raw_name, d.raw_mssv, d.raw_stt, a.choices FROM sheets s "
+        "LEFT JOIN detections d ON d.sheet_id = s.id LEFT JOIN answers a ON a.sheet_id = s.id"
+    )
+
+    def get_job(self, job_id):
+        row = self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_sheet(self, sheet_id):
+        row = self.connection().execute(f"{self._SELECT_SHEETS} WHERE s.id = ?", (sheet_id,)).fetchone()
+        return self._row_to_result(row) if row else None
+
+    def list_sheets(self, exam=None, room=None, mssv=None, job_id=None):
+        """Danh sách bài theo bộ lọc (các tham số None bị bỏ qua)"""
+        clauses, params = [], []
+        for column, value in (('s.exam', exam), ('s.room', room), ('s.mssv', mssv), ('s.job_id', job_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.connection().execute(f"{self._SELECT_SHEETS}{where} ORDER BY s.id", params).fetchall()
+        return [self._row_to_result(row) for row in rows]
+
+    def referenced_artifacts(self, since):
+        """
+        Ảnh gốc / thư mục artifact mà các bài còn hiệu lực (job tạo hoặc bài sửa
+        sau thời điểm since) đang trỏ tới.
+
+        Returns:
+            list: [(image_filename, image_name, processed_image)]
+        """
+        rows = self.connection().execute(
+            "SELECT s.image_filename, s.image_name, s.processed_image FROM sheets s JOIN jobs j ON j.id = s.job_id "
+            "WHERE j.created_at >= ? OR s.updated_at >= ?", (since, since)
+        ).fetchall()
+        return [(row['image_filename'], row['image_name'], row['processed_image']) for row in rows]
+
+    def list_edits(self, sheet_id):
+        rows = self.connection().execute(
+            "SELECT field, old_value, new_value, created_at FROM edits WHERE sheet_id = ? ORDER BY id", (sheet_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def statistics(self, exam=None, room=None, job_id=None):
+        """Thống kê điểm (thang 10) theo exam / phòng / job"""
+        clauses, params = [], []
+        for column, value in (('exam', exam), ('room', room), ('job_id', job_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        row = self.connection().execute(
+            "SELECT COUNT(*) AS total, SUM(has_issue) AS issues, "
+            "AVG(CASE WHEN num_questions > 0 THEN score * 10.0 / num_questions END) AS mean_score, "
+            "MIN(CASE WHEN num_questions > 0 THEN score * 10.0 / num_questions END) AS min_score, "
+            "MAX(CASE WHEN num_questions > 0 THEN score * 10.0 / num_questions END) AS max_score, "
+            "SUM(CASE WHEN num_questions > 0 AND score * 10.0 / num_questions >= 5 THEN 1 ELSE 0 END) AS passed "
+            f"FROM sheets{where}", params
+        ).fetchone()
+        return {
+            'total_sheets': row['total'],
+            'issues': row['issues'] or 0,
+            'passed': row['passed'] or 0,
+            'mean_score': round(row['mean_score'], 2) if row['mean_score'] is not None else None,
+            'min_score': round(row['min_score'], 2) if row['min_score'] is not None else None,
+            'max_score': round(row['max_score'], 2) if row['max_score'] is not None else None,
+        }
+
+
+# Global store instance
+_store_instance = None
+_store_lock = threading.Lock()
+
+
+def get_results_store():
+    """Get singleton results store"""
+    global _store_instance
+    with _store_lock:
+        if _store_instance is None:
+            _store_instance = ResultsStore()
+    return _store_instance
+
+
+def persist_results(response, exam, room, answer_key_filename=None, student_list_filename=None):
+    """
+    Lưu response của một lô chấm và gắn job_id / sheet_id vào response.
+    Lỗi khi ghi chỉ được log, không làm hỏng kết quả chấm.
+    """
+    try:
+        store = get_results_store()
+        job_id = store.create_job(exam, room, response['num_questions'], answer_key_filename, student_list_filename)
+        sheet_ids = store.save_sheets(job_id, exam, room, response['results'])
+        for student, sheet_id in zip(response['results'], sheet_ids):
+            student['sheet_id'] = sheet_id
+        response['job_id'] = job_id
+    except Exception as e:
+        logger.error(f"Error persisting results for room {room}: {e}")
+    return response
@@ -0,0 +1,291 @@
+"""
+Quản lý vòng đời artifact trong uploads/: TTL theo loại, quota dung lượng, dọn nền
+
+Mỗi loại artifact (ảnh upload, bản làm việc, vùng cắt theo bài, file kết quả,
+cache...) có TTL riêng. Sau khi xóa theo TTL, nếu tổng dung lượng vẫn vượt
+RETENTION_QUOTA_BYTES thì xóa tiếp các mục được dùng lâu nhất (LRU theo
+max(atime, mtime)). Việc quét chạy trong thread nền định kỳ, không nằm trên
+đường xử lý request. File đáp án / danh sách sinh viên không bị dọn.
+
+Ảnh upload, bản làm việc và thư mục vùng cắt mà results store còn trỏ tới (bài
+của job trong RETENTION_RESULTS_DAYS gần nhất) không bị xóa, kể cả khi vượt
+quota: kết quả còn hiển thị thì ảnh của nó cũng còn. TTL mặc định của các loại
+này bằng TTL của kết quả.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+
+def _ttl(env_name, default_days):
+    return float(os.environ.get(env_name, default_days)) * DAY
+
+
+RESULTS_DAYS = float(os.environ.get('RETENTION_RESULTS_DAYS', 30))
+IMAGES_DIR = os.path.join('uploads', 'images')
+WORKING_DIR = os.path.join(IMAGES_DIR, 'working')
+SHEETS_DIR = os.path.join(IMAGES_DIR, 'temp')
+
+# (tên loại, thư mục, đơn vị quản lý, TTL giây, điều kiện tên)
+# - 'file': mỗi file là một mục; 'dir': mỗi thư mục con là một mục (xóa cả thư mục)
+ARTIFACT_CLASSES = [
+    ('images', IMAGES_DIR, 'file', _ttl('RETENTION_IMAGES_DAYS', RESULTS_DAYS), None),
+    ('working_images', WORKING_DIR, 'file', _ttl('RETENTION_WORKING_DAYS', RESULTS_DAYS), None),
+    ('sheet_artifacts', SHEETS_DIR, 'dir', _ttl('RETENTION_SHEETS_DAYS', RESULTS_DAYS), None),
+    ('df_parts', os.path.join('uploads', 'temp'), 'file', _ttl('RETENTION_DF_PARTS_DAYS', 1), 'df_parts_'),
+    ('archives', os.path.join('uploads', 'temp', 'archives'), 'file', _ttl('RETENTION_ARCHIVES_DAYS', 1), None),
+    ('results', os.path.join('uploads', 'results'), 'file', RESULTS_DAYS * DAY, None),
+    ('artifact_cache', os.path.join('uploads', 'cache', 'artifacts'), 'file', _ttl('RETENTION_CACHE_DAYS', 7), None),
+    ('image_variants', os.path.join('uploads', 'cache', 'variants'), 'file', _ttl('RETENTION_CACHE_DAYS', 7), None),
+    ('contact_sheets', os.path.join('uploads', 'cache', 'contact_sheets'), 'file', _ttl('RETENTION_CACHE_DAYS', 7), None),
+    ('jobs', os.path.join('uploads', 'jobs'), 'dir', _ttl('RETENTION_JOBS_DAYS', 1), None),
+    ('profiles', os.path.join('uploads', 'profiles'), 'file', _ttl('RETENTION_PROFILES_DAYS', 7), None),
+]
+
+# Tổng dung lượng tối đa của các loại artifact trên (0 = không giới hạn)
+RETENTION_QUOTA_BYTES = int(os.environ.get('RETENTION_QUOTA_BYTES', 20 * 1024 ** 3))
+RETENTION_SWEEP_INTERVAL_SECONDS = int(os.environ.get('RETENTION_SWEEP_INTERVAL_SECONDS', 15 * 60))
+# Bỏ qua file mới ghi (có thể đang được pipeline dùng)
+RETENTION_MIN_AGE_SECONDS = int(os.environ.get('RETENTION_MIN_AGE_SECONDS', 3600))
+
+
+def _dir_usage(path):
+    """(tổng byte, thời điểm dùng gần nhất) của một thư mục"""
+    total = 0
+    last_used = os.stat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += stat.st_size
+            last_used = max(last_used, stat.st_mtime, stat.st_atime)
+    return total, last_used
+
+
+def scan_class(directory, unit, prefix=None):
+    """
+    Liệt kê các mục của một loại artifact.
+
+    Returns:
+        list: [(đường dẫn, byte, thời điểm dùng gần nhất)]
+    """
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for entry in os.scandir(directory):
+        if prefix and not entry.name.startswith(prefix):
+            continue
+        try:
+            if unit == 'file' and entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                entries.append((entry.path, stat.st_size, max(stat.st_mtime, stat.st_atime)))
+            elif unit == 'dir' and entry.is_dir(follow_symlinks=False):
+                size, last_used = _dir_usage(entry.path)
+                entries.append((entry.path, size, last_used))
+        except OSError:
+            continue
+    return entries
+
+
+def results_store_references(now):
+    """
+    Đường dẫn (đã normpath) của ảnh upload, bản làm việc và thư mục vùng cắt mà
+    các bài còn hiệu lực trong results store đang dùng.
+    """
+    from utils.results_store import get_results_store
+
+    paths = set()
+    for image_filename, image_name, processed_image in get_results_store().referenced_artifacts(now - RESULTS_DAYS * DAY):
+        if image_filename:
+            paths.add(os.path.normpath(os.path.join(IMAGES_DIR, image_filename)))
+            paths.add(os.path.normpath(os.path.join(WORKING_DIR, image_filename)))
+        if image_name:
+            paths.add(os.path.normpath(os.path.join(SHEETS_DIR, image_name)))
+        if processed_image:
+            # processedGradingImage: 'temp/<thư mục>/<file>' tính từ uploads/images
+            paths.add(os.path.normpath(os.path.join(IMAGES_DIR, os.path.dirname(processed_image))))
+    return paths
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class RetentionManager:
+    """Dọn artifact theo TTL và quota, giữ số liệu byte đang giữ / đã thu hồi"""
+
+    def __init__(self, classes=ARTIFACT_CLASSES, quota_bytes=RETENTION_QUOTA_BYTES,
+                 min_age_seconds=RETENTION_MIN_AGE_SECONDS, references=results_store_references):
+        self.classes = classes
+        self.quota_bytes = quota_bytes
+        self.min_age_seconds = min_age_seconds
+        # references(now) -> tập đường dẫn không được xóa; None = không bảo vệ gì
+        self.references = references
+        self._lock = threading.Lock()
+        self.metrics = {
+            'bytes_held': {name: 0 for name, *_ in classes},
+            'files_held': {name: 0 for name, *_ in classes},
+            'bytes_reclaimed_total': {name: 0 for name, *_ in classes},
+            'items_reclaimed_total': {name: 0 for name, *_ in classes},
+            'evicted_for_quota_total': 0,
+            'kept_referenced': 0,
+            'sweeps_total': 0,
+            'sweep_errors_total': 0,
+            'last_sweep_at': None,
+            'last_sweep_seconds': None,
+            'quota_bytes': quota_bytes,
+        }
+
+    def _reclaim(self, class_name, path, size):
+        try:
+            _remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+            return False
+        self.metrics['bytes_reclaimed_total'][class_name] += size
+        self.metrics['items_reclaimed_total'][class_name] += 1
+        return True
+
+    def _referenced_paths(self, now):
+        """Tập đường dẫn được bảo vệ; None nếu không đọc được (lượt này không xóa gì)"""
+        if self.references is None:
+            return set()
+        try:
+            return self.references(now)
+        except Exception as e:
+            logger.error(f"Could not load referenced artifacts, skipping deletions this sweep: {e}")
+            return None
+
+    def sweep(self, now=None):
+        """Một lượt dọn: TTL trước, sau đó LRU cho tới khi dưới quota"""
+        with self._lock:
+            started = time.time()
+            now = now or started
+            remaining = []
+            bytes_held = {}
+            files_held = {}
+            referenced = self._referenced_paths(now)
+            kept_referenced = 0
+
+            for class_name, directory, unit, ttl, prefix in self.classes:
+                held = 0
+                count = 0
+                for path, size, last_used in scan_class(directory, unit, prefix):
+                    held += size
+                    count += 1
+                    if referenced is None:
+                        continue
+                    if os.path.normpath(path) in referenced:
+                        kept_referenced += 1
+                        continue
+                    age = now - last_used
+                    if age > ttl and age > self.min_age_seconds:
+                        if self._reclaim(class_name, path, size):
+                            held -= size
+                            count -= 1
+                            continue
+                    remaining.append((last_used, class_name, path, size))
+                bytes_held[class_name] = held
+                files_held[class_name] = count
+
+            total = sum(bytes_held.values())
+            if self.quota_bytes and total > self.quota_bytes:
+                remaining.sort()
+                for last_used, class_name, path, size in remaining:
+                    if total <= self.quota_bytes:
+                        break
+                    if now - last_used <= self.min_age_seconds:
+                        continue
+                    if self._reclaim(class_name, path, size):
+                        total -= size
+                        bytes_held[class_name] -= size
+                        files_held[class_name] -= 1
+                        self.metrics['evicted_for_quota_total'] += 1
+                if total > self.quota_bytes:
+                    logger.warning(f"Artifacts still use {total} bytes, above quota {self.quota_bytes}")
+
+            self.metrics['bytes_held'] = bytes_held
+            self.metrics['files_held'] = files_held
+            self.metrics['kept_referenced'] = kept_referenced
+            self.metrics['sweeps_total'] += 1
+            self.metrics['last_sweep_at'] = started
+            self.metrics['last_sweep_seconds'] = round(time.time() - started, 3)
+            logger.info(f"Retention sweep: {total} bytes held in {sum(files_held.values())} items "
+                        f"({self.metrics['last_sweep_seconds']}s)")
+            return self.snapshot()
+
+    def snapshot(self):
+        """Bản sao số liệu hiện tại"""
+        return {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in self.metrics.items()
+        }
+
+
+# Global manager instance
+_manager_instance = None
+_sweeper_task = None
+
+
+def get_retention_manager():
+    """Get singleton retention manager"""
+    global _manager_instance
+    if _manager_instance is None:
+        _manager_instance = RetentionManager()
+    return _manager_instance
+
+
+def retention_gauges():
+    """Gauge cho /metrics: byte đang giữ và đã thu hồi theo loại artifact"""
+    snapshot = get_retention_manager().snapshot()
+    gauges = []
+    for class_name, value in snapshot['bytes_held'].items():
+        gauges.append(('artifact_bytes_held', 'Dung lượng artifact đang giữ theo loại',
+                       {'class': class_name}, value))
+    for class_name, value in snapshot['bytes_reclaimed_total'].items():
+        gauges.append(('artifact_bytes_reclaimed_total', 'Tổng byte đã thu hồi theo loại',
+                       {'class': class_name}, value))
+    gauges.append(('artifact_quota_bytes', 'Quota dung lượng artifact (0 = không giới hạn)',
+                   {}, snapshot['quota_bytes']))
+    return gauges
+
+
+async def _sweep_forever(interval):
+    manager = get_retention_manager()
+    while True:
+        try:
+            await run_in_threadpool(manager.sweep)
+        except Exception as e:
+            manager.metrics['sweep_errors_total'] += 1
+            logger.error(f"Retention sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_retention_sweeper(interval=RETENTION_SWEEP_INTERVAL_SECONDS):
+    """Chạy sweeper nền trên event loop hiện tại (gọi lúc startup)"""
+    global _sweeper_task
+    if _sweeper_task is None and interval > 0:
+        _sweeper_task = asyncio.get_running_loop().create_task(_sweep_forever(interval))
+    return _sweeper_task
+
+
+def stop_retention_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        _sweeper_task = None
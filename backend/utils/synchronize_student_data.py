@@ -1,3 +1,8 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 def synchronize_student_data(student, df_part):
     """
     Đồng bộ dữ liệu student dựa trên df_part.
@@ -45,8 +50,8 @@ def synchronize_student_data(student, df_part):
             student['name'] = row['full_name']
             student['index_student'] = row['STT']
             student['has_issue'] = False
-            print(
-                f"Synchronized student (2+ matches): id={student['id']}, name={student['name']}, index_student={student['index_student']}")
+            logger.debug("Synchronized student (2+ matches): id=%s, name=%s, index_student=%s",
+                         student['id'], student['name'], student['index_student'])
         else:
             # Trường hợp 2: Không có hàng nào khớp 2 thuộc tính, lấy id làm chính
             if id_student != 'N/A':
@@ -57,16 +62,16 @@ def synchronize_student_data(student, df_part):
                     student['name'] = row['full_name']
                     student['index_student'] = row['STT']
                     student['has_issue'] = False
-                    print(
-                        f"Synchronized student (by id): id={student['id']}, name={student['name']}, index_student={student['index_student']}")
+                    logger.debug("Synchronized student (by id): id=%s, name=%s, index_student=%s",
+                                 student['id'], student['name'], student['index_student'])
                 else:
                     # Không tìm thấy id, giữ nguyên và đánh dấu has_issue
                     student['has_issue'] = True
-                    print(f"No matching row for id={id_student}, keeping original values")
+                    logger.info("No matching row for id=%s, keeping original values", id_student)
             else:
                 # Không có id hợp lệ, giữ nguyên và đánh dấu has_issue
                 student['has_issue'] = True
-                print(f"No valid id for student, keeping original values")
+                logger.info("No valid id for student, keeping original values")
 
         # Xóa cột tạm
         if 'full_name' in df_part:
@@ -74,7 +79,7 @@ def synchronize_student_data(student, df_part):
 
         return student
     except Exception as e:
-        print(f"Error synchronizing student data: {e}")
+        logger.error("Error synchronizing student data: %s", e)
         student['has_issue'] = True
         return student
 
@@ -0,0 +1,130 @@
+"""
+Tesseract OCR chạy trong process qua C API (tesserocr)
+
+Mỗi worker thread giữ một engine Tesseract đã khởi tạo sẵn cho từng cấu hình
+(ngôn ngữ, page segmentation mode, whitelist), nhận trực tiếp mảng NumPy nên
+không phải spawn process `tesseract` và ghi file tạm cho mỗi bài thi như
+pytesseract. Nếu chưa cài tesserocr thì tự động fallback về pytesseract (mỗi
+lần nhận diện vẫn spawn một process) và check_tesseract_backend() cảnh báo một
+lần khi server khởi động.
+
+Cài tesserocr cần thư viện Tesseract hệ thống lúc build:
+- Debian/Ubuntu: apt install libtesseract-dev libleptonica-dev tesseract-ocr-eng
+- macOS: brew install tesseract
+- Windows: dùng wheel dựng sẵn (vd. conda install -c conda-forge tesserocr)
+"""
+
+import logging
+import threading
+from typing import List, Optional, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# tesserocr là dependency tùy chọn (cần libtesseract lúc build)
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    tesserocr = None
+    TESSEROCR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DIGITS_WHITELIST = '0123456789'
+TESSERACT_BACKENDS = ('tesserocr', 'pytesseract')
+PSM_AUTO = 3
+PSM_SINGLE_BLOCK = 6
+
+ImageInput = Union[np.ndarray, Image.Image]
+
+
+class TesseractEngine:
+    """Một engine Tesseract thường trú với cấu hình cố định"""
+
+    def __init__(self, lang: str = 'eng', psm: int = PSM_AUTO, whitelist: Optional[str] = None,
+                 backend: Optional[str] = None):
+        """backend: 'tesserocr' | 'pytesseract'; None = tesserocr nếu đã cài"""
+        if backend is None:
+            backend = 'tesserocr' if TESSEROCR_AVAILABLE else 'pytesseract'
+        if backend not in TESSERACT_BACKENDS:
+            raise ValueError(f"backend phải là một trong {TESSERACT_BACKENDS}, nhận được: {backend}")
+        if backend == 'tesserocr' and not TESSEROCR_AVAILABLE:
+            raise RuntimeError("tesserocr chưa được cài đặt")
+
+        self.lang = lang
+        self.psm = psm
+        self.whitelist = whitelist
+        self.backend = backend
+        self._api = None
+
+        if backend == 'tesserocr':
+            self._api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+            if whitelist:
+                self._api.SetVariable('tessedit_char_whitelist', whitelist)
+            logger.info(f"Initialized resident Tesseract engine (lang={lang}, psm={psm})")
+
+    def _pytesseract_config(self) -> str:
+        config = f"--psm {self.psm}"
+        if self.whitelist:
+            config += f" -c tessedit_char_whitelist={self.whitelist}"
+        return config
+
+    def recognize(self, image: ImageInput) -> str:
+        """Nhận diện text từ ảnh NumPy (gray/BGR, như cv2.imread) hoặc PIL (RGB)"""
+        if not isinstance(image, Image.Image) and image.ndim == 3:
+            # Cả hai backend đọc ndarray như RGB
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        if self._api is None:
+            import pytesseract
+            return pytesseract.image_to_string(image, lang=self.lang, config=self._pytesseract_config())
+
+        if isinstance(image, Image.Image):
+            self._api.SetImage(image)
+        else:
+            image = np.ascontiguousarray(image)
+            height, width = image.shape[:2]
+            bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+            self._api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+        return self._api.GetUTF8Text()
+
+    def recognize_batch(self, images: List[ImageInput]) -> List[str]:
+        """Nhận diện lần lượt nhiều ảnh trên cùng một engine đã khởi tạo"""
+        return [self.recognize(image) for image in images]
+
+    def close(self):
+        if self._api is not None:
+            self._api.End()
+            self._api = None
+
+
+def check_tesseract_backend() -> str:
+    """Gọi một lần khi startup: cảnh báo nếu đang fallback về pytesseract"""
+    if TESSEROCR_AVAILABLE:
+        logger.info("Tesseract OCR backend: tesserocr (in-process)")
+        return 'tesserocr'
+    logger.warning("tesserocr not installed: Tesseract OCR falls back to pytesseract and spawns a "
+                   "tesseract process per call. Install libtesseract + tesserocr to remove this cost.")
+    return 'pytesseract'
+
+
+# Engine không thread-safe nên mỗi worker thread giữ bộ engine riêng
+_local = threading.local()
+
+
+def get_tesseract_engine(lang: str = 'eng', psm: int = PSM_AUTO, whitelist: Optional[str] = None) -> TesseractEngine:
+    """Get engine thường trú của thread hiện tại cho cấu hình cho trước"""
+    engines = getattr(_local, 'engines', None)
+    if engines is None:
+        engines = _local.engines = {}
+    key = (lang, psm, whitelist)
+    if key not in engines:
+        engines[key] = TesseractEngine(lang=lang, psm=psm, whitelist=whitelist)
+    return engines[key]
+
+
+def get_digits_engine() -> TesseractEngine:
+    """Engine cấu hình sẵn cho ô mã đề: một khối text, chỉ nhận chữ số"""
+    return get_tesseract_engine(lang='eng', psm=PSM_SINGLE_BLOCK, whitelist=DIGITS_WHITELIST)
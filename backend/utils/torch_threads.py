@@ -0,0 +1,49 @@
+"""
+Chính sách số luồng của torch cho cả process
+
+Số luồng intra-op / inter-op của torch là thiết lập toàn process: nó áp dụng
+cho TrOCR, YOLO (ultralytics) và EasyOCR cùng lúc. Vì vậy chỉ đặt ở một chỗ,
+gọi tường minh khi server khởi động, và chỉ khi biến môi trường được cấu hình;
+nếu không, torch giữ mặc định của nó.
+
+- TORCH_INTRA_OP_THREADS: số luồng cho một phép toán (torch.set_num_threads)
+- TORCH_INTER_OP_THREADS: số luồng chạy song song các phép toán độc lập
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+TORCH_INTRA_OP_THREADS = int(os.environ.get('TORCH_INTRA_OP_THREADS', 0))
+TORCH_INTER_OP_THREADS = int(os.environ.get('TORCH_INTER_OP_THREADS', 0))
+
+
+def configure_torch_threads(intra_op_threads=TORCH_INTRA_OP_THREADS, inter_op_threads=TORCH_INTER_OP_THREADS):
+    """
+    Đặt số luồng intra-op / inter-op cho torch (0 = giữ mặc định).
+
+    set_num_interop_threads chỉ gọi được trước khi torch chạy tác vụ song song
+    đầu tiên, nên phải gọi lúc startup; lỗi RuntimeError ở lần gọi sau được bỏ qua.
+
+    Returns:
+        bool: True nếu có thiết lập được áp dụng.
+    """
+    if not intra_op_threads and not inter_op_threads:
+        return False
+    try:
+        import torch
+    except ImportError:
+        return False
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            logger.warning("torch inter-op threads already initialized, keeping %d",
+                           torch.get_num_interop_threads())
+    logger.info("torch threads: intra-op=%d, inter-op=%d",
+                torch.get_num_threads(), torch.get_num_interop_threads())
+    return True
@@ -0,0 +1,138 @@
+"""
+Ghi file upload xuống đĩa theo từng chunk
+
+Mỗi file được copy từ UploadFile sang file tạm theo chunk cố định, tính SHA-256
+trong lúc copy, kiểm tra giới hạn kích thước ngay khi vượt và đổi tên nguyên tử
+sang đường dẫn đích. Bộ nhớ dùng cho mỗi request không phụ thuộc kích thước ảnh.
+
+Giới hạn: Starlette đã đọc (spool) toàn bộ body multipart vào file tạm của nó
+trước khi handler chạy, nên MAX_IMAGE_BYTES / UploadBudget chỉ giới hạn những
+gì được ghi vào uploads/, không giới hạn dung lượng spool. Dung lượng đĩa của
+một request được chặn trước đó bởi middleware Content-Length trong app.py
+(MAX_UPLOAD_REQUEST_BYTES); request chunked không có Content-Length thì không.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from utils.job_workspace import content_addressed_name
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 25 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get('MAX_UPLOAD_REQUEST_BYTES', 1024 * 1024 * 1024))
+UPLOAD_WRITE_CONCURRENCY = int(os.environ.get('UPLOAD_WRITE_CONCURRENCY', 8))
+
+
+class UploadTooLarge(Exception):
+    """File hoặc request vượt quá giới hạn kích thước cho phép"""
+
+
+class UploadBudget:
+    """Tổng số byte còn được phép ghi cho một request"""
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def consume(self, size: int):
+        self.used += size
+        if self.used > self.max_bytes:
+            raise UploadTooLarge(f"Request vượt quá giới hạn {self.max_bytes} bytes")
+
+
+async def save_upload_stream(upload: UploadFile, dest_path: str, max_bytes: int = MAX_IMAGE_BYTES,
+                             budget: UploadBudget = None, content_addressed: bool = False) -> dict:
+    """
+    Copy UploadFile xuống dest_path theo chunk.
+
+    Nếu content_addressed=True, file được lưu trong thư mục của dest_path với tên
+    <hash nội dung>_<tên file>, nên các ảnh trùng tên từ nhiều phòng thi không đè nhau;
+    nếu file đó đã có (cùng nội dung) thì giữ nguyên file cũ.
+
+    Returns:
+        dict: {'path', 'filename', 'size', 'sha256', 'created'} - created=False khi
+        đường dẫn đích đã tồn tại trước lần ghi này (không được xóa khi rollback).
+
+    Raises:
+        UploadTooLarge: Khi file vượt max_bytes hoặc request vượt budget (file tạm bị xóa).
+    """
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    f = await run_in_threadpool(open, tmp_path, 'wb')
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File {upload.filename} vượt quá giới hạn {max_bytes} bytes")
+            if budget is not None:
+                budget.consume(len(chunk))
+            digest.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+        await run_in_threadpool(f.close)
+        if content_addressed:
+            dest_path = os.path.join(os.path.dirname(dest_path),
+                                     content_addressed_name(digest.hexdigest(), os.path.basename(dest_path)))
+        created = not os.path.exists(dest_path)
+        if created or not content_addressed:
+            await run_in_threadpool(os.replace, tmp_path, dest_path)
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if os.path.exists(tmp_path):
+        # Cùng nội dung với file đã có: không ghi đè file có thể đang được đọc
+        os.remove(tmp_path)
+
+    return {'path': dest_path, 'filename': os.path.basename(dest_path), 'size': size,
+            'sha256': digest.hexdigest(), 'created': created}
+
+
+async def save_uploads_concurrently(uploads, dest_path_for, max_bytes: int = MAX_IMAGE_BYTES,
+                                    budget: UploadBudget = None, on_saved=None, content_addressed: bool = False):
+    """
+    Ghi nhiều UploadFile song song (tối đa UPLOAD_WRITE_CONCURRENCY file cùng lúc).
+
+    Args:
+        uploads: Danh sách UploadFile.
+        dest_path_for: Hàm (upload) -> đường dẫn đích.
+        on_saved: Hàm (upload, result) gọi ngay khi từng file ghi xong.
+
+    Returns:
+        list: Mỗi phần tử là dict của save_upload_stream hoặc exception của file đó,
+        theo đúng thứ tự uploads. Nếu vượt budget thì UploadTooLarge được raise lên
+        sau khi xóa các file do chính lần gọi này tạo ra; file đã có từ trước và
+        file đã giao cho on_saved (có thể đang được xử lý) được giữ lại.
+    """
+    semaphore = asyncio.Semaphore(UPLOAD_WRITE_CONCURRENCY)
+
+    async def save_one(upload):
+        async with semaphore:
+            result = await save_upload_stream(upload, dest_path_for(upload), max_bytes, budget, content_addressed)
+        if on_saved is not None:
+            on_saved(upload, result)
+            result['handed_off'] = True
+        return result
+
+    results = await asyncio.gather(*(save_one(upload) for upload in uploads), return_exceptions=True)
+    if budget is not None and budget.used > budget.max_bytes:
+        for result in results:
+            if isinstance(result, dict) and result['created'] and not result.get('handed_off') \
+                    and os.path.exists(result['path']):
+                os.remove(result['path'])
+        raise UploadTooLarge(f"Request vượt quá giới hạn {budget.max_bytes} bytes")
+    return results
@@ -0,0 +1,266 @@
+"""
+ONNX Runtime backend cho model YOLO chấm phiếu trả lời.
+
+Export model .pt sang ONNX một lần (cache cạnh file trọng số), chạy inference
+bằng ONNX Runtime trên CPU và giải mã box + NMS để trả về đúng các mảng
+boxes / cls / conf mà phần hậu xử lý của predict_grade đang dùng.
+
+Input của model: tensor float32 (N, 3, imgsz, imgsz), RGB, giá trị 0..1.
+Ảnh luôn được letterbox về đúng hình vuông imgsz x imgsz (imgsz lấy từ metadata
+lúc export, mặc định 640) như ultralytics khi predict. File được export với
+dynamic=True chỉ để N (số ảnh trong lô của predict_batch) thay đổi được;
+chiều H / W trong graph cũng là symbolic nhưng backend không bao giờ đưa vào
+kích thước khác imgsz.
+"""
+
+import ast
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# onnxruntime là dependency tùy chọn, chỉ cần khi chọn backend 'onnx'
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ort = None
+    ONNXRUNTIME_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMGSZ = 640
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7  # Giống mặc định của ultralytics predict
+MAX_DETECTIONS = 300
+# Offset theo class để NMS từng class trong một lần gọi (giống ultralytics)
+MAX_WH = 7680
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+
+
+def onnx_path_for(model_path: str) -> str:
+    """Đường dẫn file ONNX cache nằm cạnh file trọng số .pt"""
+    return os.path.splitext(model_path)[0] + '.onnx'
+
+
+def export_onnx(model_path: str, imgsz: int = DEFAULT_IMGSZ) -> str:
+    """
+    Export model YOLO sang ONNX nếu chưa có bản cache mới hơn file .pt.
+    dynamic=True để batch N thay đổi được (ultralytics không cho chỉ batch động);
+    kích thước ảnh đưa vào luôn là imgsz x imgsz.
+
+    Returns:
+        str: Đường dẫn file .onnx
+    """
+    onnx_path = onnx_path_for(model_path)
+    if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(model_path):
+        return onnx_path
+
+    from ultralytics import YOLO
+
+    logger.info(f"Exporting {model_path} to ONNX (imgsz={imgsz})")
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True)
+    if os.path.abspath(exported) != os.path.abspath(onnx_path):
+        os.replace(exported, onnx_path)
+    return onnx_path
+
+
+def letterbox(image: np.ndarray, imgsz: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """Resize giữ tỉ lệ và pad về hình vuông imgsz x imgsz (pad màu 114)"""
+    h, w = image.shape[:2]
+    ratio = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_w, pad_h = (imgsz - new_w) / 2, (imgsz - new_h) / 2
+
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+    left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, ratio, (left, top)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Non-maximum suppression trên box xyxy, trả về chỉ số giữ lại theo thứ tự score giảm dần"""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+
+def decode_predictions(pred: np.ndarray, conf: float, iou: float, ratio: float,
+                       pad: Tuple[float, float], orig_shape: Tuple[int, int]):
+    """
+    Giải mã output YOLOv8 (4 + nc, N) của một ảnh thành boxes xyxy, cls, conf
+    theo tọa độ ảnh gốc.
+    """
+    pred = pred.T  # (N, 4 + nc)
+    class_scores = pred[:, 4:]
+    cls_ids = class_scores.argmax(axis=1)
+    confidences = class_scores[np.arange(len(pred)), cls_ids]
+    mask = confidences > conf
+    if not mask.any():
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+
+    xywh, cls_ids, confidences = pred[mask, :4], cls_ids[mask], confidences[mask]
+    boxes = np.empty_like(xywh)
+    boxes[:, 0] = xywh[:, 0] - xywh[:, 2] / 2
+    boxes[:, 1] = xywh[:, 1] - xywh[:, 3] / 2
+    boxes[:, 2] = xywh[:, 0] + xywh[:, 2] / 2
+    boxes[:, 3] = xywh[:, 1] + xywh[:, 3] / 2
+
+    keep = nms(boxes + (cls_ids * MAX_WH)[:, None], confidences, iou)[:MAX_DETECTIONS]
+    boxes, cls_ids, confidences = boxes[keep], cls_ids[keep], confidences[keep]
+
+    # Bỏ padding và scale về kích thước ảnh gốc
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+    return boxes.astype(np.float32), cls_ids.astype(int), confidences.astype(np.float32)
+
+
+class YoloOnnxBackend:
+    """Chạy model YOLO đã export ONNX bằng ONNX Runtime (CPUExecutionProvider)"""
+
+    def __init__(self, model_path: str, imgsz: int = DEFAULT_IMGSZ):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime chưa được cài đặt, không thể dùng backend 'onnx'")
+
+        self.onnx_path = export_onnx(model_path, imgsz)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        if 'imgsz' in metadata:
+            imgsz = max(ast.literal_eval(metadata['imgsz']))
+        self.imgsz = imgsz
+        self.input_shape = check_input_shape(self.session.get_inputs()[0].shape, imgsz)
+
+    def predict(self, image: np.ndarray, conf: float = DEFAULT_CONF, iou: float = DEFAULT_IOU):
+        """Dự đoán một ảnh BGR, trả về (boxes, cls_ids, confidences, names)"""
+        return self.predict_batch([image], conf, iou)[0]
+
+    def predict_batch(self, images: List[np.ndarray], conf: float = DEFAULT_CONF, iou: float = DEFAULT_IOU):
+        """
+        Dự đoán một lô ảnh BGR trong một lần chạy session.
+
+        Returns:
+            list: Mỗi phần tử là (boxes, cls_ids, confidences, names) cho từng ảnh.
+        """
+        if not images:
+            return []
+
+        batch, metas = [], []
+        for image in images:
+            padded, ratio, pad = letterbox(image, self.imgsz)
+            blob = cv2.cvtColor(padded, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)
+            batch.append(blob)
+            metas.append((ratio, pad, image.shape[:2]))
+
+        tensor = np.ascontiguousarray(np.stack(batch), dtype=np.float32) / 255.0
+        output = self.session.run(None, {self.input_name: tensor})[0]
+
+        results = []
+        for pred, (ratio, pad, shape) in zip(output, metas):
+            boxes, cls_ids, confidences = decode_predictions(pred, conf, iou, ratio, pad, shape)
+            results.append((boxes, cls_ids, confidences, self.names))
+        return results
+
+
+def check_input_shape(shape, imgsz: int) -> Tuple[int, int, int, int]:
+    """
+    Kiểm tra shape input của graph khớp (N, 3, imgsz, imgsz); chiều symbolic
+    (str / None) được chấp nhận. Raise ValueError nếu không khớp.
+
+    Returns:
+        tuple: Shape input mà backend sẽ đưa vào với một ảnh (1, 3, imgsz, imgsz).
+    """
+    if len(shape) != 4:
+        raise ValueError(f"Input ONNX phải có 4 chiều (N, 3, H, W), nhận được: {shape}")
+    expected = (None, 3, imgsz, imgsz)
+    for dim, want in zip(shape, expected):
+        if want is not None and isinstance(dim, int) and dim != want:
+            raise ValueError(f"Input ONNX {shape} không khớp (N, 3, {imgsz}, {imgsz})")
+    return 1, 3, imgsz, imgsz
+
+
+_backends: Dict[str, YoloOnnxBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_onnx_backend(model_path: str) -> YoloOnnxBackend:
+    """Get singleton ONNX backend cho mỗi file trọng số"""
+    with _backends_lock:
+        if model_path not in _backends:
+            _backends[model_path] = YoloOnnxBackend(model_path)
+        return _backends[model_path]
+
+
+def check_backend_parity(image_path: str, model_path: str, iou_threshold: float = 0.9) -> Optional[dict]:
+    """
+    So sánh kết quả backend ONNX với backend PyTorch (ultralytics) trên một ảnh.
+
+    Mỗi box của PyTorch được ghép với box ONNX có IoU cao nhất; cặp được tính
+    là khớp khi IoU >= iou_threshold và cùng class.
+
+    Returns:
+        dict: Số box mỗi backend, số box khớp, sai lệch confidence lớn nhất.
+    """
+    from utils.detectGrade import run_yolo
+
+    image = cv2.imread(image_path)
+    if image is None:
+        logger.error(f"Không thể đọc ảnh: {image_path}")
+        return None
+
+    pt_boxes, pt_cls, pt_conf, _ = run_yolo(image, model_path, backend='pytorch')
+    ox_boxes, ox_cls, ox_conf, _ = run_yolo(image, model_path, backend='onnx')
+
+    matched = 0
+    max_conf_diff = 0.0
+    for box, cls_id, confidence in zip(pt_boxes, pt_cls, pt_conf):
+        if len(ox_boxes) == 0:
+            break
+        xx1 = np.maximum(box[0], ox_boxes[:, 0])
+        yy1 = np.maximum(box[1], ox_boxes[:, 1])
+        xx2 = np.minimum(box[2], ox_boxes[:, 2])
+        yy2 = np.minimum(box[3], ox_boxes[:, 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        union = ((box[2] - box[0]) * (box[3] - box[1])
+                 + (ox_boxes[:, 2] - ox_boxes[:, 0]) * (ox_boxes[:, 3] - ox_boxes[:, 1]) - inter)
+        ious = inter / (union + 1e-9)
+        best = int(ious.argmax())
+        if ious[best] >= iou_threshold and ox_cls[best] == cls_id:
+            matched += 1
+            max_conf_diff = max(max_conf_diff, float(abs(ox_conf[best] - confidence)))
+
+    return {
+        'pytorch_boxes': len(pt_boxes),
+        'onnx_boxes': len(ox_boxes),
+        'matched': matched,
+        'max_conf_diff': max_conf_diff,
+        'parity': matched == len(pt_boxes) == len(ox_boxes),
+        'pytorch_labels': sorted(int(c) for c in pt_cls),
+        'onnx_labels': sorted(int(c) for c in ox_cls),
+    }